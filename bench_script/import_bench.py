@@ -0,0 +1,91 @@
+"""
+worker冷启动的耗时：在子进程中用-X importtime导入server.main，对比SERVER_MODE=full和api
+每种模式输出导入的总耗时、按顶层包汇总的耗时和累计耗时最多的模块
+python -m bench_script.import_bench [--repeat 5] [--top 15] [--json result.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 导入server.main的同时会执行django.setup()，打印的耗时包括Django加载app
+IMPORT_CODE = "import time; start = time.perf_counter(); import server.main; print(time.perf_counter() - start)"
+
+
+def import_once(mode: str):
+    """
+    :return: (导入server.main的耗时（毫秒）, [(模块, 自身耗时us, 累计耗时us, 嵌套深度)])
+    """
+    env = dict(os.environ, EECS_SERVER_MODE=mode)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_CODE],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return float(result.stdout.strip().splitlines()[-1]) * 1000, modules
+
+
+def measure(mode: str, repeat: int, top: int) -> dict:
+    wall = []
+    for _ in range(repeat):
+        elapsed, modules = import_once(mode)
+        wall.append(elapsed)
+    # 各次的模块耗时差别不大，用最后一次（文件缓存已经预热）的明细
+    packages = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        packages[name.split(".")[0]] += self_us
+    by_cumulative = sorted(modules, key=lambda each: each[2], reverse=True)
+    return {
+        "median_ms": round(statistics.median(wall), 2),
+        "min_ms": round(min(wall), 2),
+        "module_count": len(modules),
+        "import_self_ms": round(sum(each[1] for each in modules) / 1000, 2),
+        "packages_ms": {
+            name: round(us / 1000, 2)
+            for name, us in sorted(packages.items(), key=lambda each: each[1], reverse=True)[:top]
+        },
+        "cumulative_ms": {name: round(cumulative_us / 1000, 2) for name, _, cumulative_us, _ in by_cumulative[:top]},
+    }
+
+
+def report(mode: str, result: dict):
+    print(f"===== SERVER_MODE={mode} =====")
+    print(f"import server.main: median {result['median_ms']} ms, min {result['min_ms']} ms, "
+          f"{result['module_count']} modules")
+    print("按顶层包汇总的自身耗时:")
+    for name, ms in result["packages_ms"].items():
+        print(f"    {name:32s} {ms:9.2f} ms")
+    print("累计耗时最多的模块:")
+    for name, ms in result["cumulative_ms"].items():
+        print(f"    {name:48s} {ms:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--mode", choices=("full", "api"), action="append", help="默认对比full和api")
+    parser.add_argument("--json", help="把结果写入json文件")
+    args = parser.parse_args()
+
+    results = {mode: measure(mode, args.repeat, args.top) for mode in args.mode or ("full", "api")}
+    for mode, result in results.items():
+        report(mode, result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+接口的负载测试：多个并发的async客户端请求server.main:app，统计每个场景的吞吐量和p50/p95/p99延迟
+默认在进程内直接调用ASGI应用，并在单独的测试数据库中按不同的数据量造数据；
+--url时请求已经启动的uvicorn，服务器需要与本脚本使用相同的配置（数据库），数据写在专用的用户下，结束后删除
+python -m bench_script.load_bench [--sizes 10 100 1000] [--requests 200] [--concurrency 16] [--json result.json]
+python -m bench_script.load_bench --url http://127.0.0.1:8001 [--scenarios majors point1]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import h11
+from django.contrib.auth.models import User as DjangoUser
+from django.db import connection, connections, transaction
+
+from djadmin.eecs.models import Major, Point1, Point2
+
+USERNAME = "loadbench"
+PASSWORD = "loadbench1234"
+# 创建接口使用的序号从这里开始，不与造的数据重复
+CREATE_INDEX_BASE = 1000000
+
+
+class ASGIClient:
+    """
+    在进程内调用ASGI应用，不经过网络
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, headers: List[Tuple[bytes, bytes]],
+                      body: bytes = b"") -> Tuple[int, bytes]:
+        path, _, query_string = path.partition("?")
+        scope = {
+            "type": "http", "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": query_string.encode(), "root_path": "",
+            "headers": [(b"host", b"loadbench")] + headers,
+            "server": ("loadbench", 80), "client": ("127.0.0.1", 50000),
+        }
+        finished = asyncio.Event()
+        status = 0
+        chunks = []
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status, b"".join(chunks)
+
+    async def close(self):
+        pass
+
+
+class HTTPClient:
+    """
+    一个keep-alive的HTTP/1.1连接，用h11解析（uvicorn的依赖）
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.reader = self.writer = self.conn = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.conn = h11.Connection(h11.CLIENT)
+
+    async def request(self, method: str, path: str, headers: List[Tuple[bytes, bytes]],
+                      body: bytes = b"") -> Tuple[int, bytes]:
+        if self.conn is None or self.conn.our_state is not h11.IDLE:
+            await self.close()
+            await self.connect()
+        headers = [(b"host", f"{self.host}:{self.port}".encode()), (b"content-length", str(len(body)).encode())] + headers
+        self.writer.write(self.conn.send(h11.Request(method=method, target=path, headers=headers)))
+        if body:
+            self.writer.write(self.conn.send(h11.Data(data=body)))
+        self.writer.write(self.conn.send(h11.EndOfMessage()))
+        await self.writer.drain()
+        status = 0
+        chunks = []
+        while True:
+            event = self.conn.next_event()
+            if event is h11.NEED_DATA:
+                self.conn.receive_data(await self.reader.read(65536))
+            elif isinstance(event, h11.Response):
+                status = event.status_code
+            elif isinstance(event, h11.Data):
+                chunks.append(event.data)
+            elif isinstance(event, (h11.EndOfMessage, h11.ConnectionClosed)):
+                break
+        if self.conn.our_state is h11.DONE and self.conn.their_state is h11.DONE:
+            self.conn.start_next_cycle()
+        return status, b"".join(chunks)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = self.conn = None
+
+
+class Scenario:
+    """
+    :param name: 场景名
+    :param method: 请求方法
+    :param make_path: 第i个请求的路径（含查询参数）
+    :param form: 第i个请求的表单，为None时没有请求体
+    :param auth: 是否带登录的token
+    """
+
+    def __init__(self, name: str, method: str, make_path: Callable[[int], str],
+                 form: Optional[Callable[[int], dict]] = None, auth: bool = True):
+        self.name = name
+        self.method = method
+        self.make_path = make_path
+        self.form = form
+        self.auth = auth
+
+
+def make_scenarios(ids: dict) -> Dict[str, Scenario]:
+    """
+    :param ids: major_id、point1_id、point2_id是要请求的条目，
+        point1_delete和point2_delete是创建场景写入的条目，在删除场景开始前由collect_created填充
+    """
+    major = "/api/major"
+    return {scenario.name: scenario for scenario in (
+        Scenario("login", "POST", lambda i: "/auth/token",
+                 form=lambda i: {"username": USERNAME, "password": PASSWORD}, auth=False),
+        Scenario("user_info", "GET", lambda i: "/auth/user/info"),
+        Scenario("majors", "GET", lambda i: f"{major}/majors"),
+        Scenario("point1", "GET", lambda i: f"{major}/point1?major_id={ids['major_id']}"),
+        Scenario("point2", "GET", lambda i: f"{major}/point2?point1_id={ids['point1_id']}"),
+        Scenario("point1_create", "POST", lambda i: f"{major}/point1/create?" + urlencode(
+            {"major_id": ids["major_id"], "index": CREATE_INDEX_BASE + i, "content": f"新的毕业要求{i}"})),
+        Scenario("point1_update", "POST", lambda i: f"{major}/point1/update/content?" + urlencode(
+            {"point1_id": ids["point1_id"], "content": f"修改后的毕业要求{i}"})),
+        Scenario("point1_delete", "POST", lambda i: f"{major}/point1/delete?point1_id={ids['point1_delete'][i]}"),
+        Scenario("point2_create", "POST", lambda i: f"{major}/point2/create?" + urlencode(
+            {"point1_id": ids["point1_id"], "index": CREATE_INDEX_BASE + i, "content": f"新的分解指标点{i}"})),
+        Scenario("point2_update", "POST", lambda i: f"{major}/point2/update/content?" + urlencode(
+            {"point2_id": ids["point2_id"], "content": f"修改后的分解指标点{i}"})),
+        Scenario("point2_delete", "POST", lambda i: f"{major}/point2/delete?point2_id={ids['point2_delete'][i]}"),
+    )}
+
+
+def seed(size: int) -> dict:
+    """
+    为USERNAME造数据：size个专业，第一个专业有size个毕业要求，第一个毕业要求有size个分解指标点，
+    其余的毕业要求各有一个分解指标点
+    :return: 场景中使用的条目id
+    """
+    cleanup()
+    user = DjangoUser.objects.get(username=USERNAME)
+    # sqlite的bulk_create不会回填主键，写入后重新查询
+    with transaction.atomic():
+        Major.objects.bulk_create([
+            Major(manager=user, code=f"bench{i:06d}", name=f"专业{i}") for i in range(size)
+        ])
+        majors = list(Major.objects.filter(manager=user).order_by("id"))
+        Point1.objects.bulk_create([
+            Point1(major=majors[0], index=i, content=f"毕业要求{i}") for i in range(size)
+        ])
+        point1_list = list(Point1.objects.filter(major=majors[0]).order_by("index"))
+        Point2.objects.bulk_create([
+            Point2(point1=point1_list[0], index=i, content=f"分解指标点{i}") for i in range(size)
+        ] + [
+            Point2(point1=point1, index=0, content="分解指标点") for point1 in point1_list[1:]
+        ], batch_size=2000)
+    return {
+        "major_id": majors[0].id,
+        "point1_id": point1_list[0].id,
+        "point2_id": Point2.objects.filter(point1=point1_list[0]).order_by("index").first().id,
+    }
+
+
+def collect_created(ids: dict) -> None:
+    """
+    把创建场景写入的条目作为删除场景的目标
+    """
+    ids["point1_delete"] = list(
+        Point1.objects.filter(major_id=ids["major_id"], index__gte=CREATE_INDEX_BASE).order_by("index")
+        .values_list("id", flat=True)
+    )
+    ids["point2_delete"] = list(
+        Point2.objects.filter(point1_id=ids["point1_id"], index__gte=CREATE_INDEX_BASE).order_by("index")
+        .values_list("id", flat=True)
+    )
+
+
+def cleanup() -> None:
+    user = DjangoUser.objects.filter(username=USERNAME).first()
+    if user is not None:
+        Point2.objects.filter(point1__major__manager=user).delete()
+        Point1.objects.filter(major__manager=user).delete()
+        Major.objects.filter(manager=user).delete()
+
+
+def percentile(latencies: List[float], p: float) -> float:
+    """
+    :param latencies: 已排序
+    """
+    return latencies[min(len(latencies) - 1, max(0, math.ceil(p / 100 * len(latencies)) - 1))]
+
+
+async def run_scenario(clients: list, scenario: Scenario, requests: int, token: str) -> dict:
+    """
+    len(clients)个并发的客户端共同发出requests个请求
+    """
+    headers = [(b"authorization", f"Bearer {token}".encode())] if scenario.auth else []
+    latencies, errors = [], 0
+    next_index = iter(range(requests))
+
+    async def worker(client):
+        nonlocal errors
+        for i in next_index:
+            body = b""
+            request_headers = headers
+            if scenario.form is not None:
+                body = urlencode(scenario.form(i)).encode()
+                request_headers = headers + [(b"content-type", b"application/x-www-form-urlencoded")]
+            start = time.perf_counter()
+            status, _ = await client.request(scenario.method, scenario.make_path(i), request_headers, body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            # 应用内的错误码（如40001）也以200返回，这里只统计HTTP错误
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "rps": round(requests / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+async def login(client) -> str:
+    status, body = await client.request(
+        "POST", "/auth/token", [(b"content-type", b"application/x-www-form-urlencoded")],
+        urlencode({"username": USERNAME, "password": PASSWORD}).encode()
+    )
+    assert status == 200, f"登录失败：{status} {body[:200]!r}"
+    return json.loads(body)["auth_token"]
+
+
+async def close_thread_connections() -> None:
+    """
+    Django的连接是每个线程一个，删除测试数据库之前（PostgreSQL上有连接时不能删除），
+    在默认线程池和加载用户的线程池的每个线程中关闭连接
+    """
+    from config import Config
+    from server.auth.login import manager
+    loop = asyncio.get_event_loop()
+    pools = [(None, Config.DB_MAX_CONNECTIONS)]
+    if getattr(manager, "executor", None) is not None:
+        pools.append((manager.executor, Config.AUTH_EXECUTOR_WORKERS))
+    for executor, workers in pools:
+        # 所有任务都等在barrier上，保证每个线程各执行一次
+        barrier = threading.Barrier(workers)
+
+        def close():
+            connections.close_all()
+            barrier.wait(timeout=10)
+
+        await asyncio.gather(*(loop.run_in_executor(executor, close) for _ in range(workers)))
+
+
+async def run_size(clients: list, size: int, names: List[str], requests: int) -> dict:
+    # Django的ORM不能在事件循环中直接调用
+    loop = asyncio.get_event_loop()
+    ids = await loop.run_in_executor(None, seed, size)
+    scenarios = make_scenarios(ids)
+    token = await login(clients[0])
+    results = {}
+    for name in names:
+        if name.endswith("_delete"):
+            await loop.run_in_executor(None, collect_created, ids)
+            count = len(ids[name])
+            if count == 0:
+                print(f"{name}: 没有可删除的条目，先运行{name.replace('_delete', '_create')}")
+                continue
+        else:
+            count = requests
+        # 预热：登录用户、专业负责人等缓存
+        if not name.endswith(("_create", "_delete")):
+            await run_scenario(clients[:1], scenarios[name], min(count, 10), token)
+        each = results[name] = await run_scenario(clients, scenarios[name], count, token)
+        print(f"{size:7d} {name:14s} {each['rps']:9.1f} {each['p50_ms']:9.3f} {each['p95_ms']:9.3f} "
+              f"{each['p99_ms']:9.3f} {each['errors']:6d}")
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    if args.url:
+        clients = [HTTPClient(args.url) for _ in range(args.concurrency)]
+    else:
+        from server import main
+        # 与启动时相同的密码进程池、后台同步和默认线程池，不初始化tortoise-orm（场景中没有async接口）
+        await main.start_password_verifier()
+        main.start_background_sync()
+        main.limit_db_connections()
+        clients = [ASGIClient(main.app)] * args.concurrency
+
+    print(f"{'size':>7s} {'scenario':14s} {'req/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'errors':>6s}")
+    results = {}
+    try:
+        for size in args.sizes:
+            results[str(size)] = await run_size(clients, size, args.scenarios, args.requests)
+    finally:
+        for client in clients:
+            await client.close()
+        if not args.url:
+            main.shutdown_password_verifier()
+            await close_thread_connections()
+    return results
+
+
+@contextmanager
+def bench_database(use_test_db: bool = True):
+    """
+    在单独的测试数据库中（或者在当前配置的数据库中USERNAME用户下）运行，结束后删除数据
+    """
+    test_db = None
+    if use_test_db:
+        test_db = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # 文件数据库：内存数据库在多个线程的连接之间共享缓存，写入时整表加锁
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "load_bench.sqlite3")
+        connection.creation.create_test_db(verbosity=0, serialize=False)
+    created_user = False
+    try:
+        if not DjangoUser.objects.filter(username=USERNAME).exists():
+            DjangoUser.objects.create_user(USERNAME, password=PASSWORD)
+            created_user = True
+        yield
+    finally:
+        if test_db is not None:
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+        else:
+            cleanup()
+            if created_user:
+                DjangoUser.objects.filter(username=USERNAME).delete()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="请求已经启动的服务器，例如http://127.0.0.1:8001，默认在进程内调用")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="每个列表的条目数")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发的客户端数")
+    parser.add_argument("--scenarios", nargs="+", default=list(make_scenarios({})), choices=list(make_scenarios({})),
+                        help="删除场景删除的是创建场景写入的条目，需要一起运行")
+    parser.add_argument("--json", help="把结果写入json文件")
+    args = parser.parse_args()
+
+    with bench_database(use_test_db=not args.url):
+        results = asyncio.run(run(args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "target": args.url or "asgi",
+                "concurrency": args.concurrency,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
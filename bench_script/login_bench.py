@@ -0,0 +1,120 @@
+"""
+登录风暴对接口的影响：并发登录的同时请求/api/major/majors，对比在默认线程池中校验密码和在进程池中校验密码，
+统计登录的吞吐量、被拒绝（503）的次数，以及接口在登录压力下的延迟
+python -m bench_script.login_bench [--logins 32] [--api 8] [--seconds 5] [--workers 2] [--json result.json]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bench_script.load_bench import (
+    PASSWORD, USERNAME, ASGIClient, bench_database, close_thread_connections, git_commit, percentile, seed
+)
+from server.auth import login as login_module
+from server.password import PasswordVerifier
+
+
+def summarize(latencies: list, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0, "rps": 0}
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+async def contend(client: ASGIClient, token: str, logins: int, api: int, seconds: float) -> dict:
+    """
+    logins个客户端不断登录，同时api个客户端不断请求接口，持续seconds秒
+    """
+    form = f"username={USERNAME}&password={PASSWORD}".encode()
+    login_headers = [(b"content-type", b"application/x-www-form-urlencoded")]
+    api_headers = [(b"authorization", f"Bearer {token}".encode())]
+    login_latencies, api_latencies = [], []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def login_worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = await client.request("POST", "/auth/token", login_headers, form)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                login_latencies.append((time.perf_counter() - start) * 1000)
+            elif status == 503:
+                # 客户端按Retry-After退避，这里短暂等待，避免空转
+                await asyncio.sleep(0.05)
+
+    async def api_worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = await client.request("GET", "/api/major/majors", api_headers)
+            assert status == 200, status
+            api_latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[login_worker() for _ in range(logins)], *[api_worker() for _ in range(api)])
+    elapsed = time.perf_counter() - start
+    return {
+        "login": {**summarize(login_latencies, elapsed), "statuses": {str(k): v for k, v in sorted(statuses.items())}},
+        "api": summarize(api_latencies, elapsed),
+    }
+
+
+async def run(args) -> dict:
+    from server import main
+    modes = {
+        "threadpool": PasswordVerifier(0),
+        "process": PasswordVerifier(args.workers, args.queue, args.timeout),
+    }
+    # 与应用启动时相同，在创建线程之前启动进程池
+    for verifier in modes.values():
+        await verifier.start()
+    main.start_background_sync()
+    main.limit_db_connections()
+    client = ASGIClient(main.app)
+    await asyncio.get_event_loop().run_in_executor(None, seed, 10)
+    token = login_module.manager.create_access_token(data=dict(sub=USERNAME))
+
+    results = {"idle": await contend(client, token, 0, args.api, args.seconds)}
+    print(f"{'mode':10s} {'login/s':>8s} {'login p99':>10s} {'503':>6s} {'api/s':>8s} {'api p50':>9s} {'api p99':>9s}")
+    try:
+        for name, verifier in modes.items():
+            login_module.password_verifier = verifier
+            results[name] = await contend(client, token, args.logins, args.api, args.seconds)
+    finally:
+        for verifier in modes.values():
+            verifier.shutdown()
+        await close_thread_connections()
+    for name, each in results.items():
+        login = each["login"]
+        print(f"{name:10s} {login['rps']:8.1f} {login.get('p99_ms', 0):10.1f} {login['statuses'].get('503', 0):6d} "
+              f"{each['api']['rps']:8.1f} {each['api']['p50_ms']:9.2f} {each['api']['p99_ms']:9.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=32, help="并发登录的客户端数")
+    parser.add_argument("--api", type=int, default=8, help="同时请求接口的客户端数")
+    parser.add_argument("--seconds", type=float, default=5, help="每种模式的持续时间")
+    parser.add_argument("--workers", type=int, default=2, help="校验密码的进程数")
+    parser.add_argument("--queue", type=int, default=32, help="进程都忙时最多排队的登录请求数")
+    parser.add_argument("--timeout", type=float, default=5, help="排队的最长时间（秒）")
+    parser.add_argument("--json", help="把结果写入json文件")
+    args = parser.parse_args()
+
+    with bench_database():
+        results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+major.py中各个接口查询的执行计划和耗时，对比(major, index)/(point1, index)复合索引迁移前后
+在单独的测试数据库中造数据，不影响开发数据库
+python -m bench_script.query_bench [--majors 200] [--point1 20] [--point2 10] [--repeat 50] [--json result.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User as DjangoUser
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+from djadmin.eecs.models import Major, Point1, Point2
+
+BEFORE = '0006_merge_20261018_1619'
+AFTER = '0007_point1_point2_unique_index'
+
+
+def seed(majors: int, point1_per_major: int, point2_per_point1: int):
+    """
+    造数据，index全局唯一，这样迁移前的全局唯一约束和迁移后的复合唯一约束都成立
+    """
+    # sqlite的bulk_create不会回填主键，写入后重新查询
+    with transaction.atomic():
+        DjangoUser.objects.bulk_create(
+            [DjangoUser(username=f"bench{i}") for i in range(max(1, majors // 10))]
+        )
+        users = list(DjangoUser.objects.order_by('id'))
+        Major.objects.bulk_create([
+            Major(manager=users[i % len(users)], code=f"{i:06d}", name=f"专业{i}") for i in range(majors)
+        ])
+        major_ids = list(Major.objects.order_by('id').values_list('id', flat=True))
+        Point1.objects.bulk_create([
+            Point1(major_id=major_id, index=m * point1_per_major + i, content=f"毕业要求{i}")
+            for m, major_id in enumerate(major_ids) for i in range(point1_per_major)
+        ], batch_size=2000)
+        point1_ids = list(Point1.objects.order_by('id').values_list('id', flat=True))
+        Point2.objects.bulk_create([
+            Point2(point1_id=point1_id, index=p * point2_per_point1 + i, content=f"分解指标点{i}")
+            for p, point1_id in enumerate(point1_ids) for i in range(point2_per_point1)
+        ], batch_size=2000)
+
+
+def endpoint_queries():
+    """
+    :return: 接口名到执行一次查询的函数，与server/routers/major.py中的查询一致
+    """
+    major = Major.objects.order_by('id')[Major.objects.count() // 2]
+    point1 = Point1.objects.filter(major=major).order_by('index').last()
+    point2 = Point2.objects.filter(point1=point1).order_by('index').last()
+    return {
+        "majors": lambda: list(Major.objects.filter(manager=major.manager_id).order_by('id').values('id', 'name')[:101]),
+        "point1 list": lambda: list(Point1.objects.filter(major=major).order_by('index').values('id', 'index', 'content')[:101]),
+        "point1 exists": lambda: Point1.objects.filter(major=major, index=point1.index).count(),
+        "point1 version": lambda: Point1.objects.filter(major=major).aggregate(Max('create_time'), Count('id')),
+        "tree point1": lambda: list(Point1.objects.filter(major=major).order_by('index').values('id', 'index', 'content')),
+        "tree point2": lambda: list(
+            Point2.objects.filter(point1__major=major).order_by('point1_id', 'index').values('id', 'point1_id', 'index', 'content')
+        ),
+        "point2 list": lambda: list(Point2.objects.filter(point1=point1).order_by('index').values('id', 'index', 'content')[:101]),
+        "point2 exists": lambda: Point2.objects.filter(point1=point1, index=point2.index).count(),
+    }
+
+
+def capture_sql(query) -> list:
+    """
+    :return: 执行query时发出的(sql, params)
+    """
+    statements = []
+
+    def wrapper(execute, sql, params, many, context):
+        statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        query()
+    return statements
+
+
+def explain(sql: str, params) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        return "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+
+
+def measure(repeat: int) -> dict:
+    result = {}
+    for name, query in endpoint_queries().items():
+        plans = [explain(sql, params) for sql, params in capture_sql(query)]
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        result[name] = {
+            "median_ms": round(statistics.median(latencies), 4),
+            "p95_ms": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 4),
+            "plan": plans,
+        }
+    return result
+
+
+def report(title: str, result: dict):
+    print(f"===== {title} =====")
+    for name, each in result.items():
+        print(f"{name:16s} median {each['median_ms']:9.4f} ms  p95 {each['p95_ms']:9.4f} ms")
+        for plan in each["plan"]:
+            for line in plan.splitlines():
+                print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--majors", type=int, default=200)
+    parser.add_argument("--point1", type=int, default=20, help="每个专业的毕业要求数")
+    parser.add_argument("--point2", type=int, default=10, help="每个毕业要求的分解指标点数")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="把结果写入json文件")
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        call_command("migrate", "eecs", BEFORE, verbosity=0)
+        seed(args.majors, args.point1, args.point2)
+        results = {"before": measure(args.repeat)}
+        call_command("migrate", "eecs", AFTER, verbosity=0)
+        results["after"] = measure(args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    for title in ("before", "after"):
+        report(f"{title} ({BEFORE if title == 'before' else AFTER})", results[title])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+响应序列化的耗时：对比FastAPI默认的response_model校验+JSONResponse、trusted_response（orjson）和gzip压缩，
+数据与/api/major/point1的响应结构相同
+python -m bench_script.serialize_bench [--sizes 10 100 1000 10000] [--repeat 50] [--json result.json]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import statistics
+import time
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from starlette.responses import JSONResponse
+
+from server.routers import responses
+from server.routers.responses import FastJSONResponse
+from server.routers.schema import PointListData
+
+
+def make_payload(size: int) -> dict:
+    return {
+        "code": 20000,
+        "data": {
+            "total": None,
+            "has_more": True,
+            "after": "aWQ6MTAw",
+            "items": [
+                {"id": i, "index": i % 20, "content": f"能够将数学、自然科学、工程基础和专业知识用于解决复杂工程问题{i}"}
+                for i in range(size)
+            ],
+        },
+    }
+
+
+def timed(func, repeat: int) -> float:
+    """
+    :return: 中位数耗时（毫秒）
+    """
+    func()  # 预热
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def measure(size: int, repeat: int) -> dict:
+    payload = make_payload(size)
+    field = create_response_field(name="response", type_=PointListData)
+    loop = asyncio.new_event_loop()
+
+    def default_path():
+        # FastAPI对普通返回值的处理：按response_model校验、jsonable_encoder，再用JSONResponse序列化
+        content = loop.run_until_complete(serialize_response(field=field, response_content=payload))
+        return JSONResponse(content).body
+
+    def trusted_json():
+        orjson, responses.orjson = responses.orjson, None
+        try:
+            return FastJSONResponse(payload).body
+        finally:
+            responses.orjson = orjson
+
+    body = FastJSONResponse(payload).body
+    result = {
+        "bytes": len(body),
+        "default_ms": timed(default_path, repeat),
+        "trusted_ms": timed(lambda: FastJSONResponse(payload).body, repeat),
+        "trusted_json_fallback_ms": timed(trusted_json, repeat),
+        "gzip_ms": timed(lambda: gzip.compress(body, compresslevel=6), repeat),
+        "gzip_bytes": len(gzip.compress(body, compresslevel=6)),
+    }
+    # 两种方式的输出一致
+    assert json.loads(body) == json.loads(default_path())
+    loop.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="每个响应的条目数")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="把结果写入json文件")
+    args = parser.parse_args()
+
+    if responses.orjson is None:
+        print("未安装orjson，trusted_ms与trusted_json_fallback_ms相同")
+    results = {}
+    print(f"{'items':>6s} {'bytes':>9s} {'default':>10s} {'trusted':>10s} {'json':>10s} {'speedup':>8s} "
+          f"{'gzip':>10s} {'gzip bytes':>10s}")
+    for size in args.sizes:
+        each = results[size] = measure(size, args.repeat)
+        print(f"{size:6d} {each['bytes']:9d} {each['default_ms']:8.3f}ms {each['trusted_ms']:8.3f}ms "
+              f"{each['trusted_json_fallback_ms']:8.3f}ms {each['default_ms'] / each['trusted_ms']:7.1f}x "
+              f"{each['gzip_ms']:8.3f}ms {each['gzip_bytes']:10d}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
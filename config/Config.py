@@ -10,12 +10,14 @@ class ImproperlyConfigured(Exception):
     pass
 
 
-CONFIG_PATH = "/opt/web/eecs_config.yaml"
+# 可以用环境变量EECS_CONFIG_PATH指定其他配置文件，例如测试用的config/test_postgres.yaml
+CONFIG_PATH = os.environ.get("EECS_CONFIG_PATH", "/opt/web/eecs_config.yaml")
 # 从配置文件更新
 if os.path.exists(CONFIG_PATH):
     with open(CONFIG_PATH, "r") as f:
         config_dict = yaml.load(f.read(), Loader=yaml.FullLoader)
 else:
+    config_dict = {}
     sys.stderr.write(f"请确认配置文件{CONFIG_PATH}是否存在!! 配置文件信息请见 README.MD#Configuration\n")
 
 
@@ -31,21 +33,72 @@ def _get_config(field, default=None):
 
 
 # ALLOWED_HOSTS = _get_config("ALLOWED_HOSTS", ["*"])
+# 启动模式：full同时提供接口、Django admin和静态文件，api只提供接口，不加载admin相关的app，启动更快
+# 环境变量EECS_SERVER_MODE优先，同一份配置文件可以分别启动api worker和admin worker
+SERVER_MODE = os.environ.get("EECS_SERVER_MODE") or _get_config("SERVER_MODE", "full")
+if SERVER_MODE not in ("full", "api"):
+    raise ImproperlyConfigured(f"SERVER_MODE只能是full或api: {SERVER_MODE}")
 # database
+DATABASE_BACKEND = _get_config("DATABASE_BACKEND", "sqlite")  # sqlite或postgres
 POSTGRES_HOST = _get_config("POSTGRES_HOST", "127.0.0.1")
 POSTGRES_PORT = _get_config("POSTGRES_PORT", 5432)
 POSTGRES_DATABASE = _get_config("POSTGRES_DATABASE", "eecs")
 POSTGRES_USERNAME = _get_config("POSTGRES_USERNAME", "postgres")
 POSTGRES_PASSWORD = _get_config("POSTGRES_PASSWORD", "eecs123456")
-POSTGRES_URI = f"postgres://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PASSWORD}/{POSTGRES_DATABASE}"
+POSTGRES_CONN_MAX_AGE = _get_config("POSTGRES_CONN_MAX_AGE", 600)
+POSTGRES_HEALTH_CHECK_INTERVAL = _get_config("POSTGRES_HEALTH_CHECK_INTERVAL", 30)
+# 每个worker最多的数据库连接数，同时也是默认线程池的大小（Django的连接是每个线程一个）
+DB_MAX_CONNECTIONS = _get_config("DB_MAX_CONNECTIONS", 16)
+POSTGRES_URI = f"postgres://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}"
 
+# API的异步连接池大小（tortoise-orm），与Django的连接分开计算
+ASYNC_DB_POOL_SIZE = _get_config("ASYNC_DB_POOL_SIZE", 10)
+if DATABASE_BACKEND == "sqlite":
+    SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "djadmin", "db.sqlite3")
+    ASYNC_DB_URI = f"sqlite://{SQLITE_PATH}"
+else:
+    ASYNC_DB_URI = f"{POSTGRES_URI}?minsize=1&maxsize={ASYNC_DB_POOL_SIZE}"
+
+# 表结构由Django的迁移维护，不使用aerich
 TORTOISE_ORM = {
-    "connections": {"default": POSTGRES_URI},
+    "connections": {"default": ASYNC_DB_URI},
     "apps": {
         "models": {
-            "models": ["database.ps.models", "aerich.models"],
+            "models": ["server.database.ps.models"],
             "default_connection": "default",
         },
     },
 }
 
+# 生产环境的静态文件：admin页面引用带哈希的文件名，/static使用collectstatic生成的压缩版本，
+# 开启后需要先执行collectstatic；false（默认，开发和测试）时使用普通的StaticFiles和原始文件名
+STATIC_PRECOMPRESSED = _get_config("STATIC_PRECOMPRESSED", False)
+
+# /api下不小于GZIP_MINIMUM_SIZE字节的响应按Accept-Encoding用gzip压缩，0表示不压缩
+GZIP_MINIMUM_SIZE = _get_config("GZIP_MINIMUM_SIZE", 1024)
+GZIP_LEVEL = _get_config("GZIP_LEVEL", 6)
+
+# 按路径前缀限制并发：limit同时处理的请求数，queue排队的请求数，timeout排队的最长秒数，超过时返回503
+# /django和/static的limit之和应小于DB_MAX_CONNECTIONS，给/api留出线程
+BULKHEADS = _get_config("BULKHEADS", {
+    "/django": {"limit": 4, "queue": 16, "timeout": 10},
+    "/static": {"limit": 4, "queue": 64, "timeout": 10},
+})
+
+# auth
+USER_CACHE_SIZE = _get_config("USER_CACHE_SIZE", 1024)  # 0表示不缓存用户
+USER_CACHE_TTL = _get_config("USER_CACHE_TTL", 60)
+TOKEN_CACHE_SIZE = _get_config("TOKEN_CACHE_SIZE", 0)  # 0表示每次都验证token签名
+AUTH_ASYNC = _get_config("AUTH_ASYNC", True)  # 认证依赖在事件循环中执行，不占用默认线程池
+AUTH_EXECUTOR_WORKERS = _get_config("AUTH_EXECUTOR_WORKERS", 4)
+# token中带上用户id、角色和负责的专业，认证和权限检查不查询数据库
+AUTH_TOKEN_CLAIMS = _get_config("AUTH_TOKEN_CLAIMS", False)
+# 登录时校验密码的进程数，0表示在默认线程池中校验
+PASSWORD_WORKERS = _get_config("PASSWORD_WORKERS", 2)
+PASSWORD_QUEUE = _get_config("PASSWORD_QUEUE", 32)  # 进程都忙时最多排队的登录请求数，超过时返回503
+PASSWORD_QUEUE_TIMEOUT = _get_config("PASSWORD_QUEUE_TIMEOUT", 5)
+
+# cache
+REDIS_URL = _get_config("REDIS_URL", "")  # 为空时使用进程内缓存，例如redis://127.0.0.1:6379/0
+REDIS_MAX_CONNECTIONS = _get_config("REDIS_MAX_CONNECTIONS", 32)
+CACHE_TTL = _get_config("CACHE_TTL", 300)
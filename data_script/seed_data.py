@@ -0,0 +1,189 @@
+"""
+生成大量的测试数据：用户、用户-角色、专业、毕业要求和分解指标点，相同的--seed生成相同的数据
+每批用bulk_create写入，每批一个事务；所有用户使用同一个密码（只计算一次哈希）
+python -m data_script.seed_data [--users 1000] [--majors 5000] [--point1 12] [--point2 4] [--seed 42] [--clear]
+"""
+import argparse
+import random
+import sys
+import time
+from typing import Iterable, List
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User as DjangoUser
+from django.db import transaction
+
+from djadmin.eecs.models import Major, Point1, Point2, Role, UserRole
+
+ROLE_NAMES = ("专业负责人", "课程负责人", "专业班负责人")
+PHRASES = (
+    "工程知识", "问题分析", "设计/开发解决方案", "研究", "使用现代工具", "工程与社会", "环境和可持续发展",
+    "职业规范", "个人和团队", "沟通", "项目管理", "终身学习",
+)
+
+
+class Progress:
+    """
+    每秒最多输出一次进度
+    """
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.start = self.last = time.perf_counter()
+
+    def add(self, count: int) -> None:
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last >= 1 or self.done >= self.total:
+            self.last = now
+            rate = self.done / max(now - self.start, 1e-9)
+            sys.stderr.write(f"{self.name:8s} {self.done:10d}/{self.total:<10d} {rate:10.0f}行/秒\n")
+
+
+def chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def create_users(prefix: str, count: int, password: str, batch_size: int) -> List[int]:
+    """
+    :return: 新用户的id，按用户名排序
+    """
+    hashed = make_password(password)
+    progress = Progress("user", count)
+    for batch in chunks(range(count), batch_size):
+        with transaction.atomic():
+            DjangoUser.objects.bulk_create(
+                [DjangoUser(username=f"{prefix}{i:07d}", password=hashed) for i in batch]
+            )
+        progress.add(len(batch))
+    # sqlite的bulk_create不会回填主键，写入后重新查询
+    return list(
+        DjangoUser.objects.filter(username__startswith=prefix).order_by("username").values_list("id", flat=True)
+    )
+
+
+def create_user_roles(rng: random.Random, user_ids: List[int], batch_size: int) -> None:
+    """
+    每个用户都是专业负责人，另外随机分配其他角色
+    """
+    roles = [Role.objects.get_or_create(name=name)[0].id for name in ROLE_NAMES]
+    rows = []
+    for user_id in user_ids:
+        rows.append(UserRole(role_id=roles[0], user_id=user_id))
+        rows.extend(UserRole(role_id=role_id, user_id=user_id) for role_id in roles[1:] if rng.random() < 0.3)
+    progress = Progress("userrole", len(rows))
+    for batch in chunks(rows, batch_size):
+        with transaction.atomic():
+            UserRole.objects.bulk_create(batch)
+        progress.add(len(batch))
+
+
+def create_majors(rng: random.Random, prefix: str, user_ids: List[int], count: int, batch_size: int) -> List[int]:
+    """
+    :return: 新专业的id，按专业代码排序
+    """
+    progress = Progress("major", count)
+    for batch in chunks(range(count), batch_size):
+        with transaction.atomic():
+            Major.objects.bulk_create([
+                Major(manager_id=rng.choice(user_ids), code=f"{prefix}{i:07d}", name=f"{prefix}专业{i}")
+                for i in batch
+            ])
+        progress.add(len(batch))
+    return list(Major.objects.filter(code__startswith=prefix).order_by("code").values_list("id", flat=True))
+
+
+def create_points(rng: random.Random, major_ids: List[int], point1: int, point2: int, batch_size: int) -> None:
+    """
+    每个专业约point1个毕业要求，每个毕业要求约point2个分解指标点（在平均数的50%~150%之间随机），
+    按专业分批：写入一批专业的毕业要求后查询它们的id，再写入分解指标点
+    """
+    point1_counts = [rng.randint(max(1, point1 // 2), max(1, point1 * 3 // 2)) for _ in major_ids]
+    point2_counts = [rng.randint(max(1, point2 // 2), max(1, point2 * 3 // 2)) for _ in range(sum(point1_counts))]
+    progress1 = Progress("point1", len(point2_counts))
+    progress2 = Progress("point2", sum(point2_counts))
+    # major_id__in的参数个数不超过sqlite的限制
+    majors_per_batch = min(500, max(1, batch_size // max(1, point1)))
+    offset = 0
+    for start in range(0, len(major_ids), majors_per_batch):
+        batch = major_ids[start:start + majors_per_batch]
+        keys = [
+            (major_id, index)
+            for major_id, count in zip(batch, point1_counts[start:start + majors_per_batch])
+            for index in range(1, count + 1)
+        ]
+        with transaction.atomic():
+            Point1.objects.bulk_create([
+                Point1(major_id=major_id, index=index, content=f"{index}. {rng.choice(PHRASES)}")
+                for major_id, index in keys
+            ], batch_size=batch_size)
+            point1_ids = {
+                (major_id, index): point1_id
+                for point1_id, major_id, index in
+                Point1.objects.filter(major_id__in=batch).values_list("id", "major_id", "index")
+            }
+            point2_rows = [
+                Point2(point1_id=point1_ids[key], index=index, content=f"{key[1]}.{index} {rng.choice(PHRASES)}")
+                for key, count in zip(keys, point2_counts[offset:offset + len(keys)])
+                for index in range(1, count + 1)
+            ]
+            Point2.objects.bulk_create(point2_rows, batch_size=batch_size)
+        offset += len(keys)
+        progress1.add(len(keys))
+        progress2.add(len(point2_rows))
+
+
+def clear(prefix: str) -> None:
+    """
+    删除之前用同一个prefix生成的数据，从子表开始删除，每个表一条DELETE
+    """
+    Point2.objects.filter(point1__major__code__startswith=prefix).delete()
+    Point1.objects.filter(major__code__startswith=prefix).delete()
+    Major.objects.filter(code__startswith=prefix).delete()
+    UserRole.objects.filter(user__username__startswith=prefix).delete()
+    DjangoUser.objects.filter(username__startswith=prefix).delete()
+
+
+def generate(users: int, majors: int, point1: int, point2: int, seed: int = 42, prefix: str = "seed",
+             password: str = "eecs1234", batch_size: int = 5000) -> None:
+    """
+    :param users: 用户数，用户名为prefix加序号
+    :param majors: 专业数，随机分配给用户
+    :param point1: 每个专业的平均毕业要求数
+    :param point2: 每个毕业要求的平均分解指标点数
+    :param seed: 随机数种子
+    :param prefix: 用户名和专业代码的前缀，用于区分生成的数据
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    user_ids = create_users(prefix, users, password, batch_size)
+    create_user_roles(rng, user_ids, batch_size)
+    major_ids = create_majors(rng, prefix, user_ids, majors, batch_size)
+    create_points(rng, major_ids, point1, point2, batch_size)
+    sys.stderr.write(f"完成，用时{time.perf_counter() - start:.1f}秒\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--majors", type=int, default=5000)
+    parser.add_argument("--point1", type=int, default=12, help="每个专业的平均毕业要求数")
+    parser.add_argument("--point2", type=int, default=4, help="每个毕业要求的平均分解指标点数")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子，相同的种子生成相同的数据")
+    parser.add_argument("--prefix", default="seed", help="用户名和专业代码的前缀")
+    parser.add_argument("--password", default="eecs1234", help="所有用户的密码")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批写入的行数")
+    parser.add_argument("--clear", action="store_true", help="先删除之前用同一个前缀生成的数据")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear(args.prefix)
+    generate(args.users, args.majors, args.point1, args.point2, seed=args.seed, prefix=args.prefix,
+             password=args.password, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import time
+
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    带健康检查的持久连接
+    Django 3.1只在Django自己的请求开始/结束时检查和回收持久连接(close_old_connections)，
+    FastAPI的路由不会触发这些信号，所以在每次取用连接之前检查：
+    超过CONN_MAX_AGE或出过错的连接直接关闭，空闲超过HEALTH_CHECK_INTERVAL秒的连接先SELECT 1确认可用
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = 0
+
+    def ensure_connection(self):
+        if self.connection is not None and not self.in_atomic_block:
+            self.close_if_unusable_or_obsolete()
+            interval = self.settings_dict.get('HEALTH_CHECK_INTERVAL')
+            if (self.connection is not None and interval is not None
+                    and time.monotonic() - self.last_used > interval and not self.is_usable()):
+                self.close()
+        super().ensure_connection()
+        self.last_used = time.monotonic()
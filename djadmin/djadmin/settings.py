@@ -12,6 +12,10 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
+from config import Config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,6 +41,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'djadmin.eecs'
 ]
+if Config.SERVER_MODE == 'api':
+    # 只提供接口时不需要admin、session、message和静态文件，django.setup()不再导入admin及其autodiscover
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if app not in ('django.contrib.admin', 'django.contrib.sessions',
+                       'django.contrib.messages', 'django.contrib.staticfiles')
+    ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -71,12 +82,40 @@ WSGI_APPLICATION = 'djadmin.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# 数据库配置来自config/Config.py，DATABASE_BACKEND为sqlite时使用本地的sqlite文件
+if Config.DATABASE_BACKEND == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # 测试库使用文件而不是内存数据库，async接口的测试中tortoise-orm才能连接到同一个库
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+elif Config.DATABASE_BACKEND == 'postgres':
+    DATABASES = {
+        'default': {
+            # 在postgresql后端的基础上加了持久连接的健康检查
+            'ENGINE': 'djadmin.djadmin.db.postgresql',
+            'HOST': Config.POSTGRES_HOST,
+            'PORT': Config.POSTGRES_PORT,
+            'NAME': Config.POSTGRES_DATABASE,
+            'USER': Config.POSTGRES_USERNAME,
+            'PASSWORD': Config.POSTGRES_PASSWORD,
+            # 持久连接，每个线程的连接在CONN_MAX_AGE秒内复用
+            'CONN_MAX_AGE': Config.POSTGRES_CONN_MAX_AGE,
+            # 连接空闲超过该秒数后，复用前先检查是否可用
+            'HEALTH_CHECK_INTERVAL': Config.POSTGRES_HEALTH_CHECK_INTERVAL,
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+            'TEST': {
+                'NAME': f'test_{Config.POSTGRES_DATABASE}',
+            },
+        }
     }
-}
+else:
+    raise ImproperlyConfigured(f"DATABASE_BACKEND只能是postgres或sqlite: {Config.DATABASE_BACKEND}")
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -114,3 +153,7 @@ USE_TZ = False
 
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'static/'
+# STATIC_PRECOMPRESSED（生产环境）时collectstatic生成带哈希的文件名和.gz/.br压缩版本，
+# 与DEBUG无关；否则使用Django默认的存储和原始文件名
+if Config.STATIC_PRECOMPRESSED:
+    STATICFILES_STORAGE = 'djadmin.djadmin.storage.CompressedManifestStaticFilesStorage'
@@ -0,0 +1,54 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 字体、图片等已经压缩过的格式不再压缩
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.map', '.xml', '.md')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic时生成带内容哈希的文件名（staticfiles.json），并为文本文件生成.gz和.br（安装了brotli时）两种压缩版本，
+    由server/static.py按Accept-Encoding选择
+    只在Config.STATIC_PRECOMPRESSED时使用；manifest中缺失的文件（没有重新collectstatic）直接报错
+    """
+
+    def url(self, name, force=False):
+        """
+        Django默认在DEBUG=True时返回原始文件名，这里总是返回带哈希的文件名，
+        否则页面引用的文件不会使用Cache-Control: immutable
+        """
+        return super().url(name, force=True)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(self.path(name))
+
+    @staticmethod
+    def compress(path: str) -> None:
+        """
+        生成path.gz和path.br，压缩后没有变小的不保留
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        variants = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in variants:
+            compressed = compress(content)
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -1,5 +1,15 @@
 from django.contrib import admin
 from .models import *
+from .paginator import EstimatedCountPaginator
+
+
+class ListModelAdmin(admin.ModelAdmin):
+    """
+    数据量大的表的列表页：关联数据用list_select_related一次JOIN查出，
+    总数在大表上使用估计值，并且不再额外统计未过滤的总数
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # Register your models here.
@@ -12,12 +22,13 @@ class RoleAdmin(admin.ModelAdmin):
 
 
 @admin.register(UserRole)
-class UserRoleAdmin(admin.ModelAdmin):
+class UserRoleAdmin(ListModelAdmin):
     list_display = [
         'id',
         'role_name',
         'user_username'
     ]
+    list_select_related = ('role', 'user')
 
     def role_name(self, obj):
         return obj.role.name
@@ -32,13 +43,14 @@ class UserRoleAdmin(admin.ModelAdmin):
 
 
 @admin.register(Major)
-class MajorAdmin(admin.ModelAdmin):
+class MajorAdmin(ListModelAdmin):
     list_display = [
         'id',
         'code',
         'name',
         'manager_name'
     ]
+    list_select_related = ('manager',)
 
     def manager_name(self, obj):
         return obj.manager.username
@@ -49,13 +61,14 @@ class MajorAdmin(admin.ModelAdmin):
 
 
 @admin.register(Point1)
-class Point1Admin(admin.ModelAdmin):
+class Point1Admin(ListModelAdmin):
     list_display = [
         'id',
         'major_name',
         'index',
         'content'
     ]
+    list_select_related = ('major',)
 
     def major_name(self, obj):
         return obj.major.name
@@ -65,16 +78,24 @@ class Point1Admin(admin.ModelAdmin):
 
 
 @admin.register(Point2)
-class Point2Admin(admin.ModelAdmin):
+class Point2Admin(ListModelAdmin):
     list_display = [
         'id',
         'point1_index',
         'index',
         'content'
     ]
+    # Point2.__str__会访问point1.major，一起JOIN出来
+    list_select_related = ('point1__major',)
 
     def point1_index(self, obj):
         return obj.point1.index
 
     point1_index.__name__ = "毕业要求序号"
     list_display_links = ['id', ]
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # 编辑页的毕业要求下拉框显示Point1.__str__，需要专业名称
+        if db_field.name == 'point1':
+            kwargs['queryset'] = Point1.objects.select_related('major')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
@@ -0,0 +1,14 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:19
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eecs', '0002_auto_20201128_1453'),
+        ('eecs', '0005_auto_20201128_1009'),
+    ]
+
+    operations = [
+    ]
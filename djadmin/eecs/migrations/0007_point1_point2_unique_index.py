@@ -0,0 +1,39 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eecs', '0006_merge_20261018_1619'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='point1',
+            options={'ordering': ('major', 'index'), 'verbose_name': '毕业要求表', 'verbose_name_plural': '毕业要求表'},
+        ),
+        migrations.AlterModelOptions(
+            name='point2',
+            options={'ordering': ('point1', 'index'), 'verbose_name': '指标点分解表', 'verbose_name_plural': '指标点分解表'},
+        ),
+        migrations.AlterField(
+            model_name='point1',
+            name='index',
+            field=models.IntegerField(verbose_name='编号'),
+        ),
+        migrations.AlterField(
+            model_name='point2',
+            name='index',
+            field=models.IntegerField(verbose_name='编号'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='point1',
+            unique_together={('major', 'index')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='point2',
+            unique_together={('point1', 'index')},
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eecs', '0007_point1_point2_unique_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='role',
+            options={'verbose_name': '角色表', 'verbose_name_plural': '角色表'},
+        ),
+        migrations.AlterModelOptions(
+            name='userrole',
+            options={'verbose_name': '用户-角色表', 'verbose_name_plural': '用户-角色表'},
+        ),
+    ]
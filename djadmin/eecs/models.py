@@ -46,7 +46,7 @@ class Major(models.Model):
 
 class Point1(models.Model):
     major = models.ForeignKey(Major, on_delete=models.CASCADE, verbose_name="专业")
-    index = models.IntegerField(unique=True, verbose_name="编号")
+    index = models.IntegerField(verbose_name="编号")
     content = models.TextField(verbose_name="内容")
     create_time = models.DateTimeField(auto_now=True, verbose_name="创建时间")
 
@@ -55,6 +55,9 @@ class Point1(models.Model):
     class Meta:
         verbose_name_plural = "毕业要求表"
         verbose_name = verbose_name_plural
+        # 编号在专业内唯一，(major, index)上的唯一索引同时服务于按专业查询和按编号排序
+        unique_together = ('major', 'index',)
+        ordering = ('major', 'index',)
 
     def __str__(self):
         return self.major.name + "-指标点" + str(self.index)
@@ -62,7 +65,7 @@ class Point1(models.Model):
 
 class Point2(models.Model):
     point1 = models.ForeignKey(Point1, verbose_name="所属毕业要求", on_delete=models.CASCADE)
-    index = models.IntegerField(unique=True, verbose_name="编号")
+    index = models.IntegerField(verbose_name="编号")
     content = models.TextField(verbose_name="内容")
     create_time = models.DateTimeField(auto_now=True, verbose_name="创建时间")
 
@@ -71,22 +74,9 @@ class Point2(models.Model):
     class Meta:
         verbose_name_plural = "指标点分解表"
         verbose_name = verbose_name_plural
+        # 编号在毕业要求内唯一
+        unique_together = ('point1', 'index',)
+        ordering = ('point1', 'index',)
 
     def __str__(self):
         return self.point1.major.name + "-指标点%d.%d" % (self.point1.index, self.index)
-
-
-class Major1(models.Model):
-    manager = models.ForeignKey(DjangoUser, on_delete=models.CASCADE, verbose_name="专业负责人")
-    code = models.CharField(max_length=32, unique=True, verbose_name="专业代码")
-    name = models.CharField(max_length=32, unique=True, verbose_name="专业名称")
-    create_time = models.DateTimeField(auto_now=True, verbose_name="创建时间")
-
-    objects = models.Manager()
-
-    class Meta:
-        verbose_name_plural = "专业表"
-        verbose_name = verbose_name_plural
-
-    def __str__(self):
-        return self.name
@@ -0,0 +1,36 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    大表不做精确的COUNT(*)：
+    没有过滤条件时，PostgreSQL用pg_class.reltuples（ANALYZE/autovacuum维护的行数估计）作为总数，
+    估计值小于threshold、有过滤条件或者不是PostgreSQL时仍然精确计数
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _estimate(queryset):
+        """
+        :return: 表的估计行数，无法估计时返回None
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                           [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        # 从未ANALYZE过的表reltuples为-1（PostgreSQL 14之前为0）
+        return int(row[0]) if row and row[0] > 0 else None
@@ -1,3 +1,1623 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User as DjangoUser
+from django.contrib.auth.signals import user_login_failed
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+from django.db.backends.signals import connection_created
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from config import Config
+from djadmin.eecs.models import Major, Point1, Point2, Role, UserRole
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
 
 # Create your tests here.
+@skipUnless(connection.vendor == 'postgresql', "需要本地PostgreSQL，见config/test_postgres.yaml")
+class PersistentConnectionTests(TransactionTestCase):
+    """
+    持久连接在请求之间复用，而不是每个请求重新建立
+    """
+
+    def test_connections_reused_across_requests(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        token = manager.create_access_token(data=dict(sub=user.username))
+        created = []
+
+        def on_connection_created(sender, connection, **kwargs):
+            created.append(threading.get_ident())
+
+        connection_created.connect(on_connection_created)
+        try:
+            with TestClient(app) as client:
+                for _ in range(50):
+                    response = client.get('/api/major/majors', headers={'Authorization': f'Bearer {token}'})
+                    self.assertEqual(response.status_code, 200)
+        finally:
+            connection_created.disconnect(on_connection_created)
+
+        # 每个线程只建立一次连接，连接总数不超过线程池的大小
+        self.assertEqual(len(created), len(set(created)))
+        self.assertLessEqual(len(created), Config.DB_MAX_CONNECTIONS + Config.AUTH_EXECUTOR_WORKERS)
+
+
+class ConnectionLimitTests(TransactionTestCase):
+    """
+    limit_db_connections把默认线程池的大小限制为DB_MAX_CONNECTIONS，sync路由同时打开的连接数不超过它
+    """
+
+    def test_default_executor_caps_connections(self):
+        from server import main
+
+        loop = asyncio.new_event_loop()
+        created, running, peak = [], [0], [0]
+        lock = threading.Lock()
+
+        def on_connection_created(sender, connection, **kwargs):
+            created.append(threading.get_ident())
+
+        def query():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            try:
+                list(Major.objects.all()[:1])
+                time.sleep(0.05)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        async def run_queries():
+            await asyncio.gather(*(loop.run_in_executor(None, query) for _ in range(8)))
+
+        executor = None
+        connection_created.connect(on_connection_created)
+        try:
+            with mock.patch.object(Config, 'DB_MAX_CONNECTIONS', 2), \
+                    mock.patch.object(main.asyncio, 'get_event_loop', return_value=loop), \
+                    mock.patch.object(main.registry, 'add_collector'), \
+                    mock.patch.object(loop, 'set_default_executor', wraps=loop.set_default_executor) as set_executor:
+                main.limit_db_connections()
+            executor = set_executor.call_args[0][0]
+            loop.run_until_complete(run_queries())
+        finally:
+            connection_created.disconnect(on_connection_created)
+            if executor is not None:
+                executor.shutdown(wait=True)
+            loop.close()
+
+        self.assertEqual(executor._max_workers, 2)
+        self.assertEqual(peak[0], 2)
+        # 每个线程一个连接，8个查询只在2个线程中打开了连接
+        self.assertEqual(len(created), len(set(created)))
+        self.assertIn(len(created), (1, 2))
+
+
+class AdminChangelistQueryBudgetTests(TestCase):
+    """
+    admin列表页的查询次数固定，不随每页的行数增加
+    """
+    # session、当前用户、计数（PostgreSQL上先查一次估计的行数）、当前页的数据
+    QUERY_BUDGET = 5 if connection.vendor == 'postgresql' else 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = DjangoUser.objects.create_superuser('admin', password='admin1234')
+        role = Role.objects.create(name='专业负责人')
+        for i in range(30):
+            manager = DjangoUser.objects.create_user(f'manager{i}')
+            UserRole.objects.create(role=role, user=manager)
+            major = Major.objects.create(manager=manager, code=f'{i:04d}', name=f'专业{i}')
+            point1 = Point1.objects.create(major=major, index=1, content='毕业要求')
+            Point2.objects.create(point1=point1, index=1, content='分解指标点')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelist_query_budget(self):
+        for model in (UserRole, Major, Point1, Point2):
+            with self.subTest(model=model.__name__):
+                url = reverse(f'admin:eecs_{model._meta.model_name}_changelist')
+                with self.assertNumQueries(self.QUERY_BUDGET):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class QueryRecorder:
+    """
+    记录所有线程中执行的SQL（FastAPI的sync路由和admin都在线程池中执行，连接是每个线程一个），
+    trace为True时同时记录每条SQL在本项目代码中的调用栈
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def record(self, sql: str) -> None:
+        stack = ''
+        if self.trace:
+            frames = [
+                frame for frame in traceback.extract_stack()[:-3]
+                if frame.filename.startswith(self.base_dir) and 'site-packages' not in frame.filename
+                and frame.filename != __file__
+            ]
+            stack = ''.join(traceback.format_list(frames))
+        with self._lock:
+            self.queries.append((sql, stack))
+
+    @contextmanager
+    def capture(self):
+        self.queries = []
+        execute, executemany = CursorWrapper._execute, CursorWrapper._executemany
+
+        def recorded_execute(cursor, sql, params, *args):
+            self.record(sql)
+            return execute(cursor, sql, params, *args)
+
+        def recorded_executemany(cursor, sql, param_list, *args):
+            self.record(sql)
+            return executemany(cursor, sql, param_list, *args)
+
+        with mock.patch.object(CursorWrapper, '_execute', recorded_execute), \
+                mock.patch.object(CursorWrapper, '_executemany', recorded_executemany):
+            yield self
+
+    def report(self) -> str:
+        lines = []
+        for i, (sql, stack) in enumerate(self.queries, 1):
+            lines.append(f'{i}. {sql}')
+            if stack:
+                lines.append(stack)
+        return '\n'.join(lines)
+
+
+class EndpointQueryBudgetTests(TransactionTestCase):
+    """
+    通过FastAPI应用在进程内请求/api和/django下的接口，在不同的数据量下检查查询次数：
+    不能超过预算，也不能随数据量增加（N+1）。
+    每个接口先请求一次再计数，登录用户、专业负责人等缓存已加载，统计的是稳定状态下的查询次数。
+    设置环境变量EECS_QUERY_TRACE=1时，失败信息中包含每条SQL的调用栈
+    """
+    SIZES = (2, 8, 32)
+    # 接口 -> 最多的查询次数：版本（ETag）、当前页的数据，with_total和point2的权限检查各多一次
+    API_BUDGETS = {
+        '/api/major/majors': 2,
+        '/api/major/majors?with_total=true': 3,
+        '/api/major/point1?major_id={major_id}': 2,
+        '/api/major/point2?point1_id={point1_id}': 3,
+        '/api/major/{major_id}/tree': 3,
+        '/api/major/{major_id}/export?format=csv': 1,
+        '/api/major/export?format=ndjson': 1,
+    }
+    # 列表页：session、当前用户、计数（PostgreSQL上先查一次估计的行数）、当前页的数据；
+    # 修改页：session、当前用户、BEGIN、对象及标题中的毕业要求和专业、下拉框的选项
+    ADMIN_EXTRA = 1 if connection.vendor == 'postgresql' else 0
+    ADMIN_BUDGETS = {
+        '/django/admin/eecs/userrole/': 4 + ADMIN_EXTRA,
+        '/django/admin/eecs/major/': 4 + ADMIN_EXTRA,
+        '/django/admin/eecs/point1/': 4 + ADMIN_EXTRA,
+        '/django/admin/eecs/point2/': 4 + ADMIN_EXTRA,
+        '/django/admin/eecs/point2/{point2_id}/change/': 7,
+    }
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        self.admin = DjangoUser.objects.create_superuser('admin', password='admin1234')
+        self.user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        self.role = Role.objects.create(name='专业负责人')
+        UserRole.objects.create(role=self.role, user=self.user)
+        token = manager.create_access_token(data=dict(sub=self.user.username))
+        self.api_headers = {'Authorization': f'Bearer {token}'}
+        django_client = Client()
+        django_client.force_login(self.admin)
+        self.admin_cookies = {'sessionid': django_client.cookies['sessionid'].value}
+        # 不进入with，不触发startup（tortoise-orm的连接），sync路由使用默认线程池
+        self.client = TestClient(app)
+        self.recorder = QueryRecorder(trace=os.environ.get('EECS_QUERY_TRACE') == '1')
+
+    def seed(self, size: int) -> dict:
+        """
+        为self.user创建size个专业，每个专业size个毕业要求，每个毕业要求2个分解指标点，
+        同时创建size个其他负责人的专业
+        :return: 用于填充接口路径的id
+        """
+        Point2.objects.all().delete()
+        Point1.objects.all().delete()
+        Major.objects.all().delete()
+        for i in range(size):
+            manager, _ = DjangoUser.objects.get_or_create(username=f'manager{i}')
+            UserRole.objects.get_or_create(role=self.role, user=manager)
+            Major.objects.create(manager=manager, code=f'other{i}', name=f'其他专业{i}')
+        Major.objects.bulk_create(
+            Major(manager=self.user, code=f'{i:04d}', name=f'专业{i}') for i in range(size)
+        )
+        majors = list(Major.objects.filter(manager=self.user).order_by('id'))
+        Point1.objects.bulk_create(
+            Point1(major=major, index=i, content=f'毕业要求{i}') for major in majors for i in range(size)
+        )
+        point1_list = list(Point1.objects.filter(major__manager=self.user).order_by('id'))
+        Point2.objects.bulk_create(
+            Point2(point1=point1, index=i, content=f'分解指标点{i}') for point1 in point1_list for i in range(2)
+        )
+        return {
+            'major_id': majors[0].id,
+            'point1_id': point1_list[0].id,
+            'point2_id': Point2.objects.filter(point1=point1_list[0]).first().id,
+        }
+
+    def count_queries(self, url: str, **kwargs) -> int:
+        self.client.get(url, **kwargs)
+        with self.recorder.capture():
+            response = self.client.get(url, **kwargs)
+            # 流式响应读完之后才执行完所有的查询
+            response.content
+        self.assertEqual(response.status_code, 200, url)
+        return len(self.recorder.queries)
+
+    def check_budgets(self, budgets: dict, **kwargs) -> None:
+        counts = {url: {} for url in budgets}
+        for size in self.SIZES:
+            ids = self.seed(size)
+            for url, budget in budgets.items():
+                with self.subTest(url=url, size=size):
+                    count = counts[url][size] = self.count_queries(url.format(**ids), **kwargs)
+                    self.assertLessEqual(
+                        count, budget, f'{url}在数据量为{size}时查询了{count}次：\n{self.recorder.report()}'
+                    )
+        for url, by_size in counts.items():
+            with self.subTest(url=url):
+                self.assertEqual(len(set(by_size.values())), 1, f'{url}的查询次数随数据量增加：{by_size}')
+
+    def test_api_query_budgets(self):
+        self.check_budgets(self.API_BUDGETS, headers=self.api_headers)
+
+    def test_admin_query_budgets(self):
+        self.check_budgets(self.ADMIN_BUDGETS, cookies=self.admin_cookies)
+
+
+def run_async(coro):
+    """
+    在TestClient使用的同一个事件循环中执行协程（Bulkhead的信号量要在同一个事件循环中使用）
+    """
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
+
+
+class PasswordLoginTests(TransactionTestCase):
+    """
+    /auth/token的密码校验：在进程池中校验，进程都忙并且队列已满时返回503，PASSWORD_WORKERS为0时使用authenticate
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+
+        DjangoUser.objects.create_user('eecs', password='eecs1234')
+        DjangoUser.objects.create_user('inactive', password='eecs1234', is_active=False)
+        self.client = TestClient(app)
+        self.verifier = None
+
+    def tearDown(self):
+        # 等待进程池的子进程退出
+        if self.verifier is not None:
+            self.verifier.shutdown()
+
+    def use_verifier(self, verifier):
+        """
+        用verifier代替login中的password_verifier，tearDown时关闭它的进程池
+        """
+        from server.auth import login
+
+        patcher = mock.patch.object(login, 'password_verifier', verifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.verifier = verifier
+        return verifier
+
+    def login(self, username: str, password: str):
+        return self.client.post('/auth/token', data={'username': username, 'password': password})
+
+    def test_process_pool_login(self):
+        from server.password import PasswordVerifier
+
+        # 测试进程中已经有其他线程，fork出的子进程可能继承被持有的锁，这里使用spawn
+        verifier = self.use_verifier(PasswordVerifier(1, 4, 5, start_method='spawn'))
+        run_async(verifier.start())
+        failed = []
+
+        def receiver(sender, credentials, **kwargs):
+            failed.append(credentials)
+
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+        cases = [
+            ('eecs', 'eecs1234', 200),
+            ('eecs', 'wrong', 401),
+            ('inactive', 'eecs1234', 401),
+            # 不存在的用户同样在进程池中计算一次哈希
+            ('nobody', 'eecs1234', 401),
+        ]
+        for username, password, status in cases:
+            with self.subTest(username=username, password=password):
+                admitted = verifier.bulkhead.admitted
+                response = self.login(username, password)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(verifier.bulkhead.admitted, admitted + 1)
+        self.assertIn('auth_token', self.login('eecs', 'eecs1234').json())
+        self.assertEqual([credentials['username'] for credentials in failed], ['eecs', 'inactive', 'nobody'])
+        self.assertTrue(all('eecs1234' not in credentials.values() for credentials in failed))
+        verifier.shutdown()
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_full_queue_returns_503(self):
+        from server.password import PasswordVerifier
+
+        verifier = self.use_verifier(PasswordVerifier(1, 0, 0.01))
+        # 占住唯一的进程，队列长度为0，下一个登录请求直接被拒绝，不查询用户
+        run_async(verifier.bulkhead.acquire())
+        try:
+            with mock.patch('server.password.run_in_threadpool') as run_in_threadpool:
+                response = self.login('eecs', 'eecs1234')
+        finally:
+            verifier.bulkhead.release()
+        run_in_threadpool.assert_not_called()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(max(1, int(Config.PASSWORD_QUEUE_TIMEOUT))))
+        self.assertEqual(verifier.bulkhead.stats()['rejected'], 1)
+
+    def test_zero_workers_uses_authenticate(self):
+        from django.contrib.auth import authenticate
+        from server.password import PasswordVerifier
+
+        self.use_verifier(PasswordVerifier(0))
+        with mock.patch('server.password.authenticate', wraps=authenticate) as patched:
+            self.assertEqual(self.login('eecs', 'eecs1234').status_code, 200)
+            self.assertEqual(self.login('eecs', 'wrong').status_code, 401)
+            self.assertEqual(self.login('inactive', 'eecs1234').status_code, 401)
+        self.assertEqual(patched.call_count, 3)
+
+    def test_other_backends_use_authenticate(self):
+        from django.contrib.auth import authenticate
+        from django.test import override_settings
+        from server.password import MODEL_BACKEND, PasswordVerifier
+
+        verifier = self.use_verifier(PasswordVerifier(1, 4, 5, start_method='spawn'))
+        backends = [MODEL_BACKEND, 'django.contrib.auth.backends.AllowAllUsersModelBackend']
+        with override_settings(AUTHENTICATION_BACKENDS=backends), \
+                mock.patch('server.password.authenticate', wraps=authenticate) as patched:
+            self.assertEqual(self.login('eecs', 'eecs1234').status_code, 200)
+        self.assertEqual(patched.call_count, 1)
+        self.assertEqual(verifier.bulkhead.admitted, 0)
+
+    def test_outdated_hash_upgraded_in_same_call(self):
+        from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password
+        from server.password import verify_password
+
+        outdated = PBKDF2PasswordHasher().encode('eecs1234', 'salt', iterations=1000)
+        valid, updated, _ = verify_password('eecs1234', outdated)
+        self.assertTrue(valid)
+        self.assertNotEqual(updated, outdated)
+        self.assertTrue(check_password('eecs1234', updated))
+        self.assertEqual(verify_password('wrong', outdated)[:2], (False, None))
+        self.assertEqual(verify_password('eecs1234', None)[:2], (False, None))
+
+
+class TokenClaimsTests(TransactionTestCase):
+    """
+    AUTH_TOKEN_CLAIMS：认证和/auth/user/info使用token中的claims，角色或负责的专业变化后旧token返回401。
+    每次修改都模拟在事务提交之前有请求用旧数据重新写入了token_version，提交后仍然要失效
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth import login
+        from server.password import PasswordVerifier
+
+        self.user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        self.other = DjangoUser.objects.create_user('other', password='eecs1234')
+        self.user_role = UserRole.objects.create(role=Role.objects.create(name='专业负责人'), user=self.user)
+        self.major = Major.objects.create(manager=self.user, code='0001', name='专业')
+        for patcher in (
+            mock.patch.object(Config, 'AUTH_TOKEN_CLAIMS', True),
+            mock.patch.object(login, 'password_verifier', PasswordVerifier(0)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+        self.recorder = QueryRecorder()
+
+    def login(self) -> dict:
+        response = self.client.post('/auth/token', data={'username': 'eecs', 'password': 'eecs1234'})
+        self.assertEqual(response.status_code, 200)
+        return {'Authorization': f"Bearer {response.json()['auth_token']}"}
+
+    @contextmanager
+    def stale_refill(self):
+        """
+        在事务中修改数据，提交之前把旧的token_version写回缓存，和并发的请求读到旧数据时一样
+        """
+        from server.auth.claims import current_token_version
+        from server.database.cache import cache, token_version_key
+
+        stale = current_token_version(self.user.id)
+        with transaction.atomic():
+            yield
+            cache.set(token_version_key(self.user.id), stale)
+
+    def test_claims_served_without_queries(self):
+        headers = self.login()
+        self.client.get('/auth/user/info', headers=headers)
+        with self.recorder.capture():
+            response = self.client.get('/auth/user/info', headers=headers)
+            owned = self.client.get(f'/api/major/point1?major_id={self.major.id}', headers=headers)
+        self.assertEqual(response.json()['roles'], ['专业负责人'])
+        self.assertEqual(owned.status_code, 200)
+        # 只有毕业要求列表本身的两次查询（版本和当前页）
+        self.assertEqual(len(self.recorder.queries), 2, self.recorder.report())
+
+    def test_removed_role_invalidates_token(self):
+        headers = self.login()
+        self.assertEqual(self.client.get('/auth/user/info', headers=headers).status_code, 200)
+        with self.stale_refill():
+            self.user_role.delete()
+        self.assertEqual(self.client.get('/auth/user/info', headers=headers).status_code, 401)
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.login()).json()['roles'], [])
+
+    def test_changed_manager_invalidates_token(self):
+        headers = self.login()
+        url = f'/api/major/point1?major_id={self.major.id}'
+        self.assertEqual(self.client.get(url, headers=headers).status_code, 200)
+        with self.stale_refill():
+            self.major.manager = self.other
+            self.major.save()
+        self.assertEqual(self.client.get(url, headers=headers).status_code, 401)
+        self.assertEqual(self.client.get(url, headers=self.login()).status_code, 404)
+
+
+class TokenRevocationTests(TransactionTestCase):
+    """
+    /auth/logout吊销token，认证时只查进程内的吊销列表
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        DjangoUser.objects.create_user('eecs', password='eecs1234')
+        self.manager = manager
+        self.client = TestClient(app)
+
+    def headers(self, token: str) -> dict:
+        return {'Authorization': f'Bearer {token}'}
+
+    def test_logout_revokes_token(self):
+        token = self.manager.create_access_token(data=dict(sub='eecs'))
+        other = self.manager.create_access_token(data=dict(sub='eecs'))
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.headers(token)).status_code, 200)
+        self.assertEqual(self.client.post('/auth/logout', headers=self.headers(token)).json(), {'code': 20000})
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.headers(token)).status_code, 401)
+        self.assertEqual(self.client.post('/auth/logout', headers=self.headers(token)).status_code, 401)
+        # 同一个用户的其他token不受影响
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.headers(other)).status_code, 200)
+        self.assertEqual(self.client.post('/auth/logout').status_code, 401)
+
+    def test_token_without_jti_still_accepted(self):
+        import jwt
+
+        payload = {'sub': 'eecs', 'exp': datetime.utcnow() + timedelta(minutes=5)}
+        token = jwt.encode(payload, str(self.manager.secret), self.manager.algorithm).decode()
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.headers(token)).status_code, 200)
+        self.assertEqual(self.client.post('/auth/logout', headers=self.headers(token)).status_code, 200)
+        self.assertEqual(self.client.get('/auth/user/info', headers=self.headers(token)).status_code, 200)
+
+    def test_expired_entries_purged(self):
+        from server.auth.revocation import RevocationList
+
+        revocations = RevocationList()
+        now = time.time()
+        revocations.revoke('expired', now - 1)
+        revocations.revoke('live', now + 60)
+        revocations.revoke('live', now + 60)
+        self.assertFalse(revocations.is_revoked('expired'))
+        self.assertTrue(revocations.is_revoked('live'))
+        self.assertEqual(revocations.stats(), {'revoked': 1})
+        self.assertEqual(len(revocations._expiry), 1)
+
+    @skipUnless(fakeredis is not None, "需要fakeredis")
+    def test_revocations_shared_through_redis(self):
+        from server.auth.revocation import RevocationList
+
+        server = fakeredis.FakeServer()
+        first = RevocationList(fakeredis.FakeRedis(server=server))
+        second = RevocationList(fakeredis.FakeRedis(server=server))
+        exp = time.time() + 60
+        first.revoke('a', exp)
+        first.revoke('expired', time.time() - 1)
+        self.assertFalse(second.is_revoked('a'))
+        # 启动时和定时同步从有序集合加载，过期的不加载
+        second._sync()
+        self.assertTrue(second.is_revoked('a'))
+        self.assertFalse(second.is_revoked('expired'))
+        # pub/sub的通知
+        second._on_message({'data': f'b {exp}'.encode()})
+        self.assertTrue(second.is_revoked('b'))
+
+
+class LRUCacheTests(SimpleTestCase):
+    """
+    LoginManager的用户缓存：命中、未命中、淘汰和过期的计数
+    """
+
+    def test_hits_misses_and_evictions(self):
+        from server.database.lru_cache import LRUCache
+
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b最久未使用，写入c时被淘汰
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'size': 2, 'max_size': 2, 'hits': 2, 'misses': 1, 'evictions': 1, 'expirations': 0,
+        })
+
+    def test_expiration(self):
+        from server.database.lru_cache import LRUCache
+
+        now = [100.0]
+        with mock.patch('server.database.lru_cache.time.monotonic', lambda: now[0]):
+            cache = LRUCache(max_size=4, ttl=10)
+            cache.set('a', 1)
+            cache.set('b', 2, ttl=30)
+            now[0] += 10
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_discard_if(self):
+        from server.database.lru_cache import LRUCache
+
+        cache = LRUCache(max_size=4)
+        for key in range(4):
+            cache.set(key, key * 10)
+        cache.discard_if(lambda key, value: value >= 20)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(1), 10)
+
+
+class UserCacheTests(TransactionTestCase):
+    """
+    缓存的登录用户：重复请求不查询数据库，在admin中修改用户后立即失效
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        self.user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        token = manager.create_access_token(data=dict(sub=self.user.username))
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.client = TestClient(app)
+        self.recorder = QueryRecorder()
+
+    def test_cached_user_reused(self):
+        self.assertEqual(self.client.get('/auth/protected', headers=self.headers).json(), 'eecs')
+        with self.recorder.capture():
+            self.assertEqual(self.client.get('/auth/protected', headers=self.headers).status_code, 200)
+        self.assertEqual(self.recorder.queries, [])
+
+    def test_deactivated_user_rejected_immediately(self):
+        self.assertEqual(self.client.get('/auth/protected', headers=self.headers).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/protected', headers=self.headers).status_code, 401)
+
+    def test_deleted_user_rejected(self):
+        self.assertEqual(self.client.get('/auth/protected', headers=self.headers).status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.client.get('/auth/protected', headers=self.headers).status_code, 401)
+
+
+class TokenCacheTests(TransactionTestCase):
+    """
+    TOKEN_CACHE_SIZE：缓存的payload到token的exp为止，吊销和token_version的检查在缓存之后仍然执行
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+        from server.database.lru_cache import LRUCache
+
+        self.user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        self.manager = manager
+        patcher = mock.patch.object(manager, 'token_cache', LRUCache(16))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+
+    def get_info(self, token: str):
+        return self.client.get('/auth/user/info', headers={'Authorization': f'Bearer {token}'})
+
+    def test_cached_token_expires_at_exp(self):
+        import jwt.api_jwt
+
+        token = self.manager.create_access_token(data=dict(sub='eecs'), expires_delta=timedelta(minutes=5))
+        self.assertEqual(self.get_info(token).status_code, 200)
+        self.assertEqual(len(self.manager.token_cache), 1)
+
+        later = datetime.utcnow() + timedelta(minutes=6)
+
+        class Later(datetime):
+            @classmethod
+            def utcnow(cls):
+                return later
+
+        monotonic = time.monotonic() + 6 * 60
+        with mock.patch('server.database.lru_cache.time.monotonic', lambda: monotonic), \
+                mock.patch.object(jwt.api_jwt, 'datetime', Later):
+            self.assertEqual(self.get_info(token).status_code, 401)
+        self.assertEqual(len(self.manager.token_cache), 0)
+
+    def test_cached_token_revoked(self):
+        token = self.manager.create_access_token(data=dict(sub='eecs'))
+        self.assertEqual(self.get_info(token).status_code, 200)
+        self.client.post('/auth/logout', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(len(self.manager.token_cache), 1)
+        self.assertEqual(self.get_info(token).status_code, 401)
+
+    def test_cached_token_version_bumped(self):
+        from server.auth.claims import token_claims
+
+        token = self.manager.create_access_token(data=dict(sub='eecs', **token_claims(self.user.id)))
+        self.assertEqual(self.get_info(token).status_code, 200)
+        UserRole.objects.create(role=Role.objects.create(name='专业负责人'), user=self.user)
+        self.assertEqual(len(self.manager.token_cache), 1)
+        self.assertEqual(self.get_info(token).status_code, 401)
+
+
+class AsyncLoginManagerTests(SimpleTestCase):
+    """
+    AsyncLoginManager：token在事件循环中验证，缓存未命中时在自己的线程池中加载用户
+    """
+
+    def setUp(self):
+        from server.auth.my_fastapi_login import AsyncLoginManager
+
+        self.manager = AsyncLoginManager('secret', tokenUrl='/auth/token', executor_workers=2, user_cache_size=16)
+        self.addCleanup(self.manager.shutdown)
+        self.loaded = []
+
+        @self.manager.user_loader
+        def load_user(username):
+            self.loaded.append((username, threading.current_thread().name))
+            return {'username': username} if username != 'nobody' else None
+
+    def token(self, username: str) -> str:
+        return self.manager.create_access_token(data=dict(sub=username))
+
+    def test_user_loaded_in_executor_and_cached(self):
+        token = self.token('eecs')
+        self.assertEqual(run_async(self.manager.get_current_user(token)), {'username': 'eecs'})
+        self.assertEqual(run_async(self.manager.get_current_user(token)), {'username': 'eecs'})
+        self.assertEqual(len(self.loaded), 1)
+        self.assertTrue(self.loaded[0][1].startswith('login-manager'))
+
+    def test_coroutine_loader(self):
+        @self.manager.user_loader
+        async def load_user(username):
+            return {'username': username, 'async': True}
+
+        self.assertTrue(run_async(self.manager.get_current_user(self.token('eecs')))['async'])
+
+    def test_invalid_token_and_missing_user(self):
+        from fastapi.exceptions import HTTPException
+
+        for token in ('not-a-token', self.token('nobody')):
+            with self.subTest(token=token), self.assertRaises(HTTPException) as raised:
+                run_async(self.manager.get_current_user(token))
+            self.assertEqual(raised.exception.status_code, 401)
+
+    def test_shutdown_and_reuse(self):
+        executor = self.manager.executor
+        self.manager.shutdown()
+        self.assertTrue(executor._shutdown)
+        # 再次使用时重新创建线程池
+        self.assertEqual(run_async(self.manager.get_current_user(self.token('eecs'))), {'username': 'eecs'})
+        self.assertIsNot(self.manager.executor, executor)
+
+
+@skipUnless(fakeredis is not None, "需要fakeredis")
+class RedisCacheTests(SimpleTestCase):
+    """
+    RedisCache：批量读写、进程内缓存以及通过pub/sub在worker之间同步失效
+    """
+
+    def make_cache(self, server, start: bool = True):
+        from server.database.cache import RedisCache
+
+        cache = RedisCache(client=fakeredis.FakeRedis(server=server), local_ttl=60)
+        if start:
+            cache.start()
+            self.addCleanup(cache._subscriber.stop)
+        return cache
+
+    def wait_for(self, condition, timeout: float = 5) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_set_many_and_get_many(self):
+        cache = self.make_cache(fakeredis.FakeServer(), start=False)
+        cache.set_many({'a': 1, 'b': [2]})
+        with mock.patch.object(cache.client, 'mget', wraps=cache.client.mget) as mget:
+            self.assertEqual(cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': [2]})
+        # 三个key只读一次Redis
+        mget.assert_called_once()
+        self.assertEqual(cache.get_or_load('c', lambda: 3), 3)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_local_layer_only_after_start(self):
+        cache = self.make_cache(fakeredis.FakeServer(), start=False)
+        cache.set('a', 1)
+        self.assertEqual(cache.local_ttl, 0)
+        self.assertIsNone(cache._local.get('a'))
+        cache.start()
+        self.addCleanup(cache._subscriber.stop)
+        cache.set('a', 1)
+        self.assertEqual(cache._local.get('a'), 1)
+
+    def test_invalidation_reaches_other_worker(self):
+        server = fakeredis.FakeServer()
+        first, second = self.make_cache(server), self.make_cache(server)
+        invalidated = []
+        second.add_invalidation_listener(invalidated.append)
+        first.set('user:eecs', 'old')
+        self.assertEqual(second.get('user:eecs'), 'old')
+        self.assertEqual(second._local.get('user:eecs'), 'old')
+        first.invalidate('user:eecs')
+        self.assertTrue(self.wait_for(lambda: invalidated == ['user:eecs']))
+        self.assertIsNone(second._local.get('user:eecs'))
+        self.assertIsNone(second.get('user:eecs'))
+
+
+class UserRenameTests(TransactionTestCase):
+    """
+    用户改名后，旧用户名的token不能再通过缓存中的旧用户认证
+    """
+
+    def test_old_username_invalidated(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        token = manager.create_access_token(data=dict(sub='eecs'))
+        headers = {'Authorization': f'Bearer {token}'}
+        client = TestClient(app)
+        self.assertEqual(client.get('/auth/protected', headers=headers).status_code, 200)
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(client.get('/auth/protected', headers=headers).status_code, 401)
+
+
+class ApiTestCase(TransactionTestCase):
+    """
+    以专业负责人eecs的身份请求/api下的接口
+    """
+
+    def setUp(self):
+        from starlette.testclient import TestClient
+        from server.main import app
+        from server.auth.login import manager
+
+        self.user = DjangoUser.objects.create_user('eecs', password='eecs1234')
+        self.other = DjangoUser.objects.create_user('other', password='eecs1234')
+        token = manager.create_access_token(data=dict(sub=self.user.username))
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.client = TestClient(app)
+        self.major = Major.objects.create(manager=self.user, code='0001', name='专业')
+
+    def get(self, url: str, **kwargs):
+        return self.client.get(url, headers={**self.headers, **kwargs.pop('headers', {})}, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.client.post(url, headers=self.headers, **kwargs)
+
+
+class OutcomeTreeTests(ApiTestCase):
+    """
+    /api/major/{major_id}/tree：按编号排序的毕业要求及其分解指标点，ETag包含分解指标点的版本
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 按乱序创建，检查返回的顺序
+        for index in (3, 1, 2):
+            point1 = Point1.objects.create(major=self.major, index=index, content=f'毕业要求{index}')
+            for sub_index in (2, 1):
+                Point2.objects.create(point1=point1, index=sub_index, content=f'分解指标点{index}.{sub_index}')
+        other_major = Major.objects.create(manager=self.other, code='0002', name='其他专业')
+        Point1.objects.create(major=other_major, index=1, content='其他专业的毕业要求')
+        self.url = f'/api/major/{self.major.id}/tree'
+
+    def test_tree_content_and_order(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([item['index'] for item in data['items']], [1, 2, 3])
+        for item in data['items']:
+            self.assertEqual(item['content'], f"毕业要求{item['index']}")
+            self.assertEqual(
+                [(child['index'], child['content']) for child in item['children']],
+                [(1, f"分解指标点{item['index']}.1"), (2, f"分解指标点{item['index']}.2")],
+            )
+            self.assertEqual(set(item['children'][0]), {'id', 'index', 'content'})
+
+    def test_other_major_not_found(self):
+        other_major = Major.objects.get(code='0002')
+        self.assertEqual(self.get(f'/api/major/{other_major.id}/tree').status_code, 404)
+
+    def test_etag_changes_when_nested_point2_edited(self):
+        etag = self.get(self.url).headers['ETag']
+        self.assertEqual(self.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+        point2 = Point2.objects.filter(point1__major=self.major).first()
+        response = self.post('/api/major/point2/update/content', params={'point2_id': point2.id, 'content': '修改后'})
+        self.assertEqual(response.json()['code'], 20000)
+        response = self.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('修改后', [child['content'] for item in response.json()['data']['items'] for child in item['children']])
+
+        etag = response.headers['ETag']
+        self.post('/api/major/point2/delete', params={'point2_id': point2.id})
+        self.assertEqual(self.get(self.url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class BatchEndpointTests(ApiTestCase):
+    """
+    /api/major/*/batch/*：每个条目单独报告失败，其余条目在一个事务中写入，写入冲突时整批回滚
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.point1 = Point1.objects.create(major=self.major, index=5, content='已有的毕业要求')
+        other_major = Major.objects.create(manager=self.other, code='0002', name='其他专业')
+        self.other_point1 = Point1.objects.create(major=other_major, index=1, content='其他专业的毕业要求')
+
+    def failed_positions(self, response) -> list:
+        return [item['position'] for item in response.json()['data']['failed']]
+
+    def test_create_point1_reports_each_failure(self):
+        response = self.post(f'/api/major/point1/batch/create?major_id={self.major.id}', json=[
+            # 其他专业已经使用的序号在本专业可以使用
+            {'index': 1, 'content': 'a'},
+            {'index': 1, 'content': '本批中重复'},
+            {'index': 5, 'content': '已存在'},
+            {'index': 2, 'content': 'b'},
+        ])
+        self.assertEqual(response.json()['code'], 40001)
+        self.assertEqual(response.json()['data']['succeeded'], 2)
+        self.assertEqual(self.failed_positions(response), [1, 2])
+        self.assertEqual(
+            list(Point1.objects.filter(major=self.major).values_list('index', 'content')),
+            [(1, 'a'), (2, 'b'), (5, '已有的毕业要求')],
+        )
+
+    def test_create_point1_in_other_major(self):
+        other_major = Major.objects.get(code='0002')
+        response = self.post(f'/api/major/point1/batch/create?major_id={other_major.id}', json=[
+            {'index': 9, 'content': 'x'},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Point1.objects.filter(index=9).exists())
+
+    def test_create_point2_across_point1(self):
+        response = self.post('/api/major/point2/batch/create', json=[
+            {'point1_id': self.point1.id, 'index': 1, 'content': 'a'},
+            {'point1_id': self.other_point1.id, 'index': 1, 'content': '不属于当前用户'},
+            {'point1_id': self.point1.id, 'index': 1, 'content': '本批中重复'},
+        ])
+        self.assertEqual(response.json()['data']['succeeded'], 1)
+        self.assertEqual(self.failed_positions(response), [1, 2])
+        self.assertEqual(Point2.objects.count(), 1)
+
+    def test_update_and_delete(self):
+        point2 = Point2.objects.create(point1=self.point1, index=1, content='a')
+        other_point2 = Point2.objects.create(point1=self.other_point1, index=1, content='other')
+        modified = point2.create_time
+        response = self.post('/api/major/point2/batch/update/content', json=[
+            {'id': point2.id, 'content': '修改后'},
+            {'id': other_point2.id, 'content': '不属于当前用户'},
+            {'id': point2.id, 'content': '重复'},
+        ])
+        self.assertEqual(self.failed_positions(response), [1, 2])
+        point2.refresh_from_db()
+        self.assertEqual(point2.content, '修改后')
+        self.assertGreater(point2.create_time, modified)
+        other_point2.refresh_from_db()
+        self.assertEqual(other_point2.content, 'other')
+
+        response = self.post('/api/major/point1/batch/delete', json=[self.point1.id, self.other_point1.id, 0])
+        self.assertEqual(response.json()['data']['succeeded'], 1)
+        self.assertEqual(self.failed_positions(response), [1, 2])
+        self.assertFalse(Point1.objects.filter(id=self.point1.id).exists())
+        self.assertFalse(Point2.objects.filter(id=point2.id).exists())
+        self.assertTrue(Point2.objects.filter(id=other_point2.id).exists())
+
+    def test_conflicting_write_rolls_back_whole_batch(self):
+        bulk_create = Point1.objects.bulk_create
+
+        def concurrent_bulk_create(rows):
+            # 检查之后、写入之前，并发的请求使用了同一个序号
+            Point1.objects.create(major=self.major, index=rows[-1].index, content='并发写入')
+            return bulk_create(rows)
+
+        with mock.patch.object(Point1.objects, 'bulk_create', side_effect=concurrent_bulk_create):
+            response = self.post(f'/api/major/point1/batch/create?major_id={self.major.id}', json=[
+                {'index': 1, 'content': 'a'},
+                {'index': 5, 'content': '已存在'},
+                {'index': 2, 'content': 'b'},
+            ])
+        data = response.json()['data']
+        self.assertEqual(response.json()['code'], 40001)
+        self.assertEqual(data['succeeded'], 0)
+        self.assertEqual(self.failed_positions(response), [0, 1, 2])
+        self.assertEqual(data['failed'][0]['detail'], '序号冲突，请重试')
+        # 本批中没有写入任何条目
+        self.assertEqual(list(Point1.objects.filter(major=self.major).values_list('index', flat=True)), [5])
+
+
+class CursorTests(SimpleTestCase):
+    """
+    分页游标的编码和解码
+    """
+
+    def test_round_trip(self):
+        from server.routers.pagination import decode_cursor, encode_cursor
+
+        for last_id in (0, 1, 123456789):
+            with self.subTest(last_id=last_id):
+                cursor = encode_cursor(last_id)
+                self.assertNotIn(str(last_id), cursor)
+                self.assertEqual(decode_cursor(cursor), last_id)
+
+    def test_malformed_cursor(self):
+        import base64
+        from fastapi.exceptions import HTTPException
+        from server.routers.pagination import decode_cursor
+
+        malformed = ['abc', '%%%', base64.urlsafe_b64encode(b'pk:1').decode(),
+                     base64.urlsafe_b64encode(b'id:x').decode(), base64.urlsafe_b64encode(b'\xff\xfe').decode()]
+        for cursor in malformed:
+            with self.subTest(cursor=cursor), self.assertRaises(HTTPException) as raised:
+                decode_cursor(cursor)
+            self.assertEqual(raised.exception.status_code, 400)
+
+
+class PaginationTests(ApiTestCase):
+    """
+    列表接口的keyset分页：多取一条判断has_more，只有with_total时才返回总数
+    """
+
+    def setUp(self):
+        super().setUp()
+        Major.objects.bulk_create(Major(manager=self.user, code=f'1{i:03d}', name=f'专业{i}') for i in range(4))
+        Major.objects.create(manager=self.other, code='2000', name='其他专业')
+        self.ids = list(Major.objects.filter(manager=self.user).order_by('id').values_list('id', flat=True))
+
+    def pages(self, limit: int) -> list:
+        pages, after = [], None
+        while True:
+            params = {'limit': limit, **({'after': after} if after else {})}
+            data = self.get('/api/major/majors', params=params).json()['data']
+            pages.append(data)
+            if not data['has_more']:
+                return pages
+            after = data['after']
+
+    def test_pages_cover_all_items_in_order(self):
+        pages = self.pages(limit=2)
+        self.assertEqual([len(page['items']) for page in pages], [2, 2, 1])
+        self.assertEqual([item['id'] for page in pages for item in page['items']], self.ids)
+        self.assertIsNone(pages[-1]['after'])
+        self.assertTrue(all(page['total'] is None for page in pages))
+
+    def test_exact_multiple_has_no_empty_page(self):
+        self.assertEqual([len(page['items']) for page in self.pages(limit=len(self.ids))], [len(self.ids)])
+
+    def test_total(self):
+        data = self.get('/api/major/majors', params={'limit': 2, 'with_total': 'true'}).json()['data']
+        self.assertEqual(data['total'], 5)
+        self.assertTrue(data['has_more'])
+
+    def test_malformed_cursor_returns_400(self):
+        self.assertEqual(self.get('/api/major/majors', params={'after': 'abc'}).status_code, 400)
+        self.assertEqual(self.get('/api/major/majors', params={'limit': 0}).status_code, 422)
+
+
+class ExportTests(ApiTestCase):
+    """
+    /api/major/export：按专业、毕业要求序号、分解指标点序号排序的流式导出，只包含自己负责的专业
+    """
+
+    def setUp(self):
+        super().setUp()
+        second = Major.objects.create(manager=self.user, code='0002', name='专业二')
+        Point1.objects.create(major=second, index=1, content='毕业要求二.1')
+        for index in (2, 1):
+            point1 = Point1.objects.create(major=self.major, index=index, content=f'毕业要求{index}')
+            if index == 1:
+                for sub_index in (2, 1):
+                    Point2.objects.create(point1=point1, index=sub_index, content=f'分解指标点1.{sub_index}')
+        other_major = Major.objects.create(manager=self.other, code='0003', name='其他专业')
+        Point1.objects.create(major=other_major, index=1, content='其他专业的毕业要求')
+        self.expected = [
+            ('0001', '专业', 1, '毕业要求1', 1, '分解指标点1.1'),
+            ('0001', '专业', 1, '毕业要求1', 2, '分解指标点1.2'),
+            # 没有分解指标点的毕业要求也输出一行
+            ('0001', '专业', 2, '毕业要求2', None, None),
+            ('0002', '专业二', 1, '毕业要求二.1', None, None),
+        ]
+
+    def test_ndjson_content_and_order(self):
+        from server.routers.major_export import EXPORT_KEYS
+
+        response = self.get('/api/major/export')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        self.assertIn('majors.ndjson', response.headers['content-disposition'])
+        lines = response.content.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [dict(zip(EXPORT_KEYS, row)) for row in self.expected])
+
+    def test_csv_content_and_order(self):
+        from server.routers.major_export import CSV_HEADER
+
+        response = self.get(f'/api/major/{self.major.id}/export', params={'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertTrue(text.startswith('\ufeff'))
+        rows = list(csv.reader(io.StringIO(text[1:])))
+        self.assertEqual(rows[0], list(CSV_HEADER))
+        expected = [['' if value is None else str(value) for value in row] for row in self.expected[:3]]
+        self.assertEqual(rows[1:], expected)
+
+    def test_other_major_forbidden(self):
+        other_major = Major.objects.get(code='0003')
+        self.assertNotEqual(self.get(f'/api/major/{other_major.id}/export').status_code, 200)
+
+    def test_abandoned_export_closes_source(self):
+        from server.routers.major_export import _stream_in_thread
+
+        closed = threading.Event()
+
+        def chunks():
+            try:
+                for i in range(100):
+                    yield str(i)
+            finally:
+                closed.set()
+
+        async def read_first():
+            stream = _stream_in_thread(chunks(), max_pending=1)
+            first = await stream.__anext__()
+            await stream.aclose()
+            return first
+
+        self.assertEqual(run_async(read_first()), '0')
+        # 生产者在线程池中运行，关闭后很快退出并关闭chunks
+        self.assertTrue(closed.wait(5))
+
+
+class ConditionalRequestTests(ApiTestCase):
+    """
+    列表接口的ETag：弱ETag，未修改时返回304，数据或参数变化时ETag随之变化
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.point1 = Point1.objects.create(major=self.major, index=1, content='毕业要求1')
+        self.url = f'/api/major/point1?major_id={self.major.id}'
+
+    def test_not_modified(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        # 客户端去掉W/或在列表中发送也视为匹配
+        self.assertEqual(self.get(self.url, headers={'If-None-Match': f'"x", {etag[2:]}'}).status_code, 304)
+
+    def test_same_etag_for_gzip_and_identity(self):
+        Point1.objects.bulk_create(Point1(major=self.major, index=i, content='毕业要求' * 50) for i in range(2, 20))
+        identity = self.get(self.url, headers={'Accept-Encoding': 'identity'})
+        gzipped = self.get(self.url, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('content-encoding', identity.headers)
+        self.assertEqual(gzipped.headers['content-encoding'], 'gzip')
+        self.assertEqual(identity.headers['ETag'], gzipped.headers['ETag'])
+        self.assertTrue(identity.headers['ETag'].startswith('W/'))
+
+    def test_etag_changes_with_version_and_params(self):
+        etag = self.get(self.url).headers['ETag']
+        self.assertNotEqual(self.get(self.url, params={'limit': 1}).headers['ETag'], etag)
+        Point1.objects.create(major=self.major, index=2, content='毕业要求2')
+        response = self.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        etag = response.headers['ETag']
+        Point1.objects.filter(index=2).delete()
+        self.assertEqual(self.get(self.url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class PointIndexTests(ApiTestCase):
+    """
+    毕业要求和分解指标点的序号在所属的专业/毕业要求内唯一，列表按序号分页
+    """
+
+    def create_point1(self, index: int, major_id: int = None):
+        params = {'index': index, 'content': f'毕业要求{index}', 'major_id': major_id or self.major.id}
+        return self.post('/api/major/point1/create', params=params).json()
+
+    def test_duplicate_index_rejected_by_unique_index(self):
+        self.assertEqual(self.create_point1(1)['code'], 20000)
+        self.assertEqual(self.create_point1(1)['code'], 40001)
+        # 其他专业可以使用相同的序号
+        second = Major.objects.create(manager=self.user, code='0002', name='专业二')
+        self.assertEqual(self.create_point1(1, second.id)['code'], 20000)
+        point1 = Point1.objects.get(major=self.major, index=1)
+        params = {'index': 1, 'content': '分解指标点', 'point1_id': point1.id}
+        self.assertEqual(self.post('/api/major/point2/create', params=params).json()['code'], 20000)
+        self.assertEqual(self.post('/api/major/point2/create', params=params).json()['code'], 40001)
+        self.assertEqual(Point1.objects.filter(major=self.major).count(), 1)
+        self.assertEqual(Point2.objects.filter(point1=point1).count(), 1)
+
+    def test_concurrent_create_returns_40001(self):
+        from django.db.models import QuerySet
+
+        # 模拟两个请求同时通过检查：第二次创建时唯一索引冲突，不应返回500
+        self.assertEqual(self.create_point1(1)['code'], 20000)
+        with mock.patch.object(QuerySet, 'count', return_value=0), \
+                mock.patch.object(QuerySet, 'exists', return_value=False):
+            self.assertEqual(self.create_point1(1)['code'], 40001)
+
+    def test_list_paginated_by_index(self):
+        for index in (3, 1, 4, 2, 5):
+            self.create_point1(index)
+        pages, after = [], None
+        while True:
+            params = {'major_id': self.major.id, 'limit': 2, **({'after': after} if after else {})}
+            data = self.get('/api/major/point1', params=params).json()['data']
+            pages.append([item['index'] for item in data['items']])
+            if not data['has_more']:
+                break
+            after = data['after']
+        self.assertEqual(pages, [[1, 2], [3, 4], [5]])
+        # 专业列表的id游标不能用于按序号分页的列表
+        from server.routers.pagination import encode_cursor
+        params = {'major_id': self.major.id, 'after': encode_cursor(1)}
+        self.assertEqual(self.get('/api/major/point1', params=params).status_code, 400)
+
+
+class AsyncEndpointTests(ApiTestCase):
+    """
+    /api/async/major下的tortoise-orm版本的接口，与Django连接同一个测试库
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from tortoise import Tortoise
+
+        super().setUpClass()
+        settings = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            # 不切换为WAL模式，测试库删除后不留下-wal和-shm文件
+            db_url = f"sqlite://{settings['NAME']}?journal_mode=delete"
+        else:
+            db_url = (f"postgres://{settings['USER']}:{settings['PASSWORD']}@{settings['HOST']}:{settings['PORT']}"
+                      f"/{settings['NAME']}")
+        run_async(Tortoise.init(db_url=db_url, modules={'models': ['server.database.ps.models']}))
+
+    @classmethod
+    def tearDownClass(cls):
+        from tortoise import Tortoise
+
+        run_async(Tortoise.close_connections())
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        for index in (2, 1, 3):
+            point1 = Point1.objects.create(major=self.major, index=index, content=f'毕业要求{index}')
+            Point2.objects.create(point1=point1, index=1, content=f'分解指标点{index}.1')
+        other_major = Major.objects.create(manager=self.other, code='0002', name='其他专业')
+        self.other_point1 = Point1.objects.create(major=other_major, index=1, content='其他专业的毕业要求')
+
+    def test_models_map_to_django_tables(self):
+        from server.database.ps import models as ps
+
+        async def load():
+            major = await ps.Major.get(id=self.major.id).prefetch_related('manager')
+            point2 = await ps.Point2.filter(point1__major_id=self.major.id, point1__index=2).first()
+            return major, point2
+
+        major, point2 = run_async(load())
+        self.assertEqual((major.code, major.name, major.manager.username), ('0001', '专业', 'eecs'))
+        self.assertEqual(point2.content, '分解指标点2.1')
+
+    def test_list_and_not_modified(self):
+        url = f'/api/async/major/point1?major_id={self.major.id}'
+        response = self.get(url, params={'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual([item['index'] for item in data['items']], [1, 2])
+        self.assertTrue(data['has_more'])
+        data = self.get(url, params={'limit': 2, 'after': data['after']}).json()['data']
+        self.assertEqual([item['index'] for item in data['items']], [3])
+        etag = self.get(url).headers['ETag']
+        self.assertEqual(self.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        point1 = Point1.objects.get(major=self.major, index=3)
+        point1.content = '修改后的毕业要求'
+        point1.save()
+        self.assertEqual(self.get(url, headers={'If-None-Match': etag}).status_code, 200)
+        majors = self.get('/api/async/major/majors').json()['data']['items']
+        self.assertEqual(majors, [{'id': self.major.id, 'name': '专业'}])
+
+    def test_other_major_not_found(self):
+        self.assertEqual(self.get(f'/api/async/major/point1?major_id={self.other_point1.major_id}').status_code, 404)
+        response = self.post('/api/async/major/point1/delete', params={'point1_id': self.other_point1.id})
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Point1.objects.filter(id=self.other_point1.id).exists())
+
+    def test_create_duplicate_index(self):
+        params = {'index': 4, 'content': '毕业要求4', 'major_id': self.major.id}
+        self.assertEqual(self.post('/api/async/major/point1/create', params=params).json()['code'], 20000)
+        self.assertEqual(self.post('/api/async/major/point1/create', params=params).json()['code'], 40001)
+
+    def test_delete_point1_cascades(self):
+        point1 = Point1.objects.get(major=self.major, index=2)
+        response = self.post('/api/async/major/point1/delete', params={'point1_id': point1.id})
+        self.assertEqual(response.json()['code'], 20000)
+        self.assertFalse(Point1.objects.filter(id=point1.id).exists())
+        self.assertFalse(Point2.objects.filter(point1_id=point1.id).exists())
+        self.assertEqual(Point2.objects.filter(point1__major=self.major).count(), 2)
+
+
+class BulkheadTests(SimpleTestCase):
+    """
+    按路径前缀的并发上限：队列满或排队超时返回503，统计数据见/metrics/bulkheads
+    """
+
+    def make_client(self, **options):
+        from starlette.applications import Starlette
+        from starlette.responses import PlainTextResponse
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+        from server.bulkhead import Bulkhead, BulkheadMiddleware
+
+        async def ok(request):
+            return PlainTextResponse('ok')
+
+        bulkhead = Bulkhead('/slow', **options)
+        app = Starlette(routes=[Route('/slow/page', ok), Route('/fast', ok)])
+        return TestClient(BulkheadMiddleware(app, [bulkhead])), bulkhead
+
+    def test_rejected_when_queue_full(self):
+        client, bulkhead = self.make_client(limit=1, queue=0, timeout=3)
+        run_async(bulkhead.acquire())
+        try:
+            response = client.get('/slow/page')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '3')
+            # 其他前缀不受影响
+            self.assertEqual(client.get('/fast').status_code, 200)
+        finally:
+            bulkhead.release()
+        self.assertEqual(client.get('/slow/page').status_code, 200)
+        stats = bulkhead.stats()
+        self.assertEqual((stats['admitted'], stats['rejected'], stats['timed_out'], stats['active']), (2, 1, 0, 0))
+
+    def test_rejected_when_wait_times_out(self):
+        client, bulkhead = self.make_client(limit=1, queue=1, timeout=0.05)
+        run_async(bulkhead.acquire())
+        try:
+            self.assertEqual(client.get('/slow/page').status_code, 503)
+        finally:
+            bulkhead.release()
+        stats = bulkhead.stats()
+        self.assertEqual((stats['timed_out'], stats['rejected'], stats['queued'], stats['peak_queued']), (1, 0, 0, 1))
+
+    def test_queued_request_admitted_after_release(self):
+        client, bulkhead = self.make_client(limit=1, queue=1, timeout=5)
+        run_async(bulkhead.acquire())
+        asyncio.get_event_loop().call_later(0.05, bulkhead.release)
+        self.assertEqual(client.get('/slow/page').status_code, 200)
+        stats = bulkhead.stats()
+        self.assertEqual((stats['admitted'], stats['active'], stats['queued']), (2, 0, 0))
+        self.assertGreater(stats['wait_seconds_max'], 0)
+
+    def test_metrics_endpoint(self):
+        from starlette.testclient import TestClient
+        from server import main
+
+        static = next(bulkhead for bulkhead in main.bulkheads if bulkhead.name == '/static')
+        client = TestClient(main.app)
+        before = client.get('/metrics/bulkheads').json()
+        self.assertTrue(set(Config.BULKHEADS) <= set(before))
+        self.assertEqual(before['/static']['limit'], Config.BULKHEADS['/static']['limit'])
+
+        # 占满/static的并发，不允许排队
+        with mock.patch.object(static, 'queue', 0):
+            for _ in range(static.limit):
+                run_async(static.acquire())
+            try:
+                self.assertEqual(client.get('/static/admin/css/base.css').status_code, 503)
+                during = client.get('/metrics/bulkheads').json()['/static']
+            finally:
+                for _ in range(static.limit):
+                    static.release()
+        self.assertEqual(during['active'], static.limit)
+        self.assertEqual(during['rejected'], before['/static']['rejected'] + 1)
+        self.assertEqual(during['queue'], 0)
+        self.assertEqual(client.get('/metrics/bulkheads').json()['/static']['active'], 0)
+
+
+class StaticFilesTests(SimpleTestCase):
+    """
+    STATIC_PRECOMPRESSED时collectstatic生成带哈希的文件名和.gz版本，与DEBUG无关，
+    PrecompressedStaticFiles按Accept-Encoding返回压缩版本，带哈希的文件名使用immutable
+    """
+
+    def setUp(self):
+        import tempfile
+        from django.core.management import call_command
+        from django.test import override_settings
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        source, self.root = os.path.join(tmp.name, 'source'), os.path.join(tmp.name, 'static')
+        os.makedirs(os.path.join(source, 'app'))
+        self.css = 'body { color: #333; }\n' * 200
+        with open(os.path.join(source, 'app', 'site.css'), 'w') as f:
+            f.write(self.css)
+        settings = override_settings(
+            DEBUG=True, STATIC_ROOT=self.root, STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATICFILES_STORAGE='djadmin.djadmin.storage.CompressedManifestStaticFilesStorage',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_url_even_with_debug(self):
+        from djadmin.djadmin.storage import CompressedManifestStaticFilesStorage
+
+        storage = CompressedManifestStaticFilesStorage()
+        url = storage.url('app/site.css')
+        self.assertRegex(url, r'^/static/app/site\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.root, url[len('/static/'):] + '.gz')))
+        # 没有collectstatic的文件直接报错，而不是退回到原始文件名
+        with self.assertRaises(ValueError):
+            storage.url('app/missing.css')
+
+    def test_precompressed_immutable_response(self):
+        from starlette.testclient import TestClient
+        from djadmin.djadmin.storage import CompressedManifestStaticFilesStorage
+        from server.static import IMMUTABLE, REVALIDATE, PrecompressedStaticFiles
+
+        hashed = CompressedManifestStaticFilesStorage().url('app/site.css')[len('/static'):]
+        client = TestClient(PrecompressedStaticFiles(self.root))
+
+        response = client.get(hashed, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+        self.assertEqual(response.headers['cache-control'], IMMUTABLE)
+        self.assertEqual(response.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(response.text, self.css)
+        self.assertLess(int(response.headers['content-length']), len(self.css))
+
+        identity = client.get(hashed, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('content-encoding', identity.headers)
+        self.assertEqual(identity.text, self.css)
+        self.assertNotEqual(identity.headers['etag'], response.headers['etag'])
+        not_modified = client.get(hashed, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['etag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+        # 原始文件名的内容可能变化，每次用ETag确认
+        self.assertEqual(client.get('/app/site.css').headers['cache-control'], REVALIDATE)
+        self.assertEqual(client.get('/staticfiles.json').status_code, 404)
+
+
+class ResponseTests(SimpleTestCase):
+    """
+    FastJSONResponse与之前jsonable_encoder + JSONResponse的输出一致，trusted_response带上注入的header，
+    PrefixGZipMiddleware只压缩指定前缀下不小于minimum_size的响应
+    """
+    content = {
+        "code": 20000,
+        "data": {
+            "total": None, "has_more": False, "after": None,
+            "items": [{"id": 1, "index": 2, "content": "毕业要求\n\"引号\"", "ok": True, "score": 1.5,
+                       "create_time": datetime(2020, 11, 28, 10, 1, 2, 345678)}],
+        },
+    }
+
+    def test_same_json_as_before(self):
+        from fastapi.encoders import jsonable_encoder
+        from starlette.responses import JSONResponse
+        from server.routers import responses
+
+        before = json.loads(JSONResponse(jsonable_encoder(self.content)).body)
+        self.assertEqual(json.loads(responses.FastJSONResponse(self.content).body), before)
+        # 未安装orjson时的json版本
+        with mock.patch.object(responses, 'orjson', None):
+            body = responses.FastJSONResponse(self.content).body
+        self.assertEqual(json.loads(body), before)
+        self.assertIn('毕业要求'.encode(), body)
+
+    def test_trusted_response_copies_headers(self):
+        from starlette.responses import Response
+        from server.routers.responses import trusted_response
+
+        injected = Response()
+        injected.headers.update({'ETag': 'W/"v1"', 'Cache-Control': 'private, no-cache'})
+        response = trusted_response(self.content, injected)
+        self.assertEqual(response.headers['etag'], 'W/"v1"')
+        self.assertEqual(response.headers['cache-control'], 'private, no-cache')
+        # 长度和类型由新的响应体决定
+        self.assertEqual(response.headers['content-type'], 'application/json')
+        self.assertEqual(response.headers['content-length'], str(len(response.body)))
+        self.assertNotIn('etag', trusted_response(self.content).headers)
+
+    def test_prefix_gzip_minimum_size(self):
+        import gzip as gzip_module
+        from starlette.applications import Starlette
+        from starlette.responses import PlainTextResponse
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+        from server.compression import PrefixGZipMiddleware
+
+        async def text(request):
+            return PlainTextResponse('x' * int(request.query_params['size']))
+
+        app = Starlette(routes=[Route('/api/text', text), Route('/other/text', text)])
+        client = TestClient(PrefixGZipMiddleware(app, prefixes=('/api',), minimum_size=100, compresslevel=1))
+
+        def get(url: str, size: int, accept: str = 'gzip'):
+            # stream=True时requests不解压，可以检查原始的响应体
+            return client.get(url, params={'size': size}, headers={'Accept-Encoding': accept}, stream=True)
+
+        small = get('/api/text', 99)
+        self.assertNotIn('content-encoding', small.headers)
+        self.assertEqual(small.raw.read(decode_content=False), b'x' * 99)
+
+        large = get('/api/text', 100)
+        self.assertEqual(large.headers['content-encoding'], 'gzip')
+        self.assertEqual(large.headers['vary'], 'Accept-Encoding')
+        body = large.raw.read(decode_content=False)
+        self.assertEqual(int(large.headers['content-length']), len(body))
+        self.assertEqual(gzip_module.decompress(body), b'x' * 100)
+
+        # 其他前缀和不接受gzip的客户端不压缩
+        self.assertNotIn('content-encoding', get('/other/text', 1000).headers)
+        self.assertNotIn('content-encoding', get('/api/text', 1000, accept='identity').headers)
+
+
+class MetricsTests(ApiTestCase):
+    """
+    /metrics的Prometheus文本格式，以及按路由模板统计的请求数、耗时和数据库查询次数
+    """
+
+    def samples(self) -> dict:
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.text.splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                samples[name] = float(value)
+        self.text = response.text
+        return samples
+
+    def test_format_and_values(self):
+        tree = '/api/major/{major_id}/tree'
+        count = 'http_request_duration_seconds_count{method="GET",route="%s",status="%s"}'
+        before = self.samples()
+        for _ in range(2):
+            self.assertEqual(self.client.get('/ping').status_code, 200)
+        self.assertEqual(self.get(f'/api/major/{self.major.id}/tree').status_code, 200)
+        self.assertEqual(self.client.get('/no/such/path').status_code, 404)
+        after = self.samples()
+
+        def delta(name: str) -> float:
+            return after.get(name, 0) - before.get(name, 0)
+
+        for name, kind in (('http_request_duration_seconds', 'histogram'), ('http_requests_in_flight', 'gauge'),
+                           ('http_request_db_queries', 'histogram')):
+            self.assertIn(f'# TYPE {name} {kind}', self.text)
+        self.assertEqual(delta(count % ('/ping', 200)), 2)
+        # 按路由模板而不是实际路径统计
+        self.assertEqual(delta(count % (tree, 200)), 1)
+        self.assertNotIn(f'/api/major/{self.major.id}/tree', self.text)
+        self.assertEqual(delta(count % ('unmatched', 404)), 1)
+        self.assertEqual(after['http_requests_in_flight{route="/ping"}'], 0)
+
+        # 直方图的桶是累计的，+Inf等于总数
+        labels = 'method="GET",route="/ping",status="200"'
+        buckets = [value for name, value in after.items()
+                   if name.startswith('http_request_duration_seconds_bucket{' + labels)]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(after['http_request_duration_seconds_bucket{%s,le="+Inf"}' % labels],
+                         after[count % ('/ping', 200)])
+        self.assertGreater(delta('http_request_duration_seconds_sum{%s}' % labels), 0)
+        # 专业树的请求在线程池中查询了数据库，/ping没有查询
+        self.assertGreaterEqual(delta('http_request_db_queries_sum{route="%s"}' % tree), 2)
+        self.assertEqual(delta('http_request_db_queries_sum{route="/ping"}'), 0)
+        self.assertEqual(delta('http_request_db_queries_bucket{route="/ping",le="0"}'), 2)
+
+    def test_route_name_follows_router_order(self):
+        from starlette.responses import PlainTextResponse
+        from starlette.routing import Mount, Route, Router
+        from server.metrics import MetricsMiddleware
+
+        def endpoint(request):
+            return PlainTextResponse('')
+
+        router = Router(routes=[Route('/items/{item_id}', endpoint), Route('/items/new', endpoint),
+                                Route('/about', endpoint), Mount('/static', app=endpoint)])
+        middleware = MetricsMiddleware(endpoint, router)
+
+        def name(path: str) -> str:
+            return middleware.route_name({'type': 'http', 'path': path, 'method': 'GET'})
+
+        # 与Router一样，先注册的/items/{item_id}优先
+        self.assertEqual(name('/items/new'), '/items/{item_id}')
+        self.assertEqual(name('/about'), '/about')
+        self.assertEqual(name('/static/css/base.css'), '/static')
+        self.assertEqual(name('/other'), 'unmatched')
+        # 之后注册的路由也能匹配
+        router.routes.append(Route('/other', endpoint))
+        self.assertEqual(name('/other'), '/other')
@@ -0,0 +1,85 @@
+"""
+token中自带的用户信息（claims）
+开启AUTH_TOKEN_CLAIMS时，登录返回的token中包含用户id、角色名和负责的专业id，
+认证、/auth/user/info和专业的权限检查直接使用token中的数据，不再查询数据库。
+ver是用户当前状态（是否启用、密码哈希、角色、负责的专业）的摘要，保存在共享缓存中，
+这些数据变化时缓存失效并重新计算，与旧token中的ver不一致，旧token随之失效
+"""
+import hashlib
+import json
+from typing import Iterable, Optional
+
+from django.contrib.auth.models import User as DjangoUser
+
+from djadmin.eecs.models import Major, UserRole
+from server.database.cache import cache, token_version_key
+
+
+def _digest(is_active: bool, password: str, roles: Iterable[str], major_ids: Iterable[int]) -> str:
+    raw = json.dumps([is_active, password, sorted(roles), sorted(major_ids)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def load_claims(user_id: int) -> Optional[dict]:
+    """
+    从数据库中读取用户的claims，共三次查询
+    :param user_id: 用户id
+    :return: {"uid", "roles", "majors", "ver"}，用户不存在或未启用时返回None
+    """
+    user = DjangoUser.objects.filter(id=user_id).values('is_active', 'password').first()
+    if user is None or not user['is_active']:
+        return None
+    roles = list(UserRole.objects.filter(user_id=user_id).values_list('role__name', flat=True))
+    majors = list(Major.objects.filter(manager_id=user_id).order_by('id').values_list('id', flat=True))
+    return {
+        "uid": user_id,
+        "roles": roles,
+        "majors": majors,
+        "ver": _digest(user['is_active'], user['password'], roles, majors),
+    }
+
+
+def token_claims(user_id: int) -> Optional[dict]:
+    """
+    登录时调用，返回要放进token中的claims，同时把版本写入共享缓存，
+    之后的请求不需要再计算版本
+    """
+    claims = load_claims(user_id)
+    if claims is not None:
+        cache.set(token_version_key(user_id), claims["ver"])
+    return claims
+
+
+def current_token_version(user_id: int) -> str:
+    """
+    用户当前的token版本，缓存未命中时查询数据库
+    :return: 版本，用户不存在或未启用时为空字符串（与任何token都不一致）
+    """
+    return cache.get_or_load(
+        token_version_key(user_id),
+        lambda: (load_claims(user_id) or {}).get("ver", "")
+    )
+
+
+class TokenUser:
+    """
+    由token中的claims构造的用户，只有认证和权限检查用到的字段；
+    不是Django的模型，查询时使用manager_id=user.id而不是manager=user
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+    # token中不包含密码哈希
+    password = ""
+
+    def __init__(self, payload: dict):
+        """
+        :param payload: token的payload
+        """
+        self.id = self.pk = payload["uid"]
+        self.username = payload["sub"]
+        self.roles = list(payload["roles"])
+        self.major_ids = frozenset(payload["majors"])
+
+    def __repr__(self):
+        return f"<TokenUser {self.username}>"
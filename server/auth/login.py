@@ -1,30 +1,88 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from djadmin.djadmin.settings import SECRET_KEY
-from server.auth.my_fastapi_login import LoginManager
-from django.contrib import auth
+from config import Config
+from server.auth.my_fastapi_login import LoginManager, AsyncLoginManager
+from server.database.cache import cache, user_key, roles_key, token_version_key
+from server.auth.claims import TokenUser, current_token_version, token_claims
+from server.auth.revocation import RevocationList
+from server.bulkhead import BulkheadRejected
+from server.password import PasswordVerifier
 from django.contrib.auth.models import User as DjangoUser
 from djadmin.eecs.models import UserRole, Role
 from fastapi.security import OAuth2PasswordRequestForm
 from server.auth.my_fastapi_login.exceptions import InvalidCredentialsException
-from fastapi import Depends
+from fastapi import Depends, Request
+from starlette.concurrency import run_in_threadpool
 from datetime import timedelta
 from pydantic import BaseModel, Field
 from typing import List, Any
 
-manager = LoginManager(SECRET_KEY, tokenUrl='/auth/token')
+# 使用共享缓存的Redis同步各worker的登出，未配置Redis时只在当前进程内生效
+revocation_list = RevocationList(getattr(cache, "client", None))
+_manager_options = dict(
+    user_cache_size=Config.USER_CACHE_SIZE, user_cache_ttl=Config.USER_CACHE_TTL,
+    token_cache_size=Config.TOKEN_CACHE_SIZE, revocation_list=revocation_list
+)
+if Config.AUTH_ASYNC:
+    manager = AsyncLoginManager(
+        SECRET_KEY, tokenUrl='/auth/token', executor_workers=Config.AUTH_EXECUTOR_WORKERS, **_manager_options
+    )
+else:
+    manager = LoginManager(SECRET_KEY, tokenUrl='/auth/token', **_manager_options)
+password_verifier = PasswordVerifier(Config.PASSWORD_WORKERS, Config.PASSWORD_QUEUE, Config.PASSWORD_QUEUE_TIMEOUT)
 
 
 @manager.user_loader
 def load_user(username: str) -> DjangoUser:
     """
-    从Django admin中加载用户
+    从Django admin中加载用户，缓存中保存的是用户对象本身，是否启用在每次加载时检查，
+    在admin中停用用户后缓存失效，下一个请求即返回401
     :param username: 用户名
-    :return: 用户对象
+    :return: 用户对象，不存在或未启用时返回None
     """
-    user = DjangoUser.objects.get(username=username)
+    user = cache.get_or_load(user_key(username), lambda: DjangoUser.objects.filter(username=username).first())
+    if user is None or not user.is_active:
+        return None
     return user
 
 
+@manager.claims_loader
+def load_token_user(payload: dict):
+    """
+    由token中的claims构造用户，只检查版本（共享缓存），不查询用户、角色和专业
+    :param payload: token的payload
+    :return: 用户对象，版本与当前版本不一致时返回None
+    """
+    if payload.get("uid") is None or payload["ver"] != current_token_version(payload["uid"]):
+        return None
+    return TokenUser(payload)
+
+
+def _on_cache_invalidate(key: str):
+    """
+    共享缓存中的用户失效时（包括其他worker中的修改），同步删除manager中缓存的用户
+    """
+    if key.startswith(user_key("")):
+        manager.invalidate_user(key[len(user_key("")):])
+    elif key.startswith(token_version_key("")):
+        manager.invalidate_claims(int(key[len(token_version_key("")):]))
+
+
+cache.add_invalidation_listener(_on_cache_invalidate)
+
+
+@receiver([post_save, post_delete], sender=DjangoUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    在Django admin中修改或删除用户后，立即让缓存的用户失效，
+    用户改名时旧用户名对应的缓存也一并删除
+    """
+    if manager.user_cache is not None:
+        manager.user_cache.discard_if(lambda username, user: user.pk == instance.pk)
+
+
 login_router = APIRouter()
 
 
@@ -38,21 +96,33 @@ class LoginResult(BaseModel):
 
 
 @login_router.post('/token', response_model=LoginResult)
-def login(data: OAuth2PasswordRequestForm = Depends()):
+async def login(data: OAuth2PasswordRequestForm = Depends()):
     """
     处理登陆请求的逻辑，请求字段中必须包含username和password字段，若登陆成功则返回一个access_token和token_type,
     目前使用Bearer type的方式做token认证
+    密码在单独的进程池中校验，排队的登录过多时返回503
     :param data: fastapi定义的OAuth2表格格式
     :return:
     """
     username = data.username
     password = data.password
-    django_user = auth.authenticate(username=username, password=password)
+    try:
+        django_user = await password_verifier.authenticate(username, password)
+    except BulkheadRejected:
+        raise HTTPException(
+            status_code=503, detail="登录请求过多，请稍后重试",
+            headers={"Retry-After": str(max(1, int(Config.PASSWORD_QUEUE_TIMEOUT)))}
+        )
     if not django_user:
         raise InvalidCredentialsException
-    username = django_user.username
+    data = dict(sub=django_user.username)
+    if Config.AUTH_TOKEN_CLAIMS:
+        claims = await run_in_threadpool(token_claims, django_user.id)
+        if claims is None:
+            raise InvalidCredentialsException
+        data.update(claims)
     access_token = manager.create_access_token(
-        data=dict(sub=username), expires_delta=timedelta(hours=12)
+        data=data, expires_delta=timedelta(hours=12)
     )  # 12小时到期
     return {'code': 20000, 'auth_token': access_token, 'token_type': 'bearer'}
 
@@ -64,13 +134,14 @@ class LogoutResult(BaseModel):
     code: int = Field(title="代码")
 
 
-@login_router.post('/logout')
-def logout(user=Depends(manager)):
+@login_router.post('/logout', response_model=LogoutResult)
+def logout(request: Request):
     """
-    登出
-    :param user:
+    登出，吊销请求中的token，之后使用该token的请求返回401；未登录或token已失效时返回401
+    :param request:
     :return:
     """
+    manager.revoke_request(request)
     return {'code': 20000}
 
 
@@ -95,7 +166,13 @@ class UserInfo(BaseModel):
 
 @login_router.get('/user/info', response_model=UserInfo)
 def get_user_info(user=Depends(manager)):
-    roles = [each.role.name for each in UserRole.objects.filter(user=user)]
+    # token中带有角色时直接使用
+    roles = getattr(user, "roles", None)
+    if roles is None:
+        roles = cache.get_or_load(
+            roles_key(user.id),
+            lambda: list(UserRole.objects.filter(user_id=user.id).values_list('role__name', flat=True))
+        )
     return {
         "code": 20000,
         "roles": roles,
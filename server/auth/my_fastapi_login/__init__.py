@@ -1,6 +1,7 @@
-from server.auth.my_fastapi_login.fastapi_login import LoginManager
+from server.auth.my_fastapi_login.fastapi_login import LoginManager, AsyncLoginManager
 # 注意！ github
 
 __all__ = [
-    LoginManager
+    LoginManager,
+    AsyncLoginManager,
 ]
@@ -1,4 +1,11 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import time
 import typing
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
 from typing import Callable, Awaitable, Union
 from typing import Optional, Tuple
@@ -10,6 +17,7 @@ from starlette.requests import Request
 from starlette.responses import Response
 from fastapi.exceptions import HTTPException
 from server.auth.my_fastapi_login.exceptions import InvalidCredentialsException
+from server.database.lru_cache import LRUCache
 from starlette.status import HTTP_401_UNAUTHORIZED
 
 
@@ -29,18 +37,25 @@ class LoginManager(OAuth2PasswordBearer):
     """
     改造了github上的fast_api_login,把async版本改成了sync版本
     """
-    def __init__(self, secret: str, tokenUrl: str, algorithm="HS256", use_cookie=False, use_header=True):
+    def __init__(self, secret: str, tokenUrl: str, algorithm="HS256", use_cookie=False, use_header=True,
+                 user_cache_size=0, user_cache_ttl=60, token_cache_size=0, revocation_list=None):
         """
         :param str secret: Secret key used to sign and decrypt the JWT
         :param str algorithm: Should be "HS256" or "RS256" used to decrypt the JWT
         :param str tokenUrl: The url where the user can login to get the token
         :param bool use_cookie: Set if cookies should be checked for the token
         :param bool use_header: Set if headers should be checked for the token
+        :param int user_cache_size: 按sub缓存用户对象的条目数，0表示不缓存
+        :param float user_cache_ttl: 用户缓存的过期时间（秒）
+        :param int token_cache_size: 缓存已验证token的payload的条目数，0表示每次都验证签名
+        :param revocation_list: 已吊销的token（按jti），需要有is_revoked(jti)和revoke(jti, exp)，
+            为None时不支持吊销
         """
         if use_cookie is False and use_header is False:
             raise Exception("use_cookie and use_header are both False one of them needs to be True")
         self.secret = Secret(secret)
         self._user_callback = None
+        self._claims_callback = None
         self.algorithm = algorithm
         self.pwd_context = CryptContext(schemes=["bcrypt"])
         # this is not mandatory as they user may want to user their own
@@ -53,6 +68,13 @@ class LoginManager(OAuth2PasswordBearer):
         self.use_header = use_header
         self.cookie_name = 'access-token'
 
+        # 缓存user_loader的结果，避免每个请求都查一次数据库
+        self.user_cache = LRUCache(user_cache_size, user_cache_ttl) if user_cache_size > 0 else None
+        # 缓存验证过的token，同一个token重复请求时跳过签名验证和解析
+        self.token_cache = LRUCache(token_cache_size) if token_cache_size > 0 else None
+        # 每次认证都检查，只能是进程内的查找
+        self.revocation_list = revocation_list
+
         super().__init__(tokenUrl=tokenUrl, auto_error=True)
 
     @property
@@ -82,6 +104,17 @@ class LoginManager(OAuth2PasswordBearer):
         self._user_callback = callback
         return callback
 
+    def claims_loader(self, callback: Callable) -> Callable:
+        """
+        设置由token中的claims构造用户的函数，参数为token的payload，返回用户对象，
+        claims已经失效（例如版本不一致）时返回None。
+        payload中有ver时使用该函数，不调用user_loader
+        :param Callable callback: The callback which returns the user
+        :return: The callback
+        """
+        self._claims_callback = callback
+        return callback
+
     def get_current_user(self, token: str):
         """
         This decodes the jwt based on the secret and on the algorithm
@@ -93,26 +126,113 @@ class LoginManager(OAuth2PasswordBearer):
         :return: The user object returned by `self._user_callback`
         :raise: HTTPException if the token is invalid or the user is not found
         """
+        payload = self._get_payload(token)
+
+        if self._uses_claims(payload):
+            key = self._claims_key(payload)
+            user = self._get_cached_user(key)
+            if user is None:
+                user = self._load_claims_user_uncached(payload)
+        else:
+            user = self._load_user(payload['sub'])
+
+        if user is None:
+            raise InvalidCredentialsException
+
+        return user
+
+    def _get_identifier(self, token: str) -> typing.Any:
+        """
+        验证token并取出其中的用户标识
+
+        :param str token: The encoded jwt token
+        :return: The identifier stored under the sub key
+        :raise: HTTPException if the token is invalid
+        """
+        return self._get_payload(token)['sub']
+
+    def _get_payload(self, token: str) -> dict:
+        """
+        验证token并返回payload，payload中必须有sub，并且token没有被吊销
+
+        :param str token: The encoded jwt token
+        :return: The payload of the token
+        :raise: HTTPException if the token is invalid or revoked
+        """
         try:
-            payload = jwt.decode(
-                token,
-                str(self.secret),
-                algorithms=[self.algorithm]
-            )
+            payload = self._decode_token(token)
             # the identifier should be stored under the sub (subject) key
-            user_identifier = payload.get('sub')
-            if user_identifier is None:
+            if payload.get('sub') is None:
                 raise InvalidCredentialsException
         # This includes all errors raised by pyjwt
         except jwt.PyJWTError:
             raise InvalidCredentialsException
+        if self.revocation_list is not None and self.revocation_list.is_revoked(payload.get('jti')):
+            raise InvalidCredentialsException
+        return payload
 
-        user = self._load_user(user_identifier)
+    def revoke_token(self, token: str) -> bool:
+        """
+        吊销token，之后使用该token的请求都返回401
 
-        if user is None:
-            raise InvalidCredentialsException
+        :param str token: The encoded jwt token
+        :return: 是否吊销成功，未配置revocation_list或token中没有jti时为False
+        :raise: HTTPException if the token is invalid or already revoked
+        """
+        payload = self._get_payload(token)
+        if self.revocation_list is None or payload.get('jti') is None:
+            return False
+        self.revocation_list.revoke(payload['jti'], payload['exp'])
+        return True
 
-        return user
+    def revoke_request(self, request: Request) -> bool:
+        """
+        吊销请求中的token，用于登出，token只验证一次，不加载用户
+
+        :param Request request: The incoming request
+        :return: 同revoke_token
+        :raise: HTTPException if the token is missing, invalid or already revoked
+        """
+        token = self._get_token(request)
+        if token is None:
+            raise self.not_authenticated_exception
+        return self.revoke_token(token)
+
+    def _uses_claims(self, payload: dict) -> bool:
+        return self._claims_callback is not None and 'ver' in payload
+
+    @staticmethod
+    def _claims_key(payload: dict) -> tuple:
+        """
+        claims构造的用户在用户缓存中的键，与user_loader使用的sub区分开，
+        版本变化后旧版本的条目不会再被命中
+        """
+        return 'claims', payload.get('uid'), payload['ver']
+
+    def _decode_token(self, token: str) -> dict:
+        """
+        验证并解码token，开启token_cache时按token的摘要缓存payload直到token过期
+
+        :param str token: The encoded jwt token
+        :return: The payload of the token
+        :raise: jwt.PyJWTError if the token is invalid
+        """
+        if self.token_cache is None:
+            return jwt.decode(token, str(self.secret), algorithms=[self.algorithm])
+
+        key = hashlib.sha256(token.encode()).digest()
+        payload = self.token_cache.get(key)
+        if payload is not None:
+            return payload
+
+        payload = jwt.decode(token, str(self.secret), algorithms=[self.algorithm])
+        # 没有exp的token无法确定有效期，不缓存
+        exp = payload.get('exp')
+        if exp is not None:
+            ttl = exp - time.time()
+            if ttl > 0:
+                self.token_cache.set(key, payload, ttl=ttl)
+        return payload
 
     def _load_user(self, identifier: typing.Any):
         """
@@ -120,6 +240,25 @@ class LoginManager(OAuth2PasswordBearer):
 
         :param Any identifier: The identifier the user callback takes
         :return: The user object or None
+        :raises: Exception if the user_loader has not been set
+        """
+        user = self._get_cached_user(identifier)
+        if user is None:
+            user = self._load_user_uncached(identifier)
+        return user
+
+    def _get_cached_user(self, identifier: typing.Any):
+        """
+        从用户缓存中读取用户，未开启缓存或未命中时返回None
+        """
+        if self.user_cache is None:
+            return None
+        return self.user_cache.get(identifier)
+
+    def _load_user_uncached(self, identifier: typing.Any):
+        """
+        调用user_callback加载用户并写入用户缓存
+
         :raises: Exception if the user_loader has not been set
         """
         if self._user_callback is None:
@@ -129,8 +268,47 @@ class LoginManager(OAuth2PasswordBearer):
 
         user = self._user_callback(identifier)
 
+        if user is not None and self.user_cache is not None:
+            self.user_cache.set(identifier, user)
+
+        return user
+
+    def _load_claims_user_uncached(self, payload: dict):
+        """
+        调用claims_callback构造用户并写入用户缓存
+        """
+        user = self._claims_callback(payload)
+
+        if user is not None and self.user_cache is not None:
+            self.user_cache.set(self._claims_key(payload), user)
+
         return user
 
+    def shutdown(self) -> None:
+        """
+        应用关闭时调用，同步版本没有需要释放的资源
+        """
+
+    def invalidate_claims(self, user_id: typing.Any) -> None:
+        """
+        用户的claims版本变化时，从缓存中删除该用户由claims构造的所有条目
+
+        :param Any user_id: token中的uid
+        """
+        if self.user_cache is not None:
+            self.user_cache.discard_if(
+                lambda key, user: isinstance(key, tuple) and key[0] == 'claims' and key[1] == user_id
+            )
+
+    def invalidate_user(self, identifier: typing.Any) -> None:
+        """
+        用户信息发生变化时，从缓存中删除该用户
+
+        :param Any identifier: The identifier the user callback takes
+        """
+        if self.user_cache is not None:
+            self.user_cache.discard(identifier)
+
     def create_access_token(self, *, data: dict, expires_delta: timedelta = None) -> str:
         """
         Helper function to create the encoded access token using
@@ -140,10 +318,11 @@ class LoginManager(OAuth2PasswordBearer):
         :param  timedelta expires_delta: An optional timedelta in which the token expires.
             Defaults to 15 minutes
         :return: The encoded JWT with the data and the expiry. The expiry is
-            available under the 'exp' key
+            available under the 'exp' key, a random jti is added for revocation
         """
 
         to_encode = data.copy()
+        to_encode.setdefault('jti', uuid.uuid4().hex)
 
         if expires_delta:
             expires_in = datetime.utcnow() + expires_delta
@@ -209,6 +388,18 @@ class LoginManager(OAuth2PasswordBearer):
         :return: The user object or None
         :raises: The not_authenticated_exception if set by the user
         """
+        token = self._get_token(request)
+
+        if token is not None:
+            return self.get_current_user(token)
+
+        # No token is present in the request and no Exception has been raised (auto_error=False)
+        raise self.not_authenticated_exception
+
+    def _get_token(self, request: Request) -> Optional[str]:
+        """
+        依次从cookie和header中读取token
+        """
         token = None
         if self.use_cookie:
             token = self._token_from_cookie(request)
@@ -216,8 +407,90 @@ class LoginManager(OAuth2PasswordBearer):
         if token is None and self.use_header:
             token = self.sync_super_call(request)
 
+        return token
+
+
+class AsyncLoginManager(LoginManager):
+    """
+    LoginManager的async版本，header/cookie解析和token验证直接在事件循环中完成，
+    只有缓存未命中时的用户加载交给单独的线程池，不占用starlette的默认线程池
+    """
+    def __init__(self, secret: str, tokenUrl: str, executor_workers=4, **kwargs):
+        """
+        :param int executor_workers: 加载用户的线程池大小
+        其余参数同LoginManager
+        """
+        super().__init__(secret, tokenUrl, **kwargs)
+        self.executor_workers = executor_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # 第一次使用时创建，shutdown之后再次使用（例如测试中多次启动应用）时重新创建
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="login-manager")
+        return self._executor
+
+    def shutdown(self) -> None:
+        """
+        应用关闭时调用，等待正在加载的用户完成后关闭线程池
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def get_current_user(self, token: str):
+        """
+        同LoginManager.get_current_user，user_loader可以是同步函数或者协程函数
+
+        :param str token: The encoded jwt token
+        :return: The user object returned by `self._user_callback`
+        :raise: HTTPException if the token is invalid or the user is not found
+        """
+        payload = self._get_payload(token)
+
+        if self._uses_claims(payload):
+            user = self._get_cached_user(self._claims_key(payload))
+            if user is None:
+                # 检查版本可能要访问Redis或数据库，同样放到线程池中
+                user = await self._run_in_executor(self._load_claims_user_uncached, payload)
+        else:
+            user = self._get_cached_user(payload['sub'])
+            if user is None:
+                user = await self._load_user_async(payload['sub'])
+
+        if user is None:
+            raise InvalidCredentialsException
+
+        return user
+
+    async def _load_user_async(self, identifier: typing.Any):
+        if asyncio.iscoroutinefunction(self._user_callback):
+            user = await self._user_callback(identifier)
+            if user is not None and self.user_cache is not None:
+                self.user_cache.set(identifier, user)
+            return user
+        return await self._run_in_executor(self._load_user_uncached, identifier)
+
+    async def _run_in_executor(self, func, *args):
+        # asgiref 3.2的sync_to_async不能指定线程池，这里直接用run_in_executor，同样保留contextvars
+        loop = asyncio.get_event_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, functools.partial(func, *args))
+
+    async def __call__(self, request: Request):
+        """
+        Provides the functionality to act as a Dependency
+
+        :param Request request: The incoming request, this is set automatically
+            by FastAPI
+        :return: The user object or None
+        :raises: The not_authenticated_exception if set by the user
+        """
+        token = self._get_token(request)
+
         if token is not None:
-            return self.get_current_user(token)
+            return await self.get_current_user(token)
 
         # No token is present in the request and no Exception has been raised (auto_error=False)
         raise self.not_authenticated_exception
@@ -0,0 +1,131 @@
+"""
+已注销的token
+登出时把token的jti加入吊销列表，认证时只查一次进程内的字典，不访问数据库或Redis。
+配置了REDIS_URL时吊销列表同时写入Redis的有序集合（分数为token的过期时间），
+并通过pub/sub通知所有worker；start()之后和每隔sync_interval秒从有序集合重新加载，补上错过的通知。
+token过期后jwt验证本身就会失败，过期的jti随之从内存和Redis中清理
+"""
+import heapq
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RevocationList:
+    """
+    jti -> exp的进程内字典，读取不加锁（dict的读写在GIL下是原子的）；
+    另有按exp排序的堆，加入新的jti时只弹出已经过期的堆顶，不扫描整个字典
+    """
+    channel = "eecs:token:revoked"
+
+    def __init__(self, client=None, key: str = "eecs:revoked_tokens", sync_interval: float = 60):
+        """
+        :param client: redis客户端，为None时只在当前进程内生效
+        :param str key: Redis中有序集合的键
+        :param float sync_interval: 从Redis重新加载的间隔（秒）
+        """
+        self.client = client
+        self.key = key
+        self.sync_interval = sync_interval
+        self._revoked: Dict[str, float] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        """
+        加载Redis中的吊销列表，启动订阅和定时同步的线程；
+        服务启动时在密码校验的进程池fork之后调用，导入时不创建线程
+        """
+        if self.client is None or self._started:
+            return
+        self._started = True
+        self._sync()
+        self._subscribe()
+        threading.Thread(target=self._sync_forever, name="token-revocation", daemon=True).start()
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """
+        认证时调用，没有jti的token（开启吊销前签发的）视为未吊销
+        """
+        return jti is not None and jti in self._revoked
+
+    def revoke(self, jti: str, exp: float) -> None:
+        """
+        吊销一个token，立即在当前进程生效，其他worker收到通知后生效
+        :param str jti: token的jti
+        :param float exp: token的过期时间（时间戳），之后不再需要记录
+        """
+        self._add(jti, exp)
+        if self.client is None:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zadd(self.key, {jti: exp})
+            pipe.zremrangebyscore(self.key, "-inf", time.time())
+            pipe.publish(self.channel, f"{jti} {exp}")
+            pipe.execute()
+        except Exception as e:
+            sys.stderr.write(f"写入吊销的token失败: {e}\n")
+
+    def _add(self, jti: str, exp: float) -> None:
+        with self._lock:
+            self._put(jti, exp)
+            self._purge()
+
+    def _put(self, jti: str, exp: float) -> None:
+        """
+        调用时需持有_lock，已经记录的jti（例如定时同步时重新加载的）不重复放入堆中
+        """
+        if self._revoked.get(jti) == exp:
+            return
+        self._revoked[jti] = exp
+        heapq.heappush(self._expiry, (exp, jti))
+
+    def _purge(self) -> None:
+        """
+        删除已经过期的jti，调用时需持有_lock
+        """
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            exp, jti = heapq.heappop(self._expiry)
+            if self._revoked.get(jti) == exp:
+                del self._revoked[jti]
+
+    def _subscribe(self) -> None:
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            sys.stderr.write(f"订阅token吊销通知失败，其他worker中的登出每{self.sync_interval}秒同步一次: {e}\n")
+
+    def _on_message(self, message) -> None:
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        jti, _, exp = data.partition(" ")
+        self._add(jti, float(exp))
+
+    def _sync(self) -> None:
+        """
+        从Redis加载所有未过期的jti
+        """
+        try:
+            items = self.client.zrangebyscore(self.key, time.time(), "+inf", withscores=True)
+        except Exception as e:
+            sys.stderr.write(f"读取吊销的token失败: {e}\n")
+            return
+        with self._lock:
+            for jti, exp in items:
+                self._put(jti.decode() if isinstance(jti, bytes) else jti, exp)
+            self._purge()
+
+    def _sync_forever(self) -> None:
+        while True:
+            time.sleep(self.sync_interval)
+            self._sync()
+
+    def stats(self) -> dict:
+        return {"revoked": len(self._revoked)}
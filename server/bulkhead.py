@@ -0,0 +1,136 @@
+"""
+按路径前缀隔离并发（舱壁）
+/django、/static和同步的/api路由共用同一个线程池，慢的admin页面或大的静态文件下载会占满线程池，
+给每个前缀设置并发上限，超过上限的请求排队，队列满或等待超时返回503，admin再忙也不会拖垮接口
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class BulkheadRejected(Exception):
+    pass
+
+
+class Bulkhead:
+    """
+    一个前缀的并发上限和等待队列
+    """
+
+    def __init__(self, name: str, limit: int, queue: int = 0, timeout: float = 5):
+        """
+        :param str name: 名称，一般是路径前缀
+        :param int limit: 同时处理的请求数上限
+        :param int queue: 超过上限时最多排队的请求数，0表示不排队直接返回503
+        :param float timeout: 排队的最长时间（秒），超时返回503
+        """
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        # 在事件循环中第一次使用时创建
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def acquire(self) -> None:
+        """
+        :raise: BulkheadRejected 队列已满或等待超时
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if not self._semaphore.locked():
+            # 未满时acquire不会挂起，不计入排队
+            await self._semaphore.acquire()
+            self.admitted += 1
+            self.active += 1
+            return
+        if self.queued >= self.queue:
+            self.rejected += 1
+            raise BulkheadRejected(self.name)
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise BulkheadRejected(self.name)
+        finally:
+            self.queued -= 1
+        wait = time.monotonic() - start
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        self.admitted += 1
+        self.active += 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "timeout": self.timeout,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+class BulkheadMiddleware:
+    """
+    按最长的路径前缀选择Bulkhead，没有匹配的请求不受限制
+    """
+
+    def __init__(self, app: ASGIApp, bulkheads: List[Bulkhead]):
+        self.app = app
+        # 前缀长的优先，例如/api/major先于/api
+        self.bulkheads = sorted(bulkheads, key=lambda bulkhead: len(bulkhead.name), reverse=True)
+
+    def match(self, path: str) -> Optional[Bulkhead]:
+        for bulkhead in self.bulkheads:
+            if path == bulkhead.name or path.startswith(bulkhead.name.rstrip("/") + "/"):
+                return bulkhead
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        bulkhead = self.match(scope["path"]) if scope["type"] == "http" else None
+        if bulkhead is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await bulkhead.acquire()
+        except BulkheadRejected:
+            response = JSONResponse(
+                {"detail": "服务繁忙，请稍后重试"}, status_code=503,
+                headers={"Retry-After": str(max(1, int(bulkhead.timeout)))}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            bulkhead.release()
+
+
+def build_bulkheads(config: Dict[str, dict]) -> List[Bulkhead]:
+    """
+    :param config: 路径前缀到{limit, queue, timeout}的字典，见Config.BULKHEADS
+    """
+    return [Bulkhead(prefix, **options) for prefix, options in config.items()]
@@ -0,0 +1,39 @@
+import gzip
+import io
+from typing import Tuple
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class PrefixGZipMiddleware:
+    """
+    只压缩指定路径前缀下的响应，客户端支持gzip且响应体不小于minimum_size时压缩
+    /static已经是预压缩的，/django由Django自己处理，不能再压缩一次
+    """
+
+    def __init__(self, app: ASGIApp, prefixes: Tuple[str, ...] = ("/api",), minimum_size: int = 1024,
+                 compresslevel: int = 6):
+        """
+        :param prefixes: 需要压缩的路径前缀
+        :param int minimum_size: 小于该字节数的响应不压缩
+        :param int compresslevel: gzip的压缩级别，starlette默认的9对大的JSON太耗CPU
+        """
+        self.app = app
+        self.prefixes = tuple(prefixes)
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (scope["type"] == "http" and scope["path"].startswith(self.prefixes)
+                and "gzip" in Headers(scope=scope).get("Accept-Encoding", "")):
+            responder = GZipResponder(self.app, self.minimum_size)
+            # GzipFile创建时就会写入gzip头，换成指定压缩级别的GzipFile时要同时换掉缓冲区
+            responder.gzip_buffer = io.BytesIO()
+            responder.gzip_file = gzip.GzipFile(
+                mode="wb", fileobj=responder.gzip_buffer, compresslevel=self.compresslevel
+            )
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,295 @@
+"""
+多个uvicorn worker共享的缓存，缓存用户、角色、专业负责人等高频查询
+
+配置了REDIS_URL时使用RedisCache：Redis作为共享缓存，每个worker前面再加一层进程内缓存，
+数据变化时通过pub/sub通知所有worker删除进程内缓存；未配置时退化为进程内的LocalCache
+"""
+import pickle
+import sys
+from typing import Any, Callable, Dict, Iterable
+
+from django.contrib.auth.models import User as DjangoUser
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from config import Config
+from djadmin.eecs.models import Major, Role, UserRole
+from server.database.lru_cache import LRUCache
+
+
+class LocalCache:
+    """
+    进程内缓存，未配置Redis时使用
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 300):
+        """
+        :param int max_size: 最多缓存的条目数
+        :param float ttl: 默认的过期时间（秒）
+        """
+        self.ttl = ttl
+        self._local = LRUCache(max_size, ttl)
+        self._listeners = []
+
+    def get(self, key: str) -> Any:
+        return self._local.get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        :return: 命中的key到值的字典，未命中的key不在字典中
+        """
+        result = {}
+        for key in keys:
+            value = self._local.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        self._local.set(key, value, ttl=ttl)
+
+    def set_many(self, mapping: Dict[str, Any], ttl: float = None) -> None:
+        for key, value in mapping.items():
+            self._local.set(key, value, ttl=ttl)
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: float = None) -> Any:
+        """
+        读取缓存，未命中时调用loader加载并写入缓存，loader返回None时不缓存
+        :param str key: 键
+        :param loader: 未命中时调用的加载函数
+        :param float ttl: 过期时间（秒）
+        :return: 缓存的值或loader的返回值
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl=ttl)
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        删除缓存，并通知监听者
+        """
+        for key in keys:
+            self._discard_local(key)
+
+    def add_invalidation_listener(self, callback: Callable[[str], None]) -> None:
+        """
+        注册缓存失效的监听函数，任意一个worker中的key失效时都会以key调用callback，
+        用于同步删除其他地方（例如LoginManager）的进程内缓存
+        """
+        self._listeners.append(callback)
+
+    def _discard_local(self, key: str) -> None:
+        self._local.discard(key)
+        for callback in self._listeners:
+            callback(key)
+
+    def start(self) -> None:
+        """
+        启动后台线程，进程内缓存没有需要启动的线程
+        """
+
+
+class RedisCache(LocalCache):
+    """
+    Redis共享缓存，前面加一层短时间的进程内缓存，失效通过pub/sub广播给所有worker
+    """
+    channel = "eecs:cache:invalidate"
+
+    def __init__(self, url: str = None, client=None, prefix: str = "eecs:", ttl: float = 300,
+                 local_size: int = 4096, local_ttl: float = 5, max_connections: int = 32):
+        """
+        :param str url: Redis地址，例如redis://127.0.0.1:6379/0
+        :param client: 直接传入的redis客户端（例如fakeredis.FakeRedis()），传入时忽略url
+        :param str prefix: key的前缀
+        :param float ttl: Redis中条目的过期时间（秒）
+        :param int local_size: 进程内缓存的条目数
+        :param float local_ttl: 进程内缓存的过期时间（秒）
+        :param int max_connections: 连接池大小
+        """
+        super().__init__(local_size, local_ttl)
+        if client is None:
+            import redis
+            pool = redis.ConnectionPool.from_url(url, max_connections=max_connections)
+            client = redis.Redis(connection_pool=pool)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        # 订阅失效通知之前收不到其他worker的修改，只读写Redis，start()成功后才使用进程内缓存
+        self.local_ttl = 0
+        self._configured_local_ttl = local_ttl
+        self._subscriber = None
+
+    def start(self) -> None:
+        """
+        订阅失效通知，订阅的线程在这里创建而不是在导入时，服务启动时在密码校验的进程池fork之后调用；
+        订阅失败时不使用进程内缓存，避免读到其他worker已经失效的数据
+        """
+        if self._subscriber is not None:
+            return
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            sys.stderr.write(f"订阅缓存失效通知失败，不使用进程内缓存: {e}\n")
+            return
+        self.local_ttl = self._configured_local_ttl
+
+    def _on_message(self, message) -> None:
+        key = message["data"]
+        if isinstance(key, bytes):
+            key = key.decode()
+        self._discard_local(key)
+
+    def get(self, key: str) -> Any:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        先查进程内缓存，剩下的key用一次MGET从Redis读取
+        :return: 命中的key到值的字典，未命中的key不在字典中
+        """
+        keys = list(keys)
+        result = super().get_many(keys) if self.local_ttl > 0 else {}
+        missing = [key for key in keys if key not in result]
+        if not missing:
+            return result
+        try:
+            values = self.client.mget([self.prefix + key for key in missing])
+        except Exception as e:
+            sys.stderr.write(f"读取Redis缓存失败: {e}\n")
+            return result
+        for key, raw in zip(missing, values):
+            if raw is not None:
+                value = pickle.loads(raw)
+                result[key] = value
+                if self.local_ttl > 0:
+                    self._local.set(key, value, ttl=self.local_ttl)
+        return result
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, mapping: Dict[str, Any], ttl: float = None) -> None:
+        """
+        用一个pipeline写入所有条目
+        """
+        ttl = int(self.ttl if ttl is None else ttl)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.setex(self.prefix + key, ttl, pickle.dumps(value))
+            pipe.execute()
+        except Exception as e:
+            sys.stderr.write(f"写入Redis缓存失败: {e}\n")
+            return
+        if self.local_ttl > 0:
+            for key, value in mapping.items():
+                self._local.set(key, value, ttl=self.local_ttl)
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        删除Redis中的条目，并广播给所有worker删除进程内缓存
+        """
+        if not keys:
+            return
+        for key in keys:
+            self._discard_local(key)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.delete(*[self.prefix + key for key in keys])
+            for key in keys:
+                pipe.publish(self.channel, key)
+            pipe.execute()
+        except Exception as e:
+            sys.stderr.write(f"删除Redis缓存失败: {e}\n")
+
+
+def user_key(username: str) -> str:
+    return f"user:{username}"
+
+
+def roles_key(user_id: int) -> str:
+    return f"roles:{user_id}"
+
+
+def major_manager_key(major_id: int) -> str:
+    return f"major_manager:{major_id}"
+
+
+def token_version_key(user_id: int) -> str:
+    return f"token_version:{user_id}"
+
+
+if Config.REDIS_URL:
+    cache = RedisCache(
+        Config.REDIS_URL, ttl=Config.CACHE_TTL, max_connections=Config.REDIS_MAX_CONNECTIONS
+    )
+else:
+    cache = LocalCache(ttl=Config.CACHE_TTL)
+
+
+def invalidate_on_commit(*keys: str) -> None:
+    """
+    立即删除缓存，事务提交后再删除一次：admin的修改在transaction.atomic中执行，
+    提交之前到达的请求读到的还是旧数据，会把旧值重新写入缓存（例如旧的token_version，使旧token一直有效）。
+    不在事务中时on_commit立即执行
+    """
+    cache.invalidate(*keys)
+    transaction.on_commit(lambda: cache.invalidate(*keys))
+
+
+# 数据变化时使缓存失效，在admin中修改也会立即生效
+# token_version随用户、角色和负责的专业一起失效，下次认证时重新计算，版本不同的旧token随之失效
+@receiver(post_init, sender=DjangoUser)
+def remember_username(sender, instance, **kwargs):
+    """
+    记录加载时的用户名，改名后旧用户名的缓存也要失效
+    """
+    instance._loaded_username = instance.__dict__.get("username")
+
+
+@receiver([post_save, post_delete], sender=DjangoUser)
+def invalidate_user(sender, instance, **kwargs):
+    usernames = {instance.username, getattr(instance, "_loaded_username", None)} - {None}
+    # 同一个实例再次保存时，原来的用户名是这次保存的用户名
+    instance._loaded_username = instance.username
+    invalidate_on_commit(*[user_key(username) for username in usernames], token_version_key(instance.id))
+
+
+@receiver(post_init, sender=UserRole)
+@receiver(post_init, sender=Major)
+def remember_owner(sender, instance, **kwargs):
+    """
+    记录加载时的用户/负责人，修改为其他人后原来的用户的token_version也要失效；
+    从__dict__中读取，字段被defer时不触发查询
+    """
+    instance._loaded_owner_id = instance.__dict__.get("user_id" if sender is UserRole else "manager_id")
+
+
+def _owner_versions(instance, owner_id: int) -> list:
+    owner_ids = {owner_id, getattr(instance, "_loaded_owner_id", None)} - {None}
+    # 同一个实例再次保存时，原来的用户是这次保存的用户
+    instance._loaded_owner_id = owner_id
+    return [token_version_key(user_id) for user_id in owner_ids]
+
+
+@receiver([post_save, post_delete], sender=UserRole)
+def invalidate_user_roles(sender, instance, **kwargs):
+    invalidate_on_commit(roles_key(instance.user_id), *_owner_versions(instance, instance.user_id))
+
+
+@receiver(post_save, sender=Role)
+def invalidate_role_users(sender, instance, **kwargs):
+    # 角色改名，拥有该角色的用户的角色列表都要失效
+    user_ids = UserRole.objects.filter(role=instance).values_list('user_id', flat=True)
+    invalidate_on_commit(*[key for user_id in user_ids for key in (roles_key(user_id), token_version_key(user_id))])
+
+
+@receiver([post_save, post_delete], sender=Major)
+def invalidate_major_manager(sender, instance, **kwargs):
+    invalidate_on_commit(major_manager_key(instance.id), *_owner_versions(instance, instance.manager_id))
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    带过期时间的有界LRU缓存，线程安全（sync的依赖运行在线程池里）
+    超过max_size时淘汰最久未使用的条目，每个条目在ttl秒后过期
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        """
+        :param int max_size: 最多缓存的条目数
+        :param float ttl: 默认的过期时间（秒）
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取缓存，未命中或已过期返回None
+        :param key: 键
+        :return: 缓存的值或None
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """
+        写入缓存
+        :param key: 键
+        :param value: 值
+        :param float ttl: 本条目的过期时间（秒），默认使用self.ttl
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        """
+        删除一个条目，不存在时什么也不做
+        :param key: 键
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate) -> None:
+        """
+        删除所有predicate(key, value)为真的条目
+        :param predicate: 判断函数
+        """
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: 命中、未命中、淘汰、过期的计数以及当前大小
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,83 @@
+"""
+API使用的异步模型，与djadmin/eecs/models.py映射到同一组表
+表结构由Django的迁移维护，这里不生成表（generate_schemas=False），修改Django模型时需要同步修改这里
+Django admin仍然使用Django模型
+"""
+from tortoise import fields
+from tortoise.models import Model
+
+
+class User(Model):
+    """
+    Django的auth_user表，API只需要其中的少数字段，用户的认证仍然由Django模型完成
+    """
+    id = fields.IntField(pk=True)
+    username = fields.CharField(max_length=150, unique=True)
+    is_active = fields.BooleanField()
+
+    class Meta:
+        table = "auth_user"
+
+    def __str__(self):
+        return self.username
+
+
+class Role(Model):
+    id = fields.IntField(pk=True)
+    name = fields.CharField(max_length=32, description="角色名")
+
+    class Meta:
+        table = "eecs_role"
+
+    def __str__(self):
+        return self.name
+
+
+class UserRole(Model):
+    id = fields.IntField(pk=True)
+    role = fields.ForeignKeyField("models.Role", related_name="user_roles", description="角色")
+    user = fields.ForeignKeyField("models.User", related_name="user_roles", description="用户")
+
+    class Meta:
+        table = "eecs_userrole"
+        unique_together = ("role", "user")
+
+
+class Major(Model):
+    id = fields.IntField(pk=True)
+    manager = fields.ForeignKeyField("models.User", related_name="majors", description="专业负责人")
+    code = fields.CharField(max_length=32, unique=True, description="专业代码")
+    name = fields.CharField(max_length=32, unique=True, description="专业名称")
+    create_time = fields.DatetimeField(auto_now=True, description="创建时间")
+
+    class Meta:
+        table = "eecs_major"
+
+    def __str__(self):
+        return self.name
+
+
+class Point1(Model):
+    id = fields.IntField(pk=True)
+    major = fields.ForeignKeyField("models.Major", related_name="point1", description="专业")
+    index = fields.IntField(description="编号")
+    content = fields.TextField(description="内容")
+    create_time = fields.DatetimeField(auto_now=True, description="创建时间")
+
+    class Meta:
+        table = "eecs_point1"
+        unique_together = ("major", "index")
+        ordering = ["major_id", "index"]
+
+
+class Point2(Model):
+    id = fields.IntField(pk=True)
+    point1 = fields.ForeignKeyField("models.Point1", related_name="point2", description="所属毕业要求")
+    index = fields.IntField(description="编号")
+    content = fields.TextField(description="内容")
+    create_time = fields.DatetimeField(auto_now=True, description="创建时间")
+
+    class Meta:
+        table = "eecs_point2"
+        unique_together = ("point1", "index")
+        ordering = ["point1_id", "index"]
@@ -1,14 +1,33 @@
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.wsgi import WSGIMiddleware
 from server.routers import api
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from tortoise.contrib.fastapi import register_tortoise
 import os
-from djadmin.djadmin.wsgi import application as djadmin_app
 from server.auth import login_router
+from server.auth.login import manager as login_manager, password_verifier, revocation_list
+from server.database.cache import cache
+from server.bulkhead import BulkheadMiddleware, build_bulkheads
+from server.compression import PrefixGZipMiddleware
+from server.metrics import Counter, Gauge, InstrumentedThreadPoolExecutor, MetricsMiddleware, registry
+from server.static import PrecompressedStaticFiles
+from config import Config
 
 app = FastAPI()
 
+# 先添加的中间件在内层，503的响应也会经过CORSMiddleware
+if Config.GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(
+        PrefixGZipMiddleware, prefixes=("/api",), minimum_size=Config.GZIP_MINIMUM_SIZE,
+        compresslevel=Config.GZIP_LEVEL
+    )
+bulkheads = build_bulkheads(Config.BULKHEADS)
+# 登录时校验密码的排队情况，与按前缀的bulkhead一起统计
+password_bulkheads = [password_verifier.bulkhead] if password_verifier.bulkhead is not None else []
+app.add_middleware(BulkheadMiddleware, bulkheads=bulkheads)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,18 +35,76 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 最外层，被bulkhead拒绝的请求也计入
+app.add_middleware(MetricsMiddleware, router=app.router)
 
-# 挂载django所需的全局变量
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-static_dir = os.path.join(base_dir, "djadmin/static/")
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-# 挂载django wsgi
-app.mount('/django', WSGIMiddleware(djadmin_app))
+def djadmin_app(environ, start_response):
+    """
+    第一次访问admin时才创建Django的WSGI应用（加载中间件和admin的URL），不拖慢worker启动
+    """
+    from djadmin.djadmin.wsgi import application
+    return application(environ, start_response)
+
+
+# SERVER_MODE=api时只提供接口，不挂载django admin和静态文件
+if Config.SERVER_MODE == "full":
+    # 挂载django所需的全局变量
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    static_dir = os.path.join(base_dir, "djadmin/static/")
+    if Config.STATIC_PRECOMPRESSED:
+        app.mount("/static", PrecompressedStaticFiles(directory=static_dir), name="static")
+    else:
+        app.mount("/static", StaticFiles(directory=static_dir), name="static")
+
+    # 挂载django wsgi
+    app.mount('/django', WSGIMiddleware(djadmin_app))
+
 app.include_router(login_router, prefix="/auth", tags=["auth"])
 app.include_router(api.router, prefix="/api", tags=["api"])
 
 
+# 在其他启动事件之前fork密码校验的进程池，此时还没有其他线程：
+# 共享缓存和token吊销列表的订阅线程在下面的start_background_sync中创建
+@app.on_event("startup")
+async def start_password_verifier():
+    await password_verifier.start()
+
+
+@app.on_event("startup")
+def start_background_sync():
+    """
+    订阅缓存失效和token吊销的通知（配置了REDIS_URL时），必须在start_password_verifier之后
+    """
+    cache.start()
+    revocation_list.start()
+
+
+@app.on_event("shutdown")
+def shutdown_password_verifier():
+    password_verifier.shutdown()
+
+
+@app.on_event("shutdown")
+def shutdown_login_manager():
+    login_manager.shutdown()
+
+
+# async接口的连接池，随应用启动和关闭，表结构由Django的迁移维护
+register_tortoise(app, config=Config.TORTOISE_ORM, generate_schemas=False)
+
+
+@app.on_event("startup")
+def limit_db_connections():
+    """
+    Django的数据库连接是每个线程一个，持久连接会一直被线程持有，
+    限制默认线程池（sync路由和django admin都在其中运行）的大小，即限制了每个worker的连接数
+    """
+    executor = InstrumentedThreadPoolExecutor(max_workers=Config.DB_MAX_CONNECTIONS, thread_name_prefix="db")
+    asyncio.get_event_loop().set_default_executor(executor)
+    registry.add_collector(executor.collect)
+
+
 @app.get("/ping")
 async def server_heart_beat():
     """
@@ -38,6 +115,44 @@ async def server_heart_beat():
     return "pong"
 
 
+@app.get("/metrics/bulkheads")
+async def bulkhead_metrics():
+    """
+    各路径前缀的并发、排队长度和等待时间
+    :return: 路径前缀到统计数据的字典
+    """
+    return {bulkhead.name: bulkhead.stats() for bulkhead in bulkheads + password_bulkheads}
+
+
+def collect_bulkheads():
+    """
+    把bulkhead的统计数据转换为/metrics中的指标
+    """
+    metrics = {}
+    for bulkhead in bulkheads + password_bulkheads:
+        for key, value in bulkhead.stats().items():
+            if key not in metrics:
+                if key in ("admitted", "rejected", "timed_out", "wait_seconds_total"):
+                    name = "bulkhead_" + (key if key.endswith("_total") else key + "_total")
+                    metrics[key] = Counter(name, f"bulkhead的{key}")
+                else:
+                    metrics[key] = Gauge(f"bulkhead_{key}", f"bulkhead的{key}")
+            metrics[key].inc(value, prefix=bulkhead.name)
+    return metrics.values()
+
+
+registry.add_collector(collect_bulkheads)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus文本格式的指标：各路由的耗时、正在处理的请求数、线程池排队时间、数据库查询次数和耗时
+    :return: text/plain; version=0.0.4
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", port=8000, debug=True, reload=True, lifespan="on")
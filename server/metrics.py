@@ -0,0 +1,306 @@
+"""
+进程内的指标，/metrics以Prometheus文本格式输出，不依赖prometheus_client
+- 每个路由的耗时直方图、正在处理的请求数
+- 每个请求在线程池中的排队时间
+- 每个请求的Django数据库查询次数和耗时（connection.execute_wrapper）
+多个uvicorn worker时每个worker单独统计，由Prometheus按实例汇总
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Pattern, Tuple
+
+from django.db.backends.signals import connection_created
+from starlette.routing import Route, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUEUE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    escaped = (
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        with self._lock:
+            self._values[tuple(labels.items())] += amount
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        # labels -> [每个桶的计数..., 总数, 总和]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.items())
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += 1
+            values[-1] += value
+
+    def _samples(self):
+        for labels, values in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {values[-2]}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-1])}"
+            yield f"{self.name}_count{_format_labels(labels)} {values[-2]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        """
+        :param collector: 输出时调用，返回当时的Metric，用于导出其他模块维护的统计数据（例如bulkhead）
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "请求的处理时间", LATENCY_BUCKETS
+))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "正在处理的请求数"
+))
+THREADPOOL_QUEUE = registry.register(Histogram(
+    "http_request_threadpool_queue_seconds", "每个请求在默认线程池中排队的总时间", QUEUE_BUCKETS
+))
+DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "每个请求的Django数据库查询次数", QUERY_COUNT_BUCKETS
+))
+DB_DURATION = registry.register(Histogram(
+    "http_request_db_duration_seconds", "每个请求的Django数据库查询总耗时", LATENCY_BUCKETS
+))
+EXECUTOR_QUEUE = registry.register(Histogram(
+    "threadpool_queue_seconds", "默认线程池中每个任务的排队时间", QUEUE_BUCKETS
+))
+
+
+class RequestStats:
+    """
+    一个请求的统计数据，通过contextvars传到线程池中（starlette的run_in_threadpool会复制context）
+    """
+    __slots__ = ("queries", "db_seconds", "queue_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.queue_seconds = 0.0
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Django的execute_wrapper，把查询次数和耗时记到当前请求上
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Django的连接是每个线程一个，在每个连接建立时挂上count_queries
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    记录任务从提交到开始执行的排队时间
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        # run_in_executor在事件循环线程中调用submit，此时可以取到当前请求
+        stats = current_request.get()
+        submitted = time.perf_counter()
+
+        def run():
+            waited = time.perf_counter() - submitted
+            EXECUTOR_QUEUE.observe(waited)
+            if stats is not None:
+                stats.queue_seconds += waited
+            return fn(*args, **kwargs)
+
+        return super().submit(run)
+
+    def collect(self) -> Iterable[Metric]:
+        """
+        registry的collector，输出线程池的大小和排队的任务数
+        """
+        workers = Gauge("threadpool_workers", "默认线程池的最大线程数")
+        workers.inc(self._max_workers)
+        queued = Gauge("threadpool_queued_tasks", "默认线程池中等待执行的任务数")
+        queued.inc(self._work_queue.qsize())
+        return workers, queued
+
+
+class MetricsMiddleware:
+    """
+    按路由模板（而不是实际路径）统计，避免/major/1/tree这样的路径产生无限多的标签
+    """
+
+    def __init__(self, app: ASGIApp, router: Router):
+        self.app = app
+        self.router = router
+        # 路由表的索引，第一次请求时（路由都已注册）建立，路由数量变化时重建
+        self._indexed = -1
+        self._exact: Dict[str, Tuple[int, str]] = {}
+        self._patterns: List[Tuple[int, Pattern, str]] = []
+
+    def _index_routes(self) -> None:
+        """
+        没有路径参数的路由按路径放进字典，有参数的路由和Mount保留正则，按注册顺序匹配
+        """
+        exact, patterns = {}, []
+        for position, route in enumerate(self.router.routes):
+            path, regex = getattr(route, "path", None), getattr(route, "path_regex", None)
+            if path is None or regex is None:
+                continue
+            if isinstance(route, Route) and "{" not in path:
+                exact.setdefault(path, (position, path))
+            else:
+                patterns.append((position, regex, path))
+        self._exact, self._patterns = exact, patterns
+        self._indexed = len(self.router.routes)
+
+    def route_name(self, scope: Scope) -> str:
+        """
+        与Router相同，第一个路径匹配的路由优先；只比较路径不比较方法，405的请求也记在路由模板上
+        """
+        if self._indexed != len(self.router.routes):
+            self._index_routes()
+        path = scope["path"]
+        position, name = self._exact.get(path, (self._indexed, "unmatched"))
+        for pattern_position, regex, template in self._patterns:
+            if pattern_position > position:
+                break
+            if regex.match(path):
+                return template
+        return name
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.route_name(scope)
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        REQUESTS_IN_FLIGHT.inc(route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.observe(time.perf_counter() - start, method=method, route=route, status=str(status))
+            REQUESTS_IN_FLIGHT.dec(route=route)
+            THREADPOOL_QUEUE.observe(stats.queue_seconds, route=route)
+            DB_QUERIES.observe(stats.queries, route=route)
+            DB_DURATION.observe(stats.db_seconds, route=route)
+            current_request.reset(token)
@@ -0,0 +1,143 @@
+"""
+登录时的密码校验
+Django的PBKDF2哈希每次要几十到几百毫秒的CPU，在默认线程池中执行会占住处理其他sync路由的线程（并且持有GIL），
+这里放到单独的进程池中，并用Bulkhead限制排队的请求数，队列满或等待超时时快速返回503
+"""
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.contrib.auth.models import User as DjangoUser
+from django.contrib.auth.signals import user_login_failed
+from starlette.concurrency import run_in_threadpool
+
+from server.bulkhead import Bulkhead, BulkheadRejected
+from server.metrics import Counter, Histogram, QUEUE_BUCKETS, registry
+
+HASH_DURATION = registry.register(Histogram(
+    "password_hash_seconds", "进程池中每次密码哈希的耗时", (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+))
+HASH_QUEUE = registry.register(Histogram(
+    "password_queue_seconds", "密码校验在Bulkhead和进程池中排队的时间", QUEUE_BUCKETS
+))
+HASH_REJECTED = registry.register(Counter(
+    "password_rejected_total", "因队列已满或等待超时被拒绝的登录"
+))
+
+
+def verify_password(password: str, encoded: Optional[str]) -> Tuple[bool, Optional[str], float]:
+    """
+    在进程池中执行，哈希参数（例如迭代次数）变化后在同一次调用中重新生成哈希，不需要再排一次队
+    :param encoded: 数据库中的密码哈希，为None（用户不存在）时仍然计算一次哈希，使响应时间与用户存在时相同
+    :return: (密码是否正确, 按当前的哈希参数重新生成的哈希（不需要时为None）, 耗时)
+    """
+    start = time.perf_counter()
+    if encoded is None:
+        make_password(password)
+        return False, None, time.perf_counter() - start
+    updated = []
+    valid = check_password(password, encoded, setter=lambda raw: updated.append(make_password(raw)))
+    return valid, updated[0] if updated else None, time.perf_counter() - start
+
+
+MODEL_BACKEND = "django.contrib.auth.backends.ModelBackend"
+
+
+def _warm_up() -> None:
+    """
+    在子进程中加载并缓存配置的哈希算法（get_hashers有lru_cache），第一次登录不用再导入
+    """
+    get_hasher("default")
+
+
+class PasswordVerifier:
+    """
+    代替django.contrib.auth.authenticate，只实现了ModelBackend：
+    在线程池中按用户名查询用户，在进程池中校验密码，未启用的用户不能登录，失败时同样发送user_login_failed信号。
+    AUTHENTICATION_BACKENDS配置了其他后端时不使用进程池，在默认线程池中调用authenticate
+    """
+
+    def __init__(self, workers: int, queue: int = 32, timeout: float = 5, start_method: Optional[str] = None):
+        """
+        :param int workers: 进程数，即同时校验的密码数，0表示不使用进程池，在默认线程池中调用authenticate
+        :param int queue: 进程都忙时最多排队的登录请求数
+        :param float timeout: 排队的最长时间（秒）
+        :param str start_method: 创建进程的方式，默认在支持fork的平台上使用fork
+        """
+        self.workers = workers
+        self.start_method = start_method
+        self.bulkhead = Bulkhead("password", workers, queue, timeout) if workers > 0 else None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # fork的子进程继承已经配置好的Django，不需要重新导入；
+            # spawn会重新执行主模块（例如python -m uvicorn的__main__），只在没有fork的平台上使用
+            method = self.start_method or ("fork" if "fork" in get_all_start_methods() else "spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context(method))
+        return self._executor
+
+    async def start(self) -> None:
+        """
+        在启动时创建所有进程，第一批登录请求也不用等待进程启动。
+        必须在创建其他线程之前调用（fork只复制当前线程，其他线程持有的锁在子进程中不会被释放）：
+        server.main中它是第一个启动事件，共享缓存和token吊销列表的订阅线程在之后才启动
+        """
+        if self.workers > 0:
+            loop = asyncio.get_event_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, _warm_up) for _ in range(self.workers)))
+
+    def shutdown(self) -> None:
+        """
+        等待子进程退出，不留下孤儿进程
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def authenticate(self, username: str, password: str) -> Optional[DjangoUser]:
+        """
+        先进入Bulkhead再查询用户，队列满时直接拒绝，不占用线程池和数据库连接
+        :return: 用户名和密码正确并且已启用的用户，否则为None
+        :raise: BulkheadRejected 队列已满或等待超时
+        """
+        if self.bulkhead is None or list(settings.AUTHENTICATION_BACKENDS) != [MODEL_BACKEND]:
+            return await run_in_threadpool(authenticate, username=username, password=password)
+        start = time.perf_counter()
+        try:
+            await self.bulkhead.acquire()
+        except BulkheadRejected:
+            HASH_REJECTED.inc()
+            raise
+        waited = time.perf_counter() - start
+        try:
+            user = await run_in_threadpool(DjangoUser.objects.filter(username=username).first)
+            submitted = time.perf_counter()
+            valid, updated, seconds = await asyncio.get_event_loop().run_in_executor(
+                self.executor, verify_password, password, user.password if user is not None else None
+            )
+            waited += max(0.0, time.perf_counter() - submitted - seconds)
+        finally:
+            self.bulkhead.release()
+        HASH_DURATION.observe(seconds)
+        HASH_QUEUE.observe(waited)
+        if not valid or not user.is_active:
+            # 与authenticate一样通知登录失败（例如用于限制尝试次数），密码不传给接收者
+            await run_in_threadpool(
+                user_login_failed.send, sender=__name__,
+                credentials={"username": username, "password": "********************"}, request=None
+            )
+            return None
+        if updated is not None:
+            user.password = updated
+            await run_in_threadpool(user.save, update_fields=["password"])
+        return user
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, **(self.bulkhead.stats() if self.bulkhead is not None else {})}
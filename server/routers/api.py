@@ -1,13 +1,21 @@
 from fastapi import APIRouter
 from fastapi import Depends
 from .major import router as major_router
+from .major_batch import router as major_batch_router
+from .major_export import router as major_export_router
+from .major_async import router as major_async_router
+from .responses import FastJSONResponse
 from server.auth.login import manager as login_manager
 
 router = APIRouter()
-router.include_router(major_router, prefix="/major", tags=["major"])
+router.include_router(major_router, prefix="/major", tags=["major"], default_response_class=FastJSONResponse)
+router.include_router(major_batch_router, prefix="/major", tags=["major"], default_response_class=FastJSONResponse)
+router.include_router(major_export_router, prefix="/major", tags=["major"], default_response_class=FastJSONResponse)
+# 同样的接口，使用tortoise-orm的async版本
+router.include_router(major_async_router, prefix="/async/major", tags=["major-async"],
+                       default_response_class=FastJSONResponse)
 
 
 @router.get('/protected')
 def protected_route(user=Depends(login_manager)):
-    print(user)
     return user.password
@@ -0,0 +1,53 @@
+import hashlib
+from typing import Any, Optional
+from django.db.models import Count, Max
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def queryset_version(queryset) -> tuple:
+    """
+    用一次聚合查询计算数据的版本：最大的create_time和条目数
+    create_time是auto_now，创建和修改都会更新它，删除会改变条目数，
+    admin中的修改同样有效，不需要在各处维护版本号
+    """
+    version = queryset.aggregate(last_modified=Max('create_time'), count=Count('id'))
+    return version['last_modified'], version['count']
+
+
+def make_etag(request: Request, version: Any) -> str:
+    """
+    由数据版本和请求的路径、参数生成弱ETag，分页参数不同的请求ETag也不同
+    同一个ETag会同时用于gzip压缩和未压缩的响应，两者字节不同，只能是弱ETag
+    """
+    key = repr((version, request.url.path, sorted(request.query_params.multi_items())))
+    return 'W/"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match使用弱比较
+    candidates = [each.strip() for each in if_none_match.split(",")]
+    return any(_opaque_tag(candidate) == _opaque_tag(etag) for candidate in candidates)
+
+
+def check_not_modified(request: Request, response: Response, version: Any) -> Optional[Response]:
+    """
+    在生成数据之前检查If-None-Match
+    :param request: 请求
+    :param response: FastAPI注入的response，会设置ETag
+    :param version: 数据的版本，例如queryset_version()的结果
+    :return: 未修改时返回304的Response，否则返回None，应继续生成数据
+    """
+    etag = make_etag(request, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
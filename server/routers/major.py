@@ -2,98 +2,125 @@ from djadmin.eecs.models import Major, Point1, Point2
 from pydantic import BaseModel, Field
 from typing import List, Any
 from server.auth.login import manager as login_manager
-from fastapi import Depends, APIRouter, HTTPException
+from fastapi import Depends, APIRouter, Request, Response
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Max
+from .conditional import check_not_modified, queryset_version
+from .pagination import PageParams, paginate
+from .permission import owned_major_id, owned_point1, owned_point2
+from .responses import trusted_response
 from .schema import *
 
 router = APIRouter()
 
 
 @router.get('/majors', response_model=ListData)
-def getMajors(user=Depends(login_manager)):
+def getMajors(request: Request, response: Response, page: PageParams = Depends(), user=Depends(login_manager)):
     """
-    获取user负责的所有专业
+    分页获取user负责的专业，按id排序，下一页用返回的after作为参数
+    支持If-None-Match，数据未变化时返回304
     """
-    major_list = list(Major.objects.filter(manager=user).values('id', 'name'))
-    major_list_len = len(major_list)
-    return {
+    major_query = Major.objects.filter(manager_id=user.id)
+    not_modified = check_not_modified(request, response, queryset_version(major_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
         "code": 20000,
-        "data": {
-            "total": major_list_len,
-            "items": major_list
-        }
-    }
+        "data": paginate(major_query, page, ('id', 'name'))
+    }, response)
 
 
-@router.get('/point1', response_model=ListData)
-def getPoint1(major_id: int, user=Depends(login_manager)):
+@router.get('/point1', response_model=PointListData)
+def getPoint1(request: Request, response: Response, page: PageParams = Depends(),
+              major_id: int = Depends(owned_major_id)):
     """
-    获取专业编号=major_id的毕业要求
+    分页获取专业编号=major_id的毕业要求
+    支持If-None-Match，数据未变化时返回304
     :return:
     """
-    major = Major.objects.get(id=major_id, manager=user)
-    point1_list = list(Point1.objects.filter(major=major).values('id', 'name', 'index'))
-    return {
+    point1_query = Point1.objects.filter(major_id=major_id)
+    not_modified = check_not_modified(request, response, queryset_version(point1_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
+        "code": 20000,
+        "data": paginate(point1_query, page, ('id', 'index', 'content'), key='index')
+    }, response)
+
+
+@router.get('/{major_id}/tree', response_model=TreeData)
+def getOutcomeTree(request: Request, response: Response, major_id: int = Depends(owned_major_id)):
+    """
+    一次获取专业编号=major_id的所有毕业要求及其分解指标点，
+    不论有多少毕业要求，都只查询两次数据库
+    支持If-None-Match，数据未变化时返回304
+    """
+    version = Point1.objects.filter(major_id=major_id).aggregate(
+        point1_modified=Max('create_time'), point1_count=Count('id', distinct=True),
+        point2_modified=Max('point2__create_time'), point2_count=Count('point2__id'),
+    )
+    not_modified = check_not_modified(request, response, sorted(version.items()))
+    if not_modified:
+        return not_modified
+    point1_list = list(
+        Point1.objects.filter(major_id=major_id).order_by('index').values('id', 'index', 'content')
+    )
+    children = {point1['id']: [] for point1 in point1_list}
+    point2_query = Point2.objects.filter(point1__major_id=major_id).order_by('point1_id', 'index')
+    for point2 in point2_query.values('id', 'point1_id', 'index', 'content'):
+        children[point2.pop('point1_id')].append(point2)
+    for point1 in point1_list:
+        point1['children'] = children[point1['id']]
+    return trusted_response({
         "code": 20000,
         "data": {
             "total": len(point1_list),
             "items": point1_list
         }
-    }
+    }, response)
 
 
 @router.post('/point1/create')
-def createPoint1(major_id: int, index: int, content: str, user=Depends(login_manager)):
+def createPoint1(index: int, content: str, major_id: int = Depends(owned_major_id)):
     """
     创建 content = content, index = index的毕业要求, index不能与已有指标点重复,
     code=20000 创建成功
     code=40001 创建失败
     """
-    major = Major.objects.get(id=major_id)
-    # 检查user是否未本专业的负责人
-    if major.manager != user:
-        raise HTTPException(status_code=401)
-    # 如果已经存在index，则返回40001错误
-    if Point1.objects.filter(major=major, index=index).count() > 0:
+    # 如果已经存在index，则返回40001错误；由(major, index)的唯一索引检查，并发创建相同序号时也只有一个成功
+    try:
+        with transaction.atomic():
+            Point1.objects.create(major_id=major_id, index=index, content=content)
+    except IntegrityError:
         return {"code": 40001, "detail": "该专业此序号已存在"}
-    else:
-        Point1.objects.create(major=major, index=index, content=content)
-        return {
-            "code": 20000,
-            "detail": "创建成功"
-        }
+    return {
+        "code": 20000,
+        "detail": "创建成功"
+    }
 
 
 @router.post('/point1/update/content')
-def updatePoint1Content(point1_id: int, content: str, user=Depends(login_manager)):
+def updatePoint1Content(content: str, point1: Point1 = Depends(owned_point1)):
     """
     修改id = point1_id的毕业要求的content为content
     code=20000 修改成功
     code=40001 修改失败
     """
-    point1 = Point1.objects.get(point1_id=point1_id)
-    # 检查user是否为本专业的负责人
-    if point1.major.manager != user:
-        raise HTTPException(status_code=401)
-    else:
-        point1.content = content
-        point1.save()
-        return {
-            "code": 20000,
-            "detail": "修改成功"
-        }
+    point1.content = content
+    point1.save()
+    return {
+        "code": 20000,
+        "detail": "修改成功"
+    }
 
 
 @router.post('/point1/delete')
-def deletePoint1(point1_id: int, user=Depends(login_manager)):
+def deletePoint1(point1: Point1 = Depends(owned_point1)):
     """
     删除id = point1_id的毕业要求
     code=20000 删除成功
     code=40001 删除失败
     """
-    point1 = Point1.objects.get(id=point1_id)
-    # 检查user是否为point1对应的专业的专业负责人
-    if point1.major.manager != user:
-        raise HTTPException(status_code=401)
     point1.delete()
     return {
         "code": 20000,
@@ -101,57 +128,48 @@ def deletePoint1(point1_id: int, user=Depends(login_manager)):
     }
 
 
-@router.get("/point2", response_model=ListData)
-def getPoint2(point1_id: int, user=Depends(login_manager)):
+@router.get("/point2", response_model=PointListData)
+def getPoint2(request: Request, response: Response, page: PageParams = Depends(),
+              point1: Point1 = Depends(owned_point1)):
     """
-    获取id = point1_id的分解指标点
+    分页获取id = point1_id的分解指标点
+    支持If-None-Match，数据未变化时返回304
     """
-    point1 = Point1.objects.get(id=point1_id)
-    # 检测权限
-    if point1.major.manager != user:
-        raise HTTPException(status_code=404, detail="未查询到毕业要求")
-    point2_list = list(Point2.objects.filter(point1=point1).values('id', 'index', 'name'))
-    return {
+    point2_query = Point2.objects.filter(point1=point1)
+    not_modified = check_not_modified(request, response, queryset_version(point2_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
         "code": 20000,
-        "data": {
-            "total": len(point2_list),
-            "items": point2_list
-        }
-    }
+        "data": paginate(point2_query, page, ('id', 'index', 'content'), key='index')
+    }, response)
 
 
 @router.post('/point2/create')
-def createPoint2(point1_id: int, index: int, content: str, user=Depends(login_manager)):
+def createPoint2(index: int, content: str, point1: Point1 = Depends(owned_point1)):
     """
     创建content = content, index = index的毕业要求,index不能与已有指标点重复,
     code=20000 创建成功
     code=40001 创建失败
     """
-    point1 = Major.objects.get(id=point1_id)
-    # 检查user是否为对应的一级指标点对应的专业的专业负责人
-    if point1.major.manager != user:
-        raise HTTPException(status_code=401)
-    # 如果已经存在index，则返回40001错误
-    if Point2.objects.filter(point1=point1, index=index).count() > 0:
+    # 如果已经存在index，则返回40001错误；由(point1, index)的唯一索引检查
+    try:
+        with transaction.atomic():
+            Point2.objects.create(point1=point1, index=index, content=content)
+    except IntegrityError:
         return {"code": 40001, "detail": "该专业此序号已存在"}
-    else:
-        Point2.objects.create(point1=point1, index=index, content=content)
-        return {
-            "code": 20000,
-            "detail": "创建成功"
-        }
+    return {
+        "code": 20000,
+        "detail": "创建成功"
+    }
 
 
 @router.post('/point2/delete')
-def deletePoint2(point2_id: int, user=Depends(login_manager)):
+def deletePoint2(point2: Point2 = Depends(owned_point2)):
     """
     删除id = point2_id的分解指标点
     code=20000 删除成功, code=40001 删除失败
     """
-    point2 = Point2.objects.get(id=point2_id)
-    # 检查user是否为point1对应的专业的专业负责人
-    if point2.point1.major.manager != user:
-        raise HTTPException(status_code=401)
     point2.delete()
     return {
         "code": 20000,
@@ -160,20 +178,15 @@ def deletePoint2(point2_id: int, user=Depends(login_manager)):
 
 
 @router.post('/point2/update/content')
-def updatePoint2Content(point2_id: int, content: str, user=Depends(login_manager)):
+def updatePoint2Content(content: str, point2: Point2 = Depends(owned_point2)):
     """
     修改id = point2_id的分解指标点的content为content
     code=20000 修改成功
     code=40001 修改失败
     """
-    point2 = Point1.objects.get(point1_id=point2_id)
-    # 检查user是否为本专业的负责人
-    if point2.point1.major.manager != user:
-        raise HTTPException(status_code=401)
-    else:
-        point2.content = content
-        point2.save()
-        return {
-            "code": 20000,
-            "detail": "修改成功"
-        }
\ No newline at end of file
+    point2.content = content
+    point2.save()
+    return {
+        "code": 20000,
+        "detail": "修改成功"
+    }
\ No newline at end of file
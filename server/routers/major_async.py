@@ -0,0 +1,279 @@
+"""
+major.py中接口的async版本，使用server/database/ps/models.py中的tortoise-orm模型，
+数据库查询不占用线程池，等待数据库时事件循环可以继续处理其他请求
+"""
+import asyncio
+from server.database.ps.models import Major, Point1, Point2
+from server.auth.login import manager as login_manager
+from fastapi import Depends, APIRouter, HTTPException, Request, Response
+from typing import Iterable
+from tortoise.exceptions import IntegrityError
+from tortoise.functions import Count, Max
+from tortoise.transactions import in_transaction
+from .conditional import check_not_modified
+from .pagination import PageParams, decode_cursor, encode_cursor
+from .permission import token_owns_major
+from .responses import trusted_response
+from .schema import *
+
+router = APIRouter()
+
+
+# conditional.py、pagination.py和permission.py中的tortoise-orm版本放在这里，
+# 同步的路由不依赖tortoise-orm
+async def queryset_version_async(queryset) -> tuple:
+    """
+    queryset_version的tortoise-orm版本，queryset为过滤好的tortoise queryset
+    queryset中不能有跨表的过滤，否则tortoise会按主键GROUP BY，得到的是每一行的版本
+    """
+    rows = await queryset.annotate(
+        last_modified=Max('create_time'), count=Count('id')
+    ).values('last_modified', 'count')
+    return rows[0]['last_modified'], rows[0]['count']
+
+
+async def paginate_async(queryset, page: PageParams, fields: Iterable[str], key: str = "id") -> dict:
+    """
+    paginate的tortoise-orm版本
+    :param queryset: 过滤好的tortoise queryset
+    :param page: 分页参数
+    :param fields: values()的字段，需要包含key
+    :param key: 分页的排序字段
+    :return: ListData中data的内容
+    """
+    page_query = queryset.order_by(key)
+    if page.after is not None:
+        page_query = page_query.filter(**{f"{key}__gt": decode_cursor(page.after, key)})
+    items = await page_query.limit(page.limit + 1).values(*fields)
+    has_more = len(items) > page.limit
+    items = items[:page.limit]
+    return {
+        "total": await queryset.count() if page.with_total else None,
+        "has_more": has_more,
+        "after": encode_cursor(items[-1][key], key) if has_more else None,
+        "items": items
+    }
+
+
+async def owned_major_id_async(major_id: int, user=Depends(login_manager)) -> int:
+    """
+    owned_major_id的async版本，直接查询数据库，不经过可能阻塞事件循环的Redis客户端
+    :return: major_id
+    """
+    owned = token_owns_major(user, major_id)
+    if owned is None:
+        owned = await Major.exists(id=major_id, manager_id=user.id)
+    if not owned:
+        raise HTTPException(status_code=404, detail="未查询到专业")
+    return major_id
+
+
+async def owned_point1_async(point1_id: int, user=Depends(login_manager)) -> Point1:
+    """
+    owned_point1的async版本
+    :return: 毕业要求
+    """
+    point1 = await Point1.filter(id=point1_id, major__manager_id=user.id).first()
+    if point1 is None:
+        raise HTTPException(status_code=404, detail="未查询到毕业要求")
+    return point1
+
+
+async def owned_point2_async(point2_id: int, user=Depends(login_manager)) -> Point2:
+    """
+    owned_point2的async版本
+    :return: 分解指标点
+    """
+    point2 = await Point2.filter(id=point2_id, point1__major__manager_id=user.id).first()
+    if point2 is None:
+        raise HTTPException(status_code=404, detail="未查询到分解指标点")
+    return point2
+
+
+@router.get('/majors', response_model=ListData)
+async def getMajorsAsync(request: Request, response: Response, page: PageParams = Depends(),
+                         user=Depends(login_manager)):
+    """
+    分页获取user负责的专业，按id排序，下一页用返回的after作为参数
+    支持If-None-Match，数据未变化时返回304
+    """
+    major_query = Major.filter(manager_id=user.id)
+    not_modified = check_not_modified(request, response, await queryset_version_async(major_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
+        "code": 20000,
+        "data": await paginate_async(major_query, page, ('id', 'name'))
+    }, response)
+
+
+@router.get('/point1', response_model=PointListData)
+async def getPoint1Async(request: Request, response: Response, page: PageParams = Depends(),
+                         major_id: int = Depends(owned_major_id_async)):
+    """
+    分页获取专业编号=major_id的毕业要求
+    支持If-None-Match，数据未变化时返回304
+    """
+    point1_query = Point1.filter(major_id=major_id)
+    not_modified = check_not_modified(request, response, await queryset_version_async(point1_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
+        "code": 20000,
+        "data": await paginate_async(point1_query, page, ('id', 'index', 'content'), key='index')
+    }, response)
+
+
+async def _tree_version(major_id: int) -> tuple:
+    """
+    一次查询计算毕业要求和分解指标点的版本
+    tortoise的聚合在有JOIN时会按毕业要求GROUP BY，每个毕业要求一行，再在这里汇总
+    """
+    rows = await Point1.filter(major_id=major_id).annotate(
+        point2_modified=Max('point2__create_time'), point2_count=Count('point2__id')
+    ).values('create_time', 'point2_modified', 'point2_count')
+    return (
+        max((row['create_time'] for row in rows), default=None), len(rows),
+        max((row['point2_modified'] for row in rows if row['point2_modified']), default=None),
+        sum(row['point2_count'] for row in rows),
+    )
+
+
+@router.get('/{major_id}/tree', response_model=TreeData)
+async def getOutcomeTreeAsync(request: Request, response: Response, major_id: int = Depends(owned_major_id_async)):
+    """
+    一次获取专业编号=major_id的所有毕业要求及其分解指标点，两次数据查询并发执行
+    支持If-None-Match，数据未变化时返回304
+    """
+    not_modified = check_not_modified(request, response, await _tree_version(major_id))
+    if not_modified:
+        return not_modified
+    point1_list, point2_list = await asyncio.gather(
+        Point1.filter(major_id=major_id).order_by('index').values('id', 'index', 'content'),
+        Point2.filter(point1__major_id=major_id).order_by('point1_id', 'index')
+        .values('id', 'point1_id', 'index', 'content'),
+    )
+    children = {point1['id']: [] for point1 in point1_list}
+    for point2 in point2_list:
+        children[point2.pop('point1_id')].append(point2)
+    for point1 in point1_list:
+        point1['children'] = children[point1['id']]
+    return trusted_response({
+        "code": 20000,
+        "data": {
+            "total": len(point1_list),
+            "items": point1_list
+        }
+    }, response)
+
+
+@router.post('/point1/create')
+async def createPoint1Async(index: int, content: str, major_id: int = Depends(owned_major_id_async)):
+    """
+    创建 content = content, index = index的毕业要求, index不能与已有指标点重复,
+    code=20000 创建成功
+    code=40001 创建失败
+    """
+    # 由(major, index)的唯一索引检查，并发创建相同序号时也只有一个成功
+    try:
+        await Point1.create(major_id=major_id, index=index, content=content)
+    except IntegrityError:
+        return {"code": 40001, "detail": "该专业此序号已存在"}
+    return {
+        "code": 20000,
+        "detail": "创建成功"
+    }
+
+
+@router.post('/point1/update/content')
+async def updatePoint1ContentAsync(content: str, point1: Point1 = Depends(owned_point1_async)):
+    """
+    修改id = point1_id的毕业要求的content为content
+    code=20000 修改成功
+    code=40001 修改失败
+    """
+    point1.content = content
+    await point1.save()
+    return {
+        "code": 20000,
+        "detail": "修改成功"
+    }
+
+
+@router.post('/point1/delete')
+async def deletePoint1Async(point1: Point1 = Depends(owned_point1_async)):
+    """
+    删除id = point1_id的毕业要求
+    code=20000 删除成功
+    code=40001 删除失败
+    """
+    # 表由Django创建，外键上没有ON DELETE CASCADE（级联删除是Django在Python中完成的），这里手动删除分解指标点
+    async with in_transaction():
+        await Point2.filter(point1_id=point1.id).delete()
+        await point1.delete()
+    return {
+        "code": 20000,
+        "detail": "删除成功"
+    }
+
+
+@router.get("/point2", response_model=PointListData)
+async def getPoint2Async(request: Request, response: Response, page: PageParams = Depends(),
+                         point1: Point1 = Depends(owned_point1_async)):
+    """
+    分页获取id = point1_id的分解指标点
+    支持If-None-Match，数据未变化时返回304
+    """
+    point2_query = Point2.filter(point1_id=point1.id)
+    not_modified = check_not_modified(request, response, await queryset_version_async(point2_query))
+    if not_modified:
+        return not_modified
+    return trusted_response({
+        "code": 20000,
+        "data": await paginate_async(point2_query, page, ('id', 'index', 'content'), key='index')
+    }, response)
+
+
+@router.post('/point2/create')
+async def createPoint2Async(index: int, content: str, point1: Point1 = Depends(owned_point1_async)):
+    """
+    创建content = content, index = index的分解指标点,index不能与已有指标点重复,
+    code=20000 创建成功
+    code=40001 创建失败
+    """
+    try:
+        await Point2.create(point1_id=point1.id, index=index, content=content)
+    except IntegrityError:
+        return {"code": 40001, "detail": "该专业此序号已存在"}
+    return {
+        "code": 20000,
+        "detail": "创建成功"
+    }
+
+
+@router.post('/point2/delete')
+async def deletePoint2Async(point2: Point2 = Depends(owned_point2_async)):
+    """
+    删除id = point2_id的分解指标点
+    code=20000 删除成功, code=40001 删除失败
+    """
+    await point2.delete()
+    return {
+        "code": 20000,
+        "detail": "删除成功"
+    }
+
+
+@router.post('/point2/update/content')
+async def updatePoint2ContentAsync(content: str, point2: Point2 = Depends(owned_point2_async)):
+    """
+    修改id = point2_id的分解指标点的content为content
+    code=20000 修改成功
+    code=40001 修改失败
+    """
+    point2.content = content
+    await point2.save()
+    return {
+        "code": 20000,
+        "detail": "修改成功"
+    }
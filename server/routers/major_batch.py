@@ -0,0 +1,168 @@
+from djadmin.eecs.models import Point1, Point2
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from typing import List, Tuple, Callable
+from server.auth.login import manager as login_manager
+from fastapi import Depends, APIRouter, Body
+from .permission import owned_major_id
+from .schema import *
+
+router = APIRouter()
+
+
+def _write_batch(write: Callable, total: int, pending: List[int], failed: List[dict]):
+    """
+    在一个事务中写入，并汇总每个条目的结果
+    :param write: 写入函数，只调用一次
+    :param total: 请求的条目数
+    :param pending: 将要写入的条目在请求列表中的位置
+    :param failed: 已经检查出失败的条目
+    :return: BatchResult
+    """
+    if pending:
+        try:
+            with transaction.atomic():
+                write()
+        except IntegrityError:
+            # 检查之后又有并发写入了相同的序号，整批回滚
+            failed = failed + [{"position": position, "detail": "序号冲突，请重试"} for position in pending]
+            pending = []
+    failed.sort(key=lambda item: item["position"])
+    return {
+        "code": 40001 if failed else 20000,
+        "data": {
+            "total": total,
+            "succeeded": len(pending),
+            "failed": failed
+        }
+    }
+
+
+def _owned_rows(model, ids: List[int], owner_filter: dict) -> Tuple[dict, List[dict]]:
+    """
+    一次查询取出ids中属于user的条目，ids中重复或不存在的条目记为失败
+    :return: (id到条目的字典, 失败的条目)
+    """
+    rows = model.objects.filter(id__in=ids, **owner_filter).in_bulk()
+    found, failed, seen = {}, [], set()
+    for position, row_id in enumerate(ids):
+        if row_id in seen:
+            failed.append({"position": position, "detail": "重复的编号"})
+        elif row_id not in rows:
+            failed.append({"position": position, "detail": "未查询到该条目"})
+        else:
+            found[position] = rows[row_id]
+        seen.add(row_id)
+    return found, failed
+
+
+@router.post('/point1/batch/create', response_model=BatchResult)
+def batchCreatePoint1(items: List[Point1CreateItem], major_id: int = Depends(owned_major_id)):
+    """
+    批量创建专业编号=major_id的毕业要求，index不能与已有毕业要求或本批中的其他条目重复
+    code=20000 全部创建成功
+    code=40001 部分条目失败，见data.failed
+    """
+    existing = set(
+        Point1.objects.filter(major_id=major_id, index__in=[item.index for item in items])
+        .values_list('index', flat=True)
+    )
+    to_create, pending, failed = [], [], []
+    for position, item in enumerate(items):
+        if item.index in existing:
+            failed.append({"position": position, "detail": "该专业此序号已存在"})
+            continue
+        existing.add(item.index)
+        to_create.append(Point1(major_id=major_id, index=item.index, content=item.content))
+        pending.append(position)
+    return _write_batch(lambda: Point1.objects.bulk_create(to_create), len(items), pending, failed)
+
+
+@router.post('/point1/batch/update/content', response_model=BatchResult)
+def batchUpdatePoint1Content(items: List[ContentUpdateItem], user=Depends(login_manager)):
+    """
+    批量修改毕业要求的content
+    code=20000 全部修改成功
+    code=40001 部分条目失败，见data.failed
+    """
+    found, failed = _owned_rows(Point1, [item.id for item in items], {"major__manager_id": user.id})
+    now = timezone.now()
+    for position, point1 in found.items():
+        point1.content = items[position].content
+        point1.create_time = now
+    return _write_batch(
+        lambda: Point1.objects.bulk_update(found.values(), ['content', 'create_time']),
+        len(items), list(found), failed
+    )
+
+
+@router.post('/point1/batch/delete', response_model=BatchResult)
+def batchDeletePoint1(point1_ids: List[int] = Body(...), user=Depends(login_manager)):
+    """
+    批量删除毕业要求
+    code=20000 全部删除成功
+    code=40001 部分条目失败，见data.failed
+    """
+    found, failed = _owned_rows(Point1, point1_ids, {"major__manager_id": user.id})
+    ids = [point1.id for point1 in found.values()]
+    return _write_batch(lambda: Point1.objects.filter(id__in=ids).delete(), len(point1_ids), list(found), failed)
+
+
+@router.post('/point2/batch/create', response_model=BatchResult)
+def batchCreatePoint2(items: List[Point2CreateItem], user=Depends(login_manager)):
+    """
+    批量创建分解指标点，条目可以属于不同的毕业要求，
+    index不能与同一毕业要求的已有分解指标点或本批中的其他条目重复
+    code=20000 全部创建成功
+    code=40001 部分条目失败，见data.failed
+    """
+    point1_ids = {item.point1_id for item in items}
+    owned = set(
+        Point1.objects.filter(id__in=point1_ids, major__manager_id=user.id).values_list('id', flat=True)
+    )
+    existing = set(
+        Point2.objects.filter(point1_id__in=owned, index__in=[item.index for item in items])
+        .values_list('point1_id', 'index')
+    )
+    to_create, pending, failed = [], [], []
+    for position, item in enumerate(items):
+        if item.point1_id not in owned:
+            failed.append({"position": position, "detail": "未查询到毕业要求"})
+            continue
+        if (item.point1_id, item.index) in existing:
+            failed.append({"position": position, "detail": "该毕业要求此序号已存在"})
+            continue
+        existing.add((item.point1_id, item.index))
+        to_create.append(Point2(point1_id=item.point1_id, index=item.index, content=item.content))
+        pending.append(position)
+    return _write_batch(lambda: Point2.objects.bulk_create(to_create), len(items), pending, failed)
+
+
+@router.post('/point2/batch/update/content', response_model=BatchResult)
+def batchUpdatePoint2Content(items: List[ContentUpdateItem], user=Depends(login_manager)):
+    """
+    批量修改分解指标点的content
+    code=20000 全部修改成功
+    code=40001 部分条目失败，见data.failed
+    """
+    found, failed = _owned_rows(Point2, [item.id for item in items], {"point1__major__manager_id": user.id})
+    now = timezone.now()
+    for position, point2 in found.items():
+        point2.content = items[position].content
+        point2.create_time = now
+    return _write_batch(
+        lambda: Point2.objects.bulk_update(found.values(), ['content', 'create_time']),
+        len(items), list(found), failed
+    )
+
+
+@router.post('/point2/batch/delete', response_model=BatchResult)
+def batchDeletePoint2(point2_ids: List[int] = Body(...), user=Depends(login_manager)):
+    """
+    批量删除分解指标点
+    code=20000 全部删除成功
+    code=40001 部分条目失败，见data.failed
+    """
+    found, failed = _owned_rows(Point2, point2_ids, {"point1__major__manager_id": user.id})
+    ids = [point2.id for point2 in found.values()]
+    return _write_batch(lambda: Point2.objects.filter(id__in=ids).delete(), len(point2_ids), list(found), failed)
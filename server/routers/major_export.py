@@ -0,0 +1,139 @@
+import asyncio
+import csv
+import io
+import json
+import threading
+from contextlib import closing
+from typing import Iterator
+from djadmin.eecs.models import Point1
+from django.db import connection
+from server.auth.login import manager as login_manager
+from fastapi import Depends, APIRouter, Query
+from fastapi.responses import StreamingResponse
+from .permission import owned_major_id
+
+router = APIRouter()
+
+# 一行对应一个分解指标点，没有分解指标点的毕业要求也会输出一行，分解指标点的字段为空
+EXPORT_FIELDS = ('major__code', 'major__name', 'index', 'content', 'point2__index', 'point2__content')
+EXPORT_KEYS = ('major_code', 'major_name', 'point1_index', 'point1_content', 'point2_index', 'point2_content')
+CSV_HEADER = ('专业代码', '专业名称', '毕业要求序号', '毕业要求内容', '分解指标点序号', '分解指标点内容')
+CHUNK_SIZE = 2000
+
+
+def _export_rows(queryset, chunk_size: int) -> Iterator[tuple]:
+    """
+    用一条LEFT JOIN查询按块读取毕业要求和分解指标点，内存占用与数据量无关
+    """
+    return (
+        queryset.order_by('major_id', 'index', 'point2__index')
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _ndjson_chunks(rows: Iterator[tuple], chunk_size: int) -> Iterator[str]:
+    lines = []
+    # 提前关闭时同时关闭rows，释放数据库游标
+    with closing(rows):
+        for row in rows:
+            lines.append(json.dumps(dict(zip(EXPORT_KEYS, row)), ensure_ascii=False))
+            if len(lines) >= chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _csv_chunks(rows: Iterator[tuple], chunk_size: int) -> Iterator[str]:
+    output = io.StringIO()
+    # 带BOM，Excel才能正确识别中文
+    output.write("\ufeff")
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    with closing(rows):
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if count % chunk_size == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+    yield output.getvalue()
+
+
+async def _stream_in_thread(chunks: Iterator[str], max_pending: int = 4):
+    """
+    在默认线程池的一个线程中迭代chunks，通过有界队列交给事件循环
+    Django的数据库连接是线程本地的，iterator()的游标必须一直在同一个线程中读取，
+    而StreamingResponse默认每次next()都可能换一个线程池中的线程；
+    默认线程池的大小即DB_MAX_CONNECTIONS，导出与sync路由共用同一组连接，不额外打开连接
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(maxsize=max_pending)
+    closed = threading.Event()
+    done = object()
+
+    def produce():
+        finished = False
+        try:
+            for chunk in chunks:
+                if closed.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+            else:
+                finished = True
+        except Exception as e:
+            if not closed.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+        finally:
+            # 客户端断开或出错时关闭游标，连接的状态不确定，也一并关闭；
+            # 正常读完时连接留给这个线程之后的请求复用
+            chunks.close()
+            if not finished:
+                connection.close()
+        if finished and not closed.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # 客户端断开时让生产者退出，并取出队列中的数据，避免生产者阻塞在put上
+        closed.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def _export_response(queryset, format: str, filename: str) -> StreamingResponse:
+    rows = _export_rows(queryset, CHUNK_SIZE)
+    if format == "csv":
+        chunks, media_type = _csv_chunks(rows, CHUNK_SIZE), "text/csv"
+    else:
+        chunks, media_type = _ndjson_chunks(rows, CHUNK_SIZE), "application/x-ndjson"
+    return StreamingResponse(
+        _stream_in_thread(chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+
+@router.get('/export')
+def exportMajors(format: str = Query("ndjson", regex="^(ndjson|csv)$"), user=Depends(login_manager)):
+    """
+    流式导出user负责的所有专业的毕业要求和分解指标点，format为ndjson或csv
+    """
+    return _export_response(Point1.objects.filter(major__manager_id=user.id), format, "majors")
+
+
+@router.get('/{major_id}/export')
+def exportMajor(format: str = Query("ndjson", regex="^(ndjson|csv)$"), major_id: int = Depends(owned_major_id)):
+    """
+    流式导出专业编号=major_id的毕业要求和分解指标点，format为ndjson或csv
+    """
+    return _export_response(Point1.objects.filter(major_id=major_id), format, f"major_{major_id}")
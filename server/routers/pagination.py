@@ -0,0 +1,69 @@
+import base64
+import binascii
+from typing import Optional, Iterable
+from fastapi import HTTPException, Query
+
+
+def encode_cursor(last_id: int, key: str = "id") -> str:
+    """
+    把最后一个条目的排序字段编码成不透明的游标
+    :param last_id: 最后一个条目的key字段的值
+    :param key: 分页的排序字段
+    """
+    return base64.urlsafe_b64encode(f"{key}:{last_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str, key: str = "id") -> int:
+    """
+    :param key: 分页的排序字段，其他字段的游标视为无效
+    :return: 游标对应的key字段的值
+    :raise: HTTPException 游标无效
+    """
+    try:
+        prefix, _, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition(":")
+        if prefix != key:
+            raise ValueError(cursor)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+
+class PageParams:
+    """
+    分页参数，作为依赖使用
+    """
+
+    def __init__(
+            self,
+            limit: int = Query(100, ge=1, le=1000, title="每页的条目数"),
+            after: Optional[str] = Query(None, title="上一页返回的游标"),
+            with_total: bool = Query(False, title="是否返回总数，需要额外的COUNT查询"),
+    ):
+        self.limit = limit
+        self.after = after
+        self.with_total = with_total
+
+
+def paginate(queryset, page: PageParams, fields: Iterable[str], key: str = "id") -> dict:
+    """
+    按key做keyset分页，多取一条判断是否还有下一页，不需要COUNT
+    key在queryset的过滤条件下必须唯一，并且最好与过滤条件组成索引，
+    例如毕业要求按(major_id, index)的唯一索引分页，一次索引范围扫描即可取出一页
+    :param queryset: 过滤好的queryset
+    :param page: 分页参数
+    :param fields: values()的字段，需要包含key
+    :param key: 分页的排序字段
+    :return: ListData中data的内容
+    """
+    page_query = queryset.order_by(key)
+    if page.after is not None:
+        page_query = page_query.filter(**{f"{key}__gt": decode_cursor(page.after, key)})
+    items = list(page_query.values(*fields)[:page.limit + 1])
+    has_more = len(items) > page.limit
+    items = items[:page.limit]
+    return {
+        "total": queryset.count() if page.with_total else None,
+        "has_more": has_more,
+        "after": encode_cursor(items[-1][key], key) if has_more else None,
+        "items": items
+    }
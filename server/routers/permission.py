@@ -0,0 +1,62 @@
+from djadmin.eecs.models import Major, Point1, Point2
+from server.auth.login import manager as login_manager
+from server.database.cache import cache, major_manager_key
+from fastapi import Depends, HTTPException
+from typing import Optional
+
+
+def get_major_manager_id(major_id: int):
+    """
+    查询专业负责人的id，结果放在共享缓存中，专业被修改或删除时失效
+    :param major_id: 专业编号
+    :return: 专业负责人的id，专业不存在时返回None
+    """
+    return cache.get_or_load(
+        major_manager_key(major_id),
+        lambda: Major.objects.filter(id=major_id).values_list('manager_id', flat=True).first()
+    )
+
+
+def token_owns_major(user, major_id: int) -> Optional[bool]:
+    """
+    token中带有负责的专业时（AUTH_TOKEN_CLAIMS）直接判断，否则返回None
+    """
+    major_ids = getattr(user, "major_ids", None)
+    if major_ids is None:
+        return None
+    return major_id in major_ids
+
+
+def owned_major_id(major_id: int, user=Depends(login_manager)) -> int:
+    """
+    检查user是否为专业编号=major_id的专业负责人
+    :return: major_id
+    """
+    owned = token_owns_major(user, major_id)
+    if owned is None:
+        owned = get_major_manager_id(major_id) == user.id
+    if not owned:
+        raise HTTPException(status_code=404, detail="未查询到专业")
+    return major_id
+
+
+def owned_point1(point1_id: int, user=Depends(login_manager)) -> Point1:
+    """
+    一次查询取出id = point1_id且属于user负责的专业的毕业要求
+    :return: 毕业要求
+    """
+    point1 = Point1.objects.filter(id=point1_id, major__manager_id=user.id).first()
+    if point1 is None:
+        raise HTTPException(status_code=404, detail="未查询到毕业要求")
+    return point1
+
+
+def owned_point2(point2_id: int, user=Depends(login_manager)) -> Point2:
+    """
+    一次查询取出id = point2_id且属于user负责的专业的分解指标点
+    :return: 分解指标点
+    """
+    point2 = Point2.objects.filter(id=point2_id, point1__major__manager_id=user.id).first()
+    if point2 is None:
+        raise HTTPException(status_code=404, detail="未查询到分解指标点")
+    return point2
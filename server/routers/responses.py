@@ -0,0 +1,45 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """
+    json.dumps不支持的类型：datetime、date等与jsonable_encoder一样输出ISO格式，其他转为字符串
+    """
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    用orjson直接序列化为bytes，datetime等类型不需要先经过jsonable_encoder，未安装orjson时退回到json
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def trusted_response(content: Any, response: Response = None) -> FastJSONResponse:
+    """
+    直接序列化content，跳过response_model的校验和jsonable_encoder
+    只用于values()查出来的、结构已经与response_model一致的数据，response_model仍然用于生成接口文档
+    :param content: 响应的内容
+    :param response: 路由注入的Response，其中设置的header（例如ETag）会一起返回
+    :return: FastJSONResponse
+    """
+    headers = None
+    if response is not None:
+        headers = {
+            key: value for key, value in response.headers.items() if key not in ("content-length", "content-type")
+        }
+    return FastJSONResponse(content, headers=headers)
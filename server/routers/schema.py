@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
 class IdNameItem(BaseModel):
@@ -7,10 +7,81 @@ class IdNameItem(BaseModel):
     name: str = Field(title="专业名称")
 
 
+class PageModel(BaseModel):
+    total: Optional[int] = Field(None, title="总数，with_total=true时返回")
+    has_more: bool = Field(title="是否还有下一页")
+    after: Optional[str] = Field(None, title="下一页的游标，没有下一页时为null")
+
+
 class ListData(BaseModel):
-    class ListDataModel(BaseModel):
-        total: int = Field("items的长度")
+    class ListDataModel(PageModel):
         items: List[IdNameItem] = Field(title="专业")
 
     code: int = Field(title="代码")
     data: ListDataModel = Field(title="数据")
+
+
+class PointItem(BaseModel):
+    id: int = Field(title="编号")
+    index: int = Field(title="序号")
+    content: str = Field(title="内容")
+
+
+class PointListData(BaseModel):
+    class PointListDataModel(PageModel):
+        items: List[PointItem] = Field(title="指标点")
+
+    code: int = Field(title="代码")
+    data: PointListDataModel = Field(title="数据")
+
+
+class Point2Node(BaseModel):
+    id: int = Field(title="分解指标点编号")
+    index: int = Field(title="序号")
+    content: str = Field(title="内容")
+
+
+class Point1Node(BaseModel):
+    id: int = Field(title="毕业要求编号")
+    index: int = Field(title="序号")
+    content: str = Field(title="内容")
+    children: List[Point2Node] = Field(title="分解指标点")
+
+
+class TreeData(BaseModel):
+    class TreeDataModel(BaseModel):
+        total: int = Field(title="毕业要求的数量")
+        items: List[Point1Node] = Field(title="毕业要求")
+
+    code: int = Field(title="代码")
+    data: TreeDataModel = Field(title="数据")
+
+
+class Point1CreateItem(BaseModel):
+    index: int = Field(title="序号")
+    content: str = Field(title="内容")
+
+
+class Point2CreateItem(BaseModel):
+    point1_id: int = Field(title="所属毕业要求编号")
+    index: int = Field(title="序号")
+    content: str = Field(title="内容")
+
+
+class ContentUpdateItem(BaseModel):
+    id: int = Field(title="编号")
+    content: str = Field(title="内容")
+
+
+class BatchResult(BaseModel):
+    class BatchResultModel(BaseModel):
+        class FailedItem(BaseModel):
+            position: int = Field(title="在请求列表中的位置")
+            detail: str = Field(title="失败原因")
+
+        total: int = Field(title="请求的条目数")
+        succeeded: int = Field(title="成功的条目数")
+        failed: List[FailedItem] = Field(title="失败的条目")
+
+    code: int = Field(title="代码")
+    data: BatchResultModel = Field(title="数据")
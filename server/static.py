@@ -0,0 +1,164 @@
+"""
+预压缩、带内容哈希的静态文件
+启动时扫描一次目录，文件的大小、ETag、压缩版本和是否带哈希都保存在内存中，请求时不再stat；
+小文件的内容第一次请求后也保存在内存中。文件由collectstatic生成，见djadmin/djadmin/storage.py
+"""
+import hashlib
+import json
+import os
+from mimetypes import guess_type
+from typing import Dict, Optional
+
+from starlette.responses import FileResponse, PlainTextResponse
+from starlette.types import Receive, Scope, Send
+
+# 优先级从高到低
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 没有哈希的文件名内容可能变化，每次用ETag确认
+REVALIDATE = "public, no-cache"
+
+
+class StaticVariant:
+    """
+    一个文件的某个编码版本
+    """
+    __slots__ = ("path", "size", "etag", "encoding", "body")
+
+    def __init__(self, path: str, stat_result: os.stat_result, encoding: Optional[str]):
+        self.path = path
+        self.size = stat_result.st_size
+        key = f"{stat_result.st_mtime_ns}-{stat_result.st_size}-{encoding}"
+        self.etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+        self.encoding = encoding
+        self.body: Optional[bytes] = None
+
+
+class StaticAsset:
+    __slots__ = ("media_type", "cache_control", "variants", "stat_result")
+
+    def __init__(self, media_type: str, cache_control: str, variants: Dict[Optional[str], StaticVariant],
+                 stat_result: os.stat_result):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants = variants
+        self.stat_result = stat_result
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """
+    解析Accept-Encoding，q=0的编码视为不接受
+    """
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    if "*" in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS)
+    return accepted
+
+
+class PrecompressedStaticFiles:
+    """
+    按Accept-Encoding返回.br/.gz版本，带哈希的文件名（在staticfiles.json中）使用Cache-Control: immutable
+    """
+
+    def __init__(self, directory: str, manifest: str = "staticfiles.json", memory_file_size: int = 64 * 1024):
+        """
+        :param str directory: collectstatic的输出目录
+        :param str manifest: directory下ManifestStaticFilesStorage生成的文件名映射
+        :param int memory_file_size: 不超过该大小的文件内容保存在内存中
+        """
+        self.directory = os.path.realpath(directory)
+        self.memory_file_size = memory_file_size
+        self.assets = self._scan(manifest)
+
+    def _scan(self, manifest: str) -> Dict[str, StaticAsset]:
+        hashed_names = set()
+        manifest_path = os.path.join(self.directory, manifest)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                hashed_names = set(json.load(f).get("paths", {}).values())
+
+        stats = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                stats[name] = (path, os.stat(path))
+
+        assets = {}
+        for name, (path, stat_result) in stats.items():
+            if name.endswith(tuple(suffix for _, suffix in ENCODINGS)) or name == manifest:
+                continue
+            variants = {None: StaticVariant(path, stat_result, None)}
+            for encoding, suffix in ENCODINGS:
+                if name + suffix in stats:
+                    variants[encoding] = StaticVariant(stats[name + suffix][0], stats[name + suffix][1], encoding)
+            assets[name] = StaticAsset(
+                media_type=guess_type(name)[0] or "text/plain",
+                cache_control=IMMUTABLE if name in hashed_names else REVALIDATE,
+                variants=variants,
+                stat_result=stat_result,
+            )
+        return assets
+
+    def select(self, asset: StaticAsset, accept_encoding: str) -> StaticVariant:
+        if len(asset.variants) > 1 and accept_encoding:
+            accepted = accepted_encodings(accept_encoding)
+            for encoding, _ in ENCODINGS:
+                if encoding in accepted and encoding in asset.variants:
+                    return asset.variants[encoding]
+        return asset.variants[None]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            await PlainTextResponse("Method Not Allowed", status_code=405)(scope, receive, send)
+            return
+        asset = self.assets.get(scope["path"].lstrip("/"))
+        if asset is None:
+            await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        variant = self.select(asset, request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        headers = [
+            (b"etag", variant.etag.encode()),
+            (b"cache-control", asset.cache_control.encode()),
+        ]
+        if len(asset.variants) > 1:
+            headers.append((b"vary", b"Accept-Encoding"))
+        if variant.encoding is not None:
+            headers.append((b"content-encoding", variant.encoding.encode()))
+
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        if variant.etag in [each.strip() for each in if_none_match.split(",")]:
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if variant.size > self.memory_file_size:
+            response = FileResponse(
+                variant.path, media_type=asset.media_type, stat_result=asset.stat_result, method=scope["method"],
+                headers={key.decode(): value.decode() for key, value in headers}
+            )
+            # stat_result是原始文件的，压缩版本的长度不同
+            response.headers["content-length"] = str(variant.size)
+            await response(scope, receive, send)
+            return
+
+        if variant.body is None:
+            with open(variant.path, "rb") as f:
+                variant.body = f.read()
+        headers.append((b"content-type", asset.media_type.encode()))
+        headers.append((b"content-length", str(variant.size).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else variant.body})